@@ -0,0 +1,119 @@
+"""Item-vector indexes for cosine retrieval over unit-normalized embeddings.
+
+Both indexes expose the same `search(query, k, exclude=None)` call so the
+recommender does not care which one it holds:
+
+- ExactIndex scores the query against every item (brute force).
+- IVFIndex clusters items with spherical k-means and only scores the
+  items in the `n_probe` clusters closest to the query. Raising n_probe
+  trades latency for recall; n_probe == n_lists is exact search.
+"""
+import numpy as np
+from ranking import top_k
+
+DEFAULT_N_PROBE = 8
+
+
+class ExactIndex:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def search(self, query, k, exclude=None):
+        """Return (indices, scores) of the k items most similar to query, best first."""
+        scores = self.vectors @ query
+        idx = top_k(scores, k, exclude=exclude)
+        return idx, scores[idx]
+
+
+class IVFIndex:
+    def __init__(self, vectors, centroids, list_offsets, list_items, n_probe=DEFAULT_N_PROBE):
+        self.vectors = vectors
+        self.centroids = centroids
+        # Inverted lists in CSR layout: items of list i are
+        # list_items[list_offsets[i]:list_offsets[i + 1]]
+        self.list_offsets = list_offsets
+        self.list_items = list_items
+        self.n_probe = n_probe
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_iter=20, seed=42, n_probe=DEFAULT_N_PROBE):
+        """Cluster unit-normalized vectors into n_lists inverted lists.
+
+        n_lists defaults to about sqrt(n_items), a common IVF starting point.
+        """
+        n_items = len(vectors)
+        if n_lists is None:
+            n_lists = int(np.sqrt(n_items))
+        n_lists = max(1, min(n_lists, n_items))
+
+        centroids, assignment = spherical_kmeans(vectors, n_lists, n_iter=n_iter, seed=seed)
+        order = np.argsort(assignment, kind='stable').astype(np.int32)
+        counts = np.bincount(assignment, minlength=n_lists)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(counts, out=list_offsets[1:])
+        return cls(vectors, centroids, list_offsets, order, n_probe=n_probe)
+
+    def search(self, query, k, exclude=None, n_probe=None):
+        """Return (indices, scores) of the k best items among the probed lists."""
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        probe = top_k(self.centroids @ query, n_probe)
+        candidates = np.concatenate([
+            self.list_items[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probe
+        ])
+        scores = self.vectors[candidates] @ query
+        best = top_k(scores, k, exclude=exclude[candidates] if exclude is not None else None)
+        return candidates[best], scores[best]
+
+    def to_arrays(self, prefix='ivf_'):
+        """Arrays to persist in the model artifact (vectors are stored separately)."""
+        return {
+            f'{prefix}centroids': self.centroids,
+            f'{prefix}list_offsets': self.list_offsets,
+            f'{prefix}list_items': self.list_items
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, vectors, prefix='ivf_', n_probe=DEFAULT_N_PROBE):
+        list_items = arrays[f'{prefix}list_items']
+        if len(list_items) != len(vectors):
+            raise ValueError(f"index covers {len(list_items)} items but the model has {len(vectors)}")
+        return cls(vectors, arrays[f'{prefix}centroids'], arrays[f'{prefix}list_offsets'], list_items, n_probe=n_probe)
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=20, seed=42):
+    """K-means on the unit sphere (cosine distance). Returns (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    assignment = np.full(len(vectors), -1, dtype=np.int64)
+
+    for _ in range(n_iter):
+        new_assignment = _assign(vectors, centroids)
+        if np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+
+        sums = np.stack([
+            np.bincount(assignment, weights=vectors[:, d], minlength=n_clusters)
+            for d in range(vectors.shape[1])
+        ], axis=1)
+        norms = np.linalg.norm(sums, axis=1)
+        empty = norms == 0
+        # Re-seed empty clusters from random items so every list stays usable
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        norms[empty] = 1
+        centroids = (sums / norms[:, None]).astype(vectors.dtype)
+
+    return centroids, _assign(vectors, centroids)
+
+
+def _assign(vectors, centroids, chunk_size=65536):
+    # Nearest centroid per item, chunked so the similarity block stays bounded
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        block = vectors[start:start + chunk_size] @ centroids.T
+        assignment[start:start + chunk_size] = np.argmax(block, axis=1)
+    return assignment
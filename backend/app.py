@@ -51,6 +51,14 @@ def create_app():
     # ✅ CREATE TABLES AUTOMATICALLY
     with app.app_context():
         db.create_all()
+        from models import ensure_indexes
+        ensure_indexes()
+        from movie_stats import ensure_movie_stats
+        from catalog_index import ensure_movie_terms
+        from search_index import ensure_search_indexes
+        ensure_movie_stats()
+        ensure_movie_terms()
+        ensure_search_indexes()
 
     # Ensure DB session is properly closed after each request
     @app.teardown_appcontext
@@ -71,10 +79,43 @@ def create_app():
         recommender.load_model()
     except Exception as e:
         print(f"Warning: Failed to load recommender model: {e}")
+    # Under gunicorn with preload_app, threads are started per worker after
+    # the fork instead (gunicorn.conf.py post_fork)
+    if os.environ.get('GUNICORN_PRELOAD') != '1':
+        start_background_threads()
 
     return app
 
 
+def start_background_threads():
+    """Threads every serving process runs. Threads do not survive a fork
+    (and a lock one holds at fork time stays locked in the child), so a
+    preloading master must not start them."""
+    from recommender import recommender
+    # Picks up newly published model versions without a restart
+    recommender.start_watcher()
+
+
+def warm_up(app):
+    """Build the lazily built in-process indexes now, so a preloading
+    master forks workers that share them instead of each building its own
+    on its first requests."""
+    from catalog_index import catalog_index
+    from search_index import search_index
+    from popularity import popularity
+    with app.app_context():
+        steps = [
+            ('catalog index', catalog_index.get),
+            ('search index', lambda: search_index.search('a', 1)),
+            ('popularity', lambda: popularity.top(1)),
+        ]
+        for name, build in steps:
+            try:
+                build()
+            except Exception as e:
+                print(f"Warning: failed to warm up {name}: {e}")
+
+
 
 app = create_app()
 
@@ -0,0 +1,173 @@
+"""On-disk model artifact: a directory of .npy arrays plus a JSON manifest.
+
+    model/
+        manifest.json       format version, scalars, and dtype/shape per array
+        user_ids.npy        ...one file per array
+
+Arrays are opened with np.load(mmap_mode='r'), so every gunicorn worker
+maps the same pages from the OS page cache instead of unpickling its own
+private copy, and loading does not depend on pickle at all.
+
+Versioned artifacts (publish_artifact) keep each version in its own
+directory and name the active one in a CURRENT file, replaced atomically:
+
+    model/
+        CURRENT             "20261017-093000-1234"
+        20261017-093000-1234/manifest.json, *.npy
+        20261016-180000-987/...
+
+load_artifact() follows CURRENT, so readers pick up the newest version
+the next time they load, while processes that still map an older
+version keep working until they switch.
+"""
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+CURRENT = 'CURRENT'
+# Versions kept on disk by publish_artifact, the active one included
+KEEP_VERSIONS = 3
+
+
+class ArtifactError(Exception):
+    pass
+
+
+@contextmanager
+def artifact_lock(path):
+    """Exclusive lock on the artifact at path, shared by every process
+    (an flock on the sibling file path.lock)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def save_artifact(path, arrays, lock=True, **meta):
+    """Write arrays (name -> ndarray) and scalar metadata to the artifact at path.
+
+    The artifact is written to a temporary sibling directory first and then
+    renamed into place under artifact_lock(path), so readers never see a
+    half-written model and concurrent writers do not swap over each other.
+    Pass lock=False when the caller already holds artifact_lock(path).
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'created_at': time.time(),
+        'meta': meta,
+        'arrays': {}
+    }
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        filename = f"{name}.npy"
+        np.save(os.path.join(tmp_path, filename), array, allow_pickle=False)
+        manifest['arrays'][name] = {
+            'file': filename,
+            'dtype': array.dtype.str,
+            'shape': list(array.shape)
+        }
+    with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if lock:
+        with artifact_lock(path):
+            _swap(tmp_path, path)
+    else:
+        _swap(tmp_path, path)
+
+
+def _swap(tmp_path, path):
+    # Two renames, not one: a directory cannot replace a non-empty one
+    old_path = f"{tmp_path}.old"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def publish_artifact(root, arrays, keep=KEEP_VERSIONS, **meta):
+    """Write arrays as a new version under root and make it the current one.
+
+    The version directory is complete before root/CURRENT is swapped to
+    name it, and versions beyond the newest `keep` are removed afterwards.
+    Returns the version name.
+    """
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    os.makedirs(root, exist_ok=True)
+    save_artifact(os.path.join(root, version), arrays, lock=False, **meta)
+
+    tmp_path = os.path.join(root, f"{CURRENT}.tmp-{os.getpid()}")
+    with open(tmp_path, 'w') as f:
+        f.write(version + '\n')
+    os.replace(tmp_path, os.path.join(root, CURRENT))
+
+    # An unversioned artifact written to root before is superseded now
+    legacy_manifest = os.path.join(root, MANIFEST)
+    if os.path.isfile(legacy_manifest):
+        with open(legacy_manifest) as f:
+            legacy_files = [spec['file'] for spec in json.load(f)['arrays'].values()]
+        for filename in legacy_files + [MANIFEST]:
+            os.remove(os.path.join(root, filename))
+
+    versions = sorted(name for name in os.listdir(root)
+                      if os.path.isfile(os.path.join(root, name, MANIFEST)))
+    for old_version in versions[:-keep] if keep else []:
+        if old_version != version:
+            shutil.rmtree(os.path.join(root, old_version), ignore_errors=True)
+    return version
+
+
+def current_version(root):
+    """Version named in root/CURRENT, or None for an unversioned artifact."""
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_artifact(root):
+    """Directory holding the current version of the artifact at root."""
+    version = current_version(root)
+    return os.path.join(root, version) if version else root
+
+
+def load_artifact(path, mmap_mode='r'):
+    """Open the artifact at path (its current version, if versioned).
+
+    Returns (manifest, arrays) with arrays memory-mapped; manifest['version']
+    is the version opened, None for an unversioned artifact.
+    """
+    version = current_version(path)
+    if version:
+        path = os.path.join(path, version)
+    manifest_path = os.path.join(path, MANIFEST)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['version'] = version
+
+    version = manifest.get('format_version')
+    if version != FORMAT_VERSION:
+        raise ArtifactError(f"{manifest_path}: unsupported format version {version} (expected {FORMAT_VERSION})")
+
+    arrays = {}
+    for name, spec in manifest['arrays'].items():
+        array = np.load(os.path.join(path, spec['file']), mmap_mode=mmap_mode, allow_pickle=False)
+        if array.dtype.str != spec['dtype'] or list(array.shape) != spec['shape']:
+            raise ArtifactError(f"{path}/{spec['file']}: does not match manifest")
+        arrays[name] = array
+    return manifest, arrays
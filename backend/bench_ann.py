@@ -0,0 +1,74 @@
+"""Offline recall@k / latency benchmark of the IVF index against exact search.
+
+Runs against the item vectors of a trained model (--model) or a synthetic
+clustered catalog, and prints one row per n_probe setting so ANN_NPROBE
+can be chosen from measured numbers.
+
+Usage:
+    python bench_ann.py --items 85000 --dim 20
+    python bench_ann.py --model model
+"""
+import argparse
+import time
+import numpy as np
+from ann import ExactIndex, IVFIndex
+from artifact import load_artifact
+from ranking import normalize_rows
+
+
+def synthetic_vectors(n_items, dim, n_clusters=200, seed=42):
+    # Items scattered around random topic directions, like SVD item factors
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    labels = rng.integers(0, n_clusters, n_items)
+    return normalize_rows(centers[labels] + rng.normal(scale=0.7, size=(n_items, dim)))
+
+
+def model_vectors(path):
+    _, arrays = load_artifact(path, mmap_mode=None)
+    return arrays['item_vectors']
+
+
+def run_queries(index, queries, k, **kwargs):
+    results = []
+    start = time.perf_counter()
+    for q in queries:
+        results.append(index.search(q, k, **kwargs)[0])
+    elapsed = time.perf_counter() - start
+    return results, elapsed / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', help='model artifact directory to take item vectors from')
+    parser.add_argument('--items', type=int, default=85_000)
+    parser.add_argument('--dim', type=int, default=20)
+    parser.add_argument('--lists', type=int, default=None, help='IVF lists (default: sqrt(items))')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--probes', default='1,2,4,8,16,32,64')
+    args = parser.parse_args()
+
+    vectors = model_vectors(args.model) if args.model else synthetic_vectors(args.items, args.dim)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(vectors, n_lists=args.lists)
+    print(f"{len(vectors)} items x {vectors.shape[1]} dims, {ivf.n_lists} lists "
+          f"(built in {time.perf_counter() - start:.1f}s)\n")
+
+    exact, exact_ms = run_queries(ExactIndex(vectors), queries, args.k)
+    print(f"{'n_probe':>8} {'recall@' + str(args.k):>10} {'ms/query':>9} {'speedup':>8}")
+    print(f"{'exact':>8} {1.0:>10.3f} {exact_ms:>9.3f} {1.0:>7.1f}x")
+
+    for n_probe in [int(p) for p in args.probes.split(',')]:
+        if n_probe > ivf.n_lists:
+            break
+        approx, ms = run_queries(ivf, queries, args.k, n_probe=n_probe)
+        recall = np.mean([len(np.intersect1d(a, e)) / len(e) for a, e in zip(approx, exact)])
+        print(f"{n_probe:>8} {recall:>10.3f} {ms:>9.3f} {exact_ms / ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
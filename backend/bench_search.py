@@ -0,0 +1,107 @@
+"""Latency benchmark of /api/search matching, grouped by query length.
+
+Queries are prefixes (as typed into the search box) of random titles, with
+a share of them given a one-letter typo. Prints p50 / p99 per query length
+for the in-memory TitleIndex and, with --db, for the legacy
+ilike('%q%') query against DATABASE_URL (and the pg_trgm query on Postgres).
+
+Usage:
+    python bench_search.py --titles 85000
+    python bench_search.py --db
+"""
+import argparse
+import time
+import numpy as np
+from search_index import TitleIndex, search_postgres
+
+WORDS = ('star', 'wars', 'love', 'night', 'dark', 'return', 'king', 'man', 'city', 'ghost',
+         'dream', 'blue', 'the', 'of', 'story', 'house', 'last', 'girl', 'day', 'life')
+
+
+def synthetic_titles(n_titles, seed=42):
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS + tuple(f"{a}{b}" for a in 'bcdfgklmnprst' for b in ('ane', 'ora', 'ix', 'elle')))
+    titles = []
+    for i in range(n_titles):
+        n_words = rng.integers(1, 5)
+        name = ' '.join(w.capitalize() for w in rng.choice(words, n_words))
+        titles.append(f"{name} {i} ({rng.integers(1930, 2024)})")
+    return np.arange(1, n_titles + 1), titles
+
+
+def make_queries(titles, lengths, per_length, typo_share, seed=0):
+    rng = np.random.default_rng(seed)
+    queries = {}
+    for length in lengths:
+        picked = []
+        for i in rng.choice(len(titles), per_length * 3):
+            prefix = titles[i][:length]
+            if len(prefix) < length:
+                continue
+            if length >= 4 and rng.random() < typo_share:
+                j = int(rng.integers(1, length))
+                prefix = prefix[:j] + 'xqz'[j % 3] + prefix[j + 1:]
+            picked.append(prefix)
+            if len(picked) == per_length:
+                break
+        queries[length] = picked
+    return queries
+
+
+def measure(fn, queries):
+    timings = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.percentile(timings, 50), np.percentile(timings, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', action='store_true', help='index the titles in DATABASE_URL and compare with SQL')
+    parser.add_argument('--titles', type=int, default=85_000, help='synthetic catalog size (without --db)')
+    parser.add_argument('--lengths', default='2,3,4,6,8,12')
+    parser.add_argument('--queries', type=int, default=300, help='queries per length')
+    parser.add_argument('--typos', type=float, default=0.2, help='share of queries with a typo')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.db:
+        from app import create_app
+        from models import Movie, db
+        create_app().app_context().push()
+        rows = db.session.query(Movie.id, Movie.title).order_by(Movie.id).all()
+        movie_ids, titles = [r[0] for r in rows], [r[1] for r in rows]
+    else:
+        movie_ids, titles = synthetic_titles(args.titles)
+
+    start = time.perf_counter()
+    index = TitleIndex(movie_ids, titles)
+    print(f"{len(index)} titles, {len(index.trigram_ids)} trigrams "
+          f"(built in {time.perf_counter() - start:.2f}s)\n")
+
+    lengths = [int(n) for n in args.lengths.split(',')]
+    queries = make_queries(titles, lengths, args.queries, args.typos)
+    popularity_scores = np.random.default_rng(1).pareto(1.5, len(index))
+
+    backends = [('memory', lambda q: index.search(q, args.limit, popularity_scores=popularity_scores))]
+    if args.db:
+        def ilike(q):
+            Movie.query.filter(Movie.title.ilike(f'%{q}%')).limit(args.limit).all()
+        backends.append(('ilike', ilike))
+        if db.engine.dialect.name == 'postgresql':
+            backends.append(('pg_trgm', lambda q: search_postgres(q, args.limit)))
+
+    header = f"{'length':>6}" + ''.join(f" {name + ' p50':>13} {name + ' p99':>13}" for name, _ in backends)
+    print(header + "   (ms)")
+    for length in lengths:
+        line = f"{length:>6}"
+        for name, fn in backends:
+            p50, p99 = measure(fn, queries[length])
+            line += f" {p50:>13.3f} {p99:>13.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""Ranking quality and serving cost of the recommender on synthetic catalogs.
+
+For each catalog size a fresh SQLite database is generated from a known
+low-rank taste model (users and movies get latent vectors around genre
+centroids, movie exposure follows a long-tailed popularity curve), loaded
+with load_data.py, trained with train_model.py and precomputed with
+precompute_recs.py, all in a temporary directory and without TMDB. Then
+each recommender method is measured on held-out ground truth:
+- get_recommendations: returning users, 20% of each user's ratings held
+  out before training; relevant = held-out ratings >= 4
+- get_cold_start_recommendations: users outside the model who rated
+  COLD_RATINGS movies after training; relevant = their other ratings >= 4
+- get_similar_movies: relevant = the movie's nearest neighbors by the
+  true latent vectors
+
+Quality: precision@k, recall@k, NDCG@k (binary relevance) and catalog
+coverage (share of movies that appear in any returned list). Cost, per
+call, after one warm-up pass: p50/p95/p99 latency, throughput of one
+thread calling in a loop, and peak traced allocations (tracemalloc, in
+a separate pass so it does not slow the timed one).
+
+Each catalog runs in its own process (the app binds DATABASE_URL at
+import). A performance change should move cost without losing quality;
+compare reports from before and after with the same --seed.
+
+Usage:
+    python bench_suite.py --catalogs 500:2000 2000:10000 --k 10
+    python bench_suite.py --catalogs 5000:50000 --no-precompute --out bench_report.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+
+GENRES = ('Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary', 'Drama',
+          'Fantasy', 'Film-Noir', 'Horror', 'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller',
+          'War', 'Western')
+WORDS = ('star', 'wars', 'love', 'night', 'dark', 'return', 'king', 'man', 'city', 'ghost',
+         'dream', 'blue', 'story', 'house', 'last', 'girl', 'day', 'life')
+LATENT_DIM = 16
+HOLDOUT_SHARE = 0.2
+COLD_SHARE = 0.1
+COLD_RATINGS = 5
+RELEVANT_RATING = 4.0
+# Ground-truth neighbors per movie for get_similar_movies
+TRUE_NEIGHBORS = 20
+# Movies need this many training ratings to be used as similarity queries
+SIMILAR_MIN_RATINGS = 10
+
+
+def synthetic_catalog(n_users, n_movies, ratings_per_user, seed):
+    """Movies, ratings and the true item vectors of a generated catalog."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(len(GENRES), LATENT_DIM))
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+
+    genre = rng.integers(len(GENRES), size=n_movies)
+    second = rng.integers(len(GENRES), size=n_movies)
+    item_vecs = centroids[genre] + 0.6 * rng.normal(size=(n_movies, LATENT_DIM)) / np.sqrt(LATENT_DIM)
+    item_bias = 0.3 * rng.normal(size=n_movies)
+    words = np.array(WORDS)
+    movies = pd.DataFrame({
+        'movieId': np.arange(1, n_movies + 1),
+        'title': [f"{' '.join(w.capitalize() for w in rng.choice(words, rng.integers(1, 4)))} {i} "
+                  f"({rng.integers(1930, 2024)})" for i in range(1, n_movies + 1)],
+        'genres': [GENRES[g] if g == s else f"{GENRES[g]}|{GENRES[s]}" for g, s in zip(genre, second)],
+    })
+
+    # Long-tailed exposure: a few movies are seen by most users
+    popularity = 1.0 / (rng.permutation(n_movies) + 10.0) ** 0.9
+    cdf = np.cumsum(popularity / popularity.sum())
+    user_vecs = centroids[rng.integers(len(GENRES), size=n_users)] + \
+        0.6 * rng.normal(size=(n_users, LATENT_DIM)) / np.sqrt(LATENT_DIM)
+    counts = np.clip(rng.lognormal(np.log(ratings_per_user), 0.7, size=n_users), 5, n_movies // 2).astype(int)
+
+    user_col, movie_col, affinity = [], [], []
+    for uid in range(n_users):
+        # Exposure by popularity, then the user rates what suits their taste
+        candidates = np.unique(np.searchsorted(cdf, rng.random(4 * counts[uid])))
+        scores = item_vecs[candidates] @ user_vecs[uid]
+        picked = candidates[np.argsort(-(scores + rng.gumbel(scale=0.3, size=len(candidates))))[:counts[uid]]]
+        user_col.append(np.full(len(picked), uid + 1))
+        movie_col.append(picked)
+        affinity.append(item_vecs[picked] @ user_vecs[uid] + item_bias[picked])
+    affinity = np.concatenate(affinity)
+    z = (affinity - affinity.mean()) / affinity.std()
+    stars = np.clip(np.round(2 * (3.5 + z + 0.5 * rng.normal(size=len(z)))) / 2, 0.5, 5.0)
+    ratings = pd.DataFrame({
+        'userId': np.concatenate(user_col),
+        'movieId': np.concatenate(movie_col) + 1,
+        'rating': stars,
+        'timestamp': int(time.time()) - rng.integers(86400, 86400 * 3000, size=len(z)),
+    })
+    return movies, ratings, item_vecs
+
+
+def split_ratings(ratings, n_users, seed):
+    """(train, held-out, cold given) ratings. Cold users are the last
+    COLD_SHARE of user ids; they rate COLD_RATINGS movies after training."""
+    rng = np.random.default_rng(seed + 1)
+    n_cold = int(n_users * COLD_SHARE)
+    cold = ratings['userId'] > n_users - n_cold
+    # Random rank of each rating within its user
+    order = ratings.assign(r=rng.random(len(ratings))).groupby('userId')['r'].rank(method='first')
+    size = ratings.groupby('userId')['userId'].transform('size')
+    holdout = ~cold & (order <= (size * HOLDOUT_SHARE).round())
+    given = cold & (order <= COLD_RATINGS)
+    return ratings[~cold & ~holdout], ratings[holdout | (cold & ~given)], ratings[given]
+
+
+def true_neighbors(item_vecs, query_ids, movie_ids):
+    """Top TRUE_NEIGHBORS ids among movie_ids by latent cosine, per query id."""
+    vecs = item_vecs[movie_ids - 1]
+    vecs = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+    neighbors = {}
+    for mid in query_ids:
+        sims = vecs @ vecs[np.searchsorted(movie_ids, mid)]
+        sims[movie_ids == mid] = -np.inf
+        top = np.argpartition(-sims, TRUE_NEIGHBORS)[:TRUE_NEIGHBORS]
+        neighbors[mid] = set(movie_ids[top].tolist())
+    return neighbors
+
+
+def ranking_metrics(recommended, relevant, k):
+    """precision@k, recall@k and NDCG@k of one list (binary relevance)."""
+    hits = [1.0 if mid in relevant else 0.0 for mid in recommended[:k]]
+    dcg = sum(h / np.log2(i + 2) for i, h in enumerate(hits))
+    idcg = sum(1.0 / np.log2(i + 2) for i in range(min(len(relevant), k)))
+    return sum(hits) / k, sum(hits) / len(relevant), dcg / idcg if idcg else 0.0
+
+
+def measure_method(call, queries, relevant, k, n_movies, repeat):
+    """Quality over the queries, then latency and peak allocations."""
+    scores, shown = [], set()
+    for q in queries:
+        movies = [m['movie_id'] for m in call(q, k)]
+        shown.update(movies)
+        scores.append(ranking_metrics(movies, relevant[q], k))
+
+    timings = []
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            call(q, k)
+            timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    peak = 0
+    for q in queries:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        call(q, k)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    scores = np.array(scores)
+    timings_ms = np.array(timings) * 1000
+    return {
+        'queries': len(queries),
+        f"precision@{k}": float(scores[:, 0].mean()),
+        f"recall@{k}": float(scores[:, 1].mean()),
+        f"ndcg@{k}": float(scores[:, 2].mean()),
+        'coverage': len(shown) / n_movies,
+        'p50_ms': float(np.percentile(timings_ms, 50)),
+        'p95_ms': float(np.percentile(timings_ms, 95)),
+        'p99_ms': float(np.percentile(timings_ms, 99)),
+        'throughput_qps': len(timings) / (timings_ms.sum() / 1000),
+        'peak_alloc_mb': peak / 2**20,
+    }
+
+
+def run_catalog(config, workdir, result_path):
+    """Build one catalog in workdir and benchmark it (runs in a child process)."""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['MODEL_WATCH_SECONDS'] = '0'
+    os.environ.pop('TMDB_API_KEY', None)
+    os.chdir(workdir)
+    # This process was spawned; give precompute_recs.py's pool the
+    # platform's default start method again, as in a normal run
+    multiprocessing.set_start_method(None, force=True)
+    n_users, n_movies, k = config['users'], config['movies'], config['k']
+    rng = np.random.default_rng(config['seed'])
+
+    build_start = time.perf_counter()
+    movies, ratings, item_vecs = synthetic_catalog(n_users, n_movies, config['ratings_per_user'], config['seed'])
+    train, heldout, cold_given = split_ratings(ratings, n_users, config['seed'])
+    data_dir = os.path.join(workdir, 'data')
+    os.makedirs(data_dir)
+    movies.to_csv(os.path.join(data_dir, 'movies.csv'), index=False)
+    pd.DataFrame({'movieId': movies['movieId'], 'imdbId': '', 'tmdbId': ''}).to_csv(
+        os.path.join(data_dir, 'links.csv'), index=False)
+    train.to_csv(os.path.join(data_dir, 'ratings.csv'), index=False)
+
+    log = sys.stdout if config['verbose'] else open(os.path.join(workdir, 'build.log'), 'w')
+    with redirect_stdout(log):
+        from load_data import load_data, insert_rows
+        from train_model import train_and_evaluate
+        from precompute_recs import precompute
+        from app import app
+        from models import Rating, db
+        from movie_stats import rebuild_movie_stats
+        from recommender import recommender
+
+        load_data(data_dir=data_dir)
+        train_and_evaluate()
+        if config['precompute']:
+            precompute()
+        tracemalloc.stop()
+        with app.app_context():
+            # Cold users rate after the model was trained
+            cold_ids = sorted(cold_given['userId'].unique().tolist())
+            insert_rows('users', ['id', 'username', 'liked_movies', 'watch_history'], pd.DataFrame({
+                'id': cold_ids, 'username': [f"user{uid}" for uid in cold_ids],
+                'liked_movies': '[]', 'watch_history': '[]'
+            }))
+            insert_rows(Rating.__tablename__, ['user_id', 'movie_id', 'rating', 'timestamp'],
+                        cold_given.assign(timestamp=int(time.time()) + 1)[
+                            ['userId', 'movieId', 'rating', 'timestamp']])
+            db.session.commit()
+            rebuild_movie_stats()
+        recommender.load_model()
+    build_seconds = time.perf_counter() - build_start
+
+    relevant = heldout[heldout['rating'] >= RELEVANT_RATING].groupby('userId')['movieId'].agg(set).to_dict()
+    cold_set = set(cold_ids)
+    warm = [uid for uid in relevant if uid not in cold_set]
+    cold = [uid for uid in relevant if uid in cold_set]
+    train_counts = train['movieId'].value_counts()
+
+    def sample(ids):
+        ids = np.asarray(ids)
+        return [int(x) for x in rng.choice(ids, size=min(config['queries'], len(ids)), replace=False)]
+
+    similar = sample(train_counts.index[train_counts >= SIMILAR_MIN_RATINGS])
+    neighbors = true_neighbors(item_vecs, similar, np.sort(train_counts.index.to_numpy()))
+
+    methods = [
+        ('get_recommendations', lambda uid, n: recommender.get_recommendations(uid, n=n)['movies'],
+         sample(warm), relevant),
+        ('get_cold_start_recommendations', lambda uid, n: recommender.get_cold_start_recommendations(uid, n=n),
+         sample(cold), relevant),
+        ('get_similar_movies', lambda mid, n: recommender.get_similar_movies(mid, n=n),
+         similar, neighbors),
+    ]
+    results = {}
+    with app.app_context():
+        for name, call, queries, truth in methods:
+            if not queries:
+                print(f"  {name}: no queries with ground truth, skipped")
+                continue
+            results[name] = measure_method(call, queries, truth, k, n_movies, config['repeat'])
+            db.session.remove()
+
+    report = dict(config, n_ratings=len(ratings), n_train_ratings=len(train),
+                  build_seconds=round(build_seconds, 2),
+                  max_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  model=recommender.info(), methods=results)
+    with open(result_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+
+
+def print_report(report):
+    k = report['k']
+    print(f"\n{report['users']} users x {report['movies']} movies, {report['n_ratings']} ratings "
+          f"(built in {report['build_seconds']}s, max RSS {report['max_rss_mb']:.0f} MB, "
+          f"precomputed recs: {'yes' if report['precompute'] else 'no'})")
+    print(f"{'method':<32} {'P@' + str(k):>6} {'R@' + str(k):>6} {'NDCG':>6} {'cover':>6} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'qps':>8} {'peak MB':>8}")
+    for name, m in report['methods'].items():
+        print(f"{name:<32} {m[f'precision@{k}']:>6.3f} {m[f'recall@{k}']:>6.3f} {m[f'ndcg@{k}']:>6.3f} "
+              f"{m['coverage']:>6.3f} {m['p50_ms']:>7.2f} {m['p95_ms']:>7.2f} {m['p99_ms']:>7.2f} "
+              f"{m['throughput_qps']:>8.0f} {m['peak_alloc_mb']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--catalogs', nargs='+', default=['500:2000', '2000:10000'],
+                        help='catalog sizes as users:movies')
+    parser.add_argument('--ratings-per-user', type=int, default=50, help='median ratings per user')
+    parser.add_argument('--k', type=int, default=10, help='list length scored')
+    parser.add_argument('--queries', type=int, default=300, help='queries per method')
+    parser.add_argument('--repeat', type=int, default=3, help='timed passes over the queries')
+    parser.add_argument('--no-precompute', dest='precompute', action='store_false',
+                        help='skip precompute_recs.py, so returning users are scored live')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default='bench_report.json')
+    parser.add_argument('--keep', action='store_true', help='keep the generated catalogs')
+    parser.add_argument('--verbose', action='store_true', help='show load/train output')
+    args = parser.parse_args()
+
+    # A fresh interpreter per catalog: the app reads DATABASE_URL once at import
+    ctx = multiprocessing.get_context('spawn')
+    reports = []
+    for catalog in args.catalogs:
+        users, movies = (int(x) for x in catalog.split(':'))
+        config = {'users': users, 'movies': movies, 'ratings_per_user': args.ratings_per_user, 'k': args.k,
+                  'queries': args.queries, 'repeat': args.repeat, 'precompute': args.precompute,
+                  'seed': args.seed, 'verbose': args.verbose}
+        workdir = tempfile.mkdtemp(prefix=f"bench-{users}x{movies}-")
+        result_path = os.path.join(workdir, 'result.json')
+        print(f"Building and measuring {users} users x {movies} movies in {workdir}...")
+        child = ctx.Process(target=run_catalog, args=(config, workdir, result_path))
+        child.start()
+        child.join()
+        if child.exitcode != 0:
+            # Left in place to look at
+            print(f"Catalog {catalog} failed (exit code {child.exitcode}), see {workdir}/build.log")
+            continue
+        with open(result_path) as f:
+            report = json.load(f)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        reports.append(report)
+        print_report(report)
+
+    with open(args.out, 'w') as f:
+        json.dump({'created_at': int(time.time()), 'catalogs': reports}, f, indent=2)
+    print(f"\nReport written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
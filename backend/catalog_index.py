@@ -0,0 +1,206 @@
+"""Genre / actor / year index over the movie catalog.
+
+movie_genres and movie_actors hold one row per (movie, term), derived from
+the Movie.genres and Movie.actors columns. They are rebuilt by load_data.py
+and updated by any writer that changes a movie's genres, actors or release
+year (sync_movie_terms), which also bumps the 'catalog' cache version.
+
+Each process keeps an in-memory CatalogIndex built from those tables:
+- genres: a boolean bitmap over movie positions per genre (few genres,
+  many movies each), so AND-ing several genres is a vectorized &
+- actors: a sorted posting list of movie positions per actor (many actors,
+  few movies each)
+- release years as an int32 array for range filters
+The index is rebuilt when the catalog version moves, checked at most every
+CATALOG_CHECK_SECONDS.
+"""
+import os
+import time
+import threading
+import numpy as np
+from sqlalchemy import delete, insert
+from idmap import IdIndex
+from models import Movie, MovieActor, MovieGenre, db
+from movie_cache import bump_cache_version, read_cache_version
+
+CATALOG_VERSION_KEY = 'catalog'
+NO_YEAR = -1
+TOP_ACTORS = 100
+
+
+def split_genres(genres):
+    """Genre names from the pipe-separated Movie.genres string."""
+    if not genres or genres == '(no genres listed)':
+        return []
+    return list(dict.fromkeys(g.strip() for g in genres.split('|') if g.strip()))
+
+
+def _term_rows(movie_id, genres, actors):
+    genre_rows = [{'movie_id': movie_id, 'genre': g} for g in split_genres(genres)]
+    actor_rows = [{'movie_id': movie_id, 'actor': a} for a in dict.fromkeys(actors or []) if a]
+    return genre_rows, actor_rows
+
+
+def rebuild_movie_terms():
+    """Rebuild movie_genres and movie_actors from every movie row."""
+    genre_rows, actor_rows = [], []
+    for movie_id, genres, actors in db.session.query(Movie.id, Movie.genres, Movie.actors):
+        g, a = _term_rows(movie_id, genres, actors)
+        genre_rows.extend(g)
+        actor_rows.extend(a)
+
+    db.session.execute(delete(MovieGenre))
+    db.session.execute(delete(MovieActor))
+    if genre_rows:
+        db.session.execute(insert(MovieGenre), genre_rows)
+    if actor_rows:
+        db.session.execute(insert(MovieActor), actor_rows)
+    bump_cache_version(CATALOG_VERSION_KEY)
+    db.session.commit()
+
+
+def ensure_movie_terms():
+    """Backfill the association tables for databases seeded before they existed."""
+    if MovieGenre.query.first() is None and Movie.query.first() is not None:
+        print("Building movie_genres / movie_actors from movies...")
+        rebuild_movie_terms()
+
+
+def sync_movie_terms(movies):
+    """Re-derive the association rows of the given (modified) movies. Call
+    inside the writer's session before it commits."""
+    movie_ids = [m.id for m in movies]
+    if not movie_ids:
+        return
+    genre_rows, actor_rows = [], []
+    for m in movies:
+        g, a = _term_rows(m.id, m.genres, m.actors)
+        genre_rows.extend(g)
+        actor_rows.extend(a)
+
+    db.session.execute(delete(MovieGenre).where(MovieGenre.movie_id.in_(movie_ids)))
+    db.session.execute(delete(MovieActor).where(MovieActor.movie_id.in_(movie_ids)))
+    if genre_rows:
+        db.session.execute(insert(MovieGenre), genre_rows)
+    if actor_rows:
+        db.session.execute(insert(MovieActor), actor_rows)
+    bump_cache_version(CATALOG_VERSION_KEY)
+
+
+class TermIndex:
+    """Immutable snapshot of the catalog index; CatalogIndex swaps in a new one on refresh."""
+
+    def __init__(self, movie_ids, years, genre_rows, actor_rows):
+        self.movie_ids = movie_ids
+        self.movie_index = IdIndex(movie_ids)
+        self.years = years
+        n_movies = len(movie_ids)
+
+        # Genres: one bitmap per lowercased genre name
+        self.genres = {}
+        for movie_id, genre in genre_rows:
+            pos = self.movie_index.get(movie_id)
+            if pos is None:
+                continue
+            bitmap = self.genres.get(genre.lower())
+            if bitmap is None:
+                bitmap = self.genres[genre.lower()] = np.zeros(n_movies, dtype=bool)
+            bitmap[pos] = True
+
+        # Actors: posting lists of movie positions, grouped with one argsort
+        self.actors = {}
+        if actor_rows:
+            names = np.array([actor for _, actor in actor_rows], dtype=object)
+            positions = self.movie_index.lookup([movie_id for movie_id, _ in actor_rows])
+            known = positions >= 0
+            names, positions = names[known], positions[known]
+            order = np.lexsort((positions, names))
+            names, positions = names[order], positions[order].astype(np.int32)
+            starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]]) if len(names) else []
+            bounds = list(starts) + [len(names)]
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                self.actors[names[start]] = positions[start:stop]
+        self.actor_names = list(self.actors)
+        self.actor_names_lower = [name.lower() for name in self.actor_names]
+
+        # Most frequent actors, ties broken by their first movie
+        self.top_actors = sorted(
+            self.actors.items(), key=lambda item: (-len(item[1]), int(item[1][0]))
+        )[:TOP_ACTORS]
+
+    def _actor_mask(self, names):
+        mask = np.zeros(len(self.movie_ids), dtype=bool)
+        for name in names:
+            mask[self.actors[name]] = True
+        return mask
+
+    def filter(self, genres=None, year_min=None, year_max=None, actor=None):
+        """Sorted ids of movies matching every given condition: all of
+        genres (exact, case-insensitive), release year range, and an actor
+        whose name contains the actor substring (case-insensitive)."""
+        mask = np.ones(len(self.movie_ids), dtype=bool)
+        for genre in genres or []:
+            bitmap = self.genres.get(genre.lower())
+            if bitmap is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= bitmap
+        if year_min is not None:
+            mask &= self.years >= year_min
+        if year_max is not None:
+            mask &= (self.years <= year_max) & (self.years != NO_YEAR)
+        if actor:
+            needle = actor.lower()
+            mask &= self._actor_mask(
+                [name for name, lower in zip(self.actor_names, self.actor_names_lower) if needle in lower]
+            )
+        return self.movie_ids[mask]
+
+    def movies_by_actor(self, name):
+        """Sorted ids of the movies an actor (exact name) appears in."""
+        positions = self.actors.get(name)
+        if positions is None:
+            return np.empty(0, dtype=np.int64)
+        return self.movie_ids[positions]
+
+
+class CatalogIndex:
+    def __init__(self, check_interval=None):
+        self.check_interval = check_interval if check_interval is not None else \
+            float(os.environ.get('CATALOG_CHECK_SECONDS', 5))
+        self._index = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Current TermIndex, rebuilt first if the catalog changed."""
+        now = time.monotonic()
+        if self._index is None or now - self._checked_at >= self.check_interval:
+            with self._lock:
+                self._checked_at = now
+                version = read_cache_version(CATALOG_VERSION_KEY)
+                if self._index is None or version != self._version:
+                    self._index = self._build()
+                    self._version = version
+        return self._index
+
+    def refresh(self):
+        with self._lock:
+            self._version = read_cache_version(CATALOG_VERSION_KEY)
+            self._index = self._build()
+            self._checked_at = time.monotonic()
+
+    def _build(self):
+        start = time.time()
+        movies = db.session.query(Movie.id, Movie.release_year).order_by(Movie.id).all()
+        movie_ids = np.array([movie_id for movie_id, _ in movies], dtype=np.int64)
+        years = np.array([NO_YEAR if year is None else year for _, year in movies], dtype=np.int32)
+        genre_rows = db.session.query(MovieGenre.movie_id, MovieGenre.genre).all()
+        actor_rows = db.session.query(MovieActor.movie_id, MovieActor.actor).all()
+        index = TermIndex(movie_ids, years, genre_rows, actor_rows)
+        print(f"Catalog index built: {len(movie_ids)} movies, {len(index.genres)} genres, "
+              f"{len(index.actors)} actors in {time.time() - start:.2f}s")
+        return index
+
+
+catalog_index = CatalogIndex()
@@ -0,0 +1,112 @@
+"""Fill in poster_url, release_year and actors from TMDB for a set of movies.
+
+Shared by load_data.py and update_posters.py. Lookups run concurrently
+through tmdb_client (rate limited); results are written back on the
+calling thread in batches of COMMIT_BATCH movies per commit. After each
+commit the processed movie ids are appended to a checkpoint file, so an
+interrupted run resumes where it stopped instead of starting over.
+"""
+import os
+import json
+import time
+from models import Movie, db
+from movie_cache import bump_movies_version
+from catalog_index import sync_movie_terms
+from tmdb_client import TMDBClient, parse_details
+
+COMMIT_BATCH = 100
+# Movie ids per IN query when reading tmdb ids
+ID_CHUNK = 1000
+
+
+class Checkpoint:
+    """Set of processed movie ids persisted as JSON (written atomically)."""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.done = set()
+        if restart:
+            self.clear()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.done = set(json.load(f)['done'])
+            print(f"Resuming from {path}: {len(self.done)} movies already processed")
+
+    def add(self, movie_ids):
+        self.done.update(movie_ids)
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'done': sorted(self.done)}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _tmdb_ids(movie_ids):
+    for start in range(0, len(movie_ids), ID_CHUNK):
+        chunk = movie_ids[start:start + ID_CHUNK]
+        rows = db.session.query(Movie.id, Movie.tmdb_id).filter(
+            Movie.id.in_(chunk), Movie.tmdb_id.isnot(None)
+        ).all()
+        yield from rows
+
+
+def _apply(results):
+    """Write {movie_id: (poster_url, year, actors)} to the movies in one commit."""
+    movies = Movie.query.filter(Movie.id.in_(list(results))).all()
+    changed = []
+    for movie in movies:
+        poster_url, year, actors = results[movie.id]
+        if poster_url: movie.poster_url = poster_url
+        if year: movie.release_year = year
+        if actors: movie.actors = actors
+        if poster_url or year or actors:
+            changed.append(movie)
+    if changed:
+        sync_movie_terms(changed)
+        bump_movies_version()
+    db.session.commit()
+    return len(changed)
+
+
+def enrich_movies(movie_ids, client=None, checkpoint_path=None, restart=False, batch_size=COMMIT_BATCH):
+    """Fetch TMDB details for movie_ids and store them. Call inside an app
+    context. Returns (updated, failed) counts; movies whose lookup failed
+    are not checkpointed, so a rerun retries them. restart discards an
+    existing checkpoint."""
+    client = client or TMDBClient()
+    checkpoint = Checkpoint(checkpoint_path, restart=restart)
+    todo = [int(mid) for mid in movie_ids if int(mid) not in checkpoint.done]
+    print(f"Enriching {len(todo)} movies from TMDB "
+          f"({client.concurrency} concurrent, {client.bucket.rate:g} req/s)...")
+
+    start = time.perf_counter()
+    results, processed = {}, []
+    updated = failed = 0
+    for movie_id, data, error in client.fetch_many(_tmdb_ids(todo)):
+        if error:
+            failed += 1
+            print(f"Err {movie_id}: {error}")
+            continue
+        processed.append(movie_id)
+        if data:
+            results[movie_id] = parse_details(data)
+        if len(processed) >= batch_size:
+            updated += _apply(results)
+            checkpoint.add(processed)
+            results, processed = {}, []
+            elapsed = time.perf_counter() - start
+            print(f"Processed {len(checkpoint.done)} movies, {updated} updated "
+                  f"({client.stats['requests'] / elapsed:.1f} req/s, {client.stats['throttled']} throttled)")
+    if processed:
+        updated += _apply(results)
+        checkpoint.add(processed)
+
+    if not failed:
+        checkpoint.clear()
+    print(f"TMDB enrichment done: {updated} updated, {failed} failed in {time.perf_counter() - start:.1f}s")
+    return updated, failed
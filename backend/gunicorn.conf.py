@@ -0,0 +1,56 @@
+"""Gunicorn settings: python -m gunicorn -c gunicorn.conf.py app:app
+
+With preload_app the master imports the app once (model artifact opened,
+catalog/search/popularity indexes built) and forks the workers from it,
+so they start out sharing those pages copy-on-write instead of each
+building its own copy. How much stays shared:
+- model arrays are memory-mapped .npy files, so reading them writes
+  nothing and their pages stay shared
+- the catalog, search and popularity indexes and the movie cache are
+  Python objects (lists, dicts, strings); requests that use them update
+  refcounts, which copies the pages they sit on into the worker
+- the GC is disabled while the master loads and everything it allocated
+  is moved to the permanent generation (gc.freeze) before the first fork,
+  so collections in the workers add no writes of their own
+- anything that must not cross a fork (DB connections, threads) is set up
+  per worker in post_fork
+
+PRELOAD_APP=0 turns preloading off (each worker then loads the app
+itself). See measure_rss.py for per-worker memory with and without it.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+preload_app = os.environ.get('PRELOAD_APP', '1') != '0'
+
+# Tells create_app() to leave background threads to post_fork
+if preload_app:
+    os.environ['GUNICORN_PRELOAD'] = '1'
+    # Collections while the app loads would only scatter free slots over
+    # pages the workers are about to share; freeze everything instead
+    gc.disable()
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded, before any worker forks
+    if not preload_app:
+        return
+    from app import app, warm_up
+    warm_up(app)
+    gc.freeze()
+    server.log.info(f"Preloaded app, {gc.get_freeze_count()} objects frozen for copy-on-write sharing")
+
+
+def post_fork(server, worker):
+    if preload_app:
+        gc.enable()
+    from app import app, start_background_threads
+    from models import db
+    # Pooled connections opened by the master must not be shared with it
+    with app.app_context():
+        db.engine.dispose(close=False)
+    start_background_threads()
@@ -0,0 +1,56 @@
+import numpy as np
+
+# Use a dense position table when ids span at most this many slots per id
+DENSE_MAX_SPAN_FACTOR = 4
+
+
+class IdIndex:
+    """Maps external ids (user or movie ids) to row positions in the model.
+
+    Backed by the sorted id array from the model artifact, looked up with
+    np.searchsorted. When ids are compact (span <= DENSE_MAX_SPAN_FACTOR x
+    count) a dense int32 position table is built instead for O(1) lookups.
+    Either way the cost is a few bytes per id rather than a dict entry.
+    """
+
+    def __init__(self, ids):
+        ids = np.asarray(ids)
+        if len(ids) > 1 and not np.all(ids[1:] > ids[:-1]):
+            raise ValueError("ids must be sorted and unique")
+        self.ids = ids
+        self.positions = None
+        if len(ids):
+            span = int(ids[-1]) - int(ids[0]) + 1
+            if span <= DENSE_MAX_SPAN_FACTOR * len(ids):
+                self.positions = np.full(span, -1, dtype=np.int32)
+                self.positions[ids - ids[0]] = np.arange(len(ids), dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id_):
+        return self.get(id_) is not None
+
+    def lookup(self, ids):
+        """Vectorized lookup: positions of ids as an int64 array, -1 where unknown."""
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        result = np.full(len(ids), -1, dtype=np.int64)
+        if not len(self.ids):
+            return result
+
+        if self.positions is not None:
+            offsets = ids - int(self.ids[0])
+            in_range = (offsets >= 0) & (offsets < len(self.positions))
+            result[in_range] = self.positions[offsets[in_range]]
+            return result
+
+        pos = np.searchsorted(self.ids, ids)
+        pos[pos == len(self.ids)] = 0
+        found = self.ids[pos] == ids
+        result[found] = pos[found]
+        return result
+
+    def get(self, id_):
+        """Position of a single id, or None if it is not in the model."""
+        pos = int(self.lookup([id_])[0])
+        return pos if pos >= 0 else None
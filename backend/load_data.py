@@ -1,41 +1,225 @@
-import pandas as pd
-import requests
-import time
+"""Seed the database from the MovieLens CSVs.
+
+Bulk pipeline: CSVs are read in chunks with compact dtypes and rows go in
+with COPY on Postgres or executemany inserts elsewhere. Each stage
+reports its rows/s.
+
+ratings.csv files sorted by user (as MovieLens ships them) are streamed:
+each chunk's complete users are inserted, with their likes and watch
+history, before the next chunk is read, so memory stays bounded by the
+chunk size. Other files are read whole and grouped by user once (one
+stable sort).
+
+Usage: python load_data.py [--data-dir ../data/ml-latest-small] [--chunk-rows 500000]
+"""
+import io
 import os
-from app import app, db
-from models import Movie, User, Rating
+import time
+import argparse
+from contextlib import contextmanager
 from datetime import datetime
-import sys
+import numpy as np
+import pandas as pd
+from sqlalchemy import column, insert, table, text
+from app import app, db
+from models import Movie, Rating, User
+from movie_stats import rebuild_movie_stats
+from catalog_index import rebuild_movie_terms
+from enrichment import enrich_movies
+from tmdb_client import TMDBClient
 import bcrypt
 
-# TMDB API Key
-TMDB_API_KEY = os.environ.get('TMDB_API_KEY')
-if not TMDB_API_KEY:
-    print("WARNING: TMDB_API_KEY not found in environment variables. Data loading may be incomplete.")
+DATA_DIR = '../data/ml-latest-small'
+CHUNK_ROWS = int(os.environ.get('LOAD_CHUNK_ROWS', 500_000))
+# Users per insert batch; bounds the watch_history JSON held in memory
+USER_BATCH = 5000
+# Movies enriched from TMDB at load time, by rating count
+TMDB_ENRICH_TOP = 100
+
+@contextmanager
+def stage(name):
+    """Report wall time and throughput of a loading stage. The body sets
+    progress['rows'] to the number of rows it handled."""
+    progress = {'rows': 0}
+    start = time.perf_counter()
+    yield progress
+    elapsed = time.perf_counter() - start
+    rate = progress['rows'] / elapsed if elapsed > 0 else 0
+    print(f"[stage] {name}: {progress['rows']:,} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
 
-def fetch_tmdb_details(tmdb_id):
-    if not tmdb_id or pd.isna(tmdb_id):
-        return None, None, []
-    
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+def copy_rows(table_name, columns, frame):
+    """COPY a DataFrame into a Postgres table through the session's connection."""
+    buf = io.StringIO()
+    frame.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cursor = db.session.connection().connection.cursor()
     try:
-        url = f"https://api.themoviedb.org/3/movie/{int(tmdb_id)}?api_key={TMDB_API_KEY}&append_to_response=credits"
-        res = requests.get(url, timeout=5)
-        if res.status_code == 200:
-            data = res.json()
-            poster = data.get('poster_path')
-            poster_url = f"https://image.tmdb.org/t/p/w500{poster}" if poster else None
-            year = int(data.get('release_date', '')[:4]) if data.get('release_date') else None
-            
-            actors = []
-            if 'credits' in data and 'cast' in data['credits']:
-                actors = [actor['name'] for actor in data['credits']['cast'][:5]]
-            
-            return poster_url, year, actors
-    except Exception as e:
-        print(f"Error fetching TMDB {tmdb_id}: {e}")
-    return None, None, []
-
-def load_data():
+        cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+    finally:
+        cursor.close()
+
+def insert_rows(table_name, columns, frame):
+    """Bulk insert a DataFrame whose columns match `columns`: COPY on
+    Postgres, a single executemany elsewhere. JSON columns must already
+    hold serialized JSON text."""
+    if frame.empty:
+        return
+    if is_postgres():
+        copy_rows(table_name, columns, frame)
+        return
+    # Plain Python values (None for missing) for the DB-API driver; JSON
+    # columns go in as the pre-serialized text
+    frame = frame.astype(object).where(frame.notna(), None)
+    rows = list(frame.itertuples(index=False, name=None))
+    if db.engine.dialect.name == 'sqlite':
+        # Raw executemany skips per-row dict and type processing
+        placeholders = ', '.join('?' * len(columns))
+        db.session.connection().exec_driver_sql(
+            f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})", rows
+        )
+        return
+    # A lightweight table() has untyped columns, so values are passed as they are
+    target = table(table_name, *[column(c) for c in columns])
+    db.session.execute(insert(target), [dict(zip(columns, row)) for row in rows])
+
+def parse_years(titles):
+    """Year from the last '(...)' group of each title when it is all digits, else None."""
+    has_parens = titles.str.contains('(', regex=False) & titles.str.contains(')', regex=False)
+    part = titles.str.rsplit('(', n=1).str[-1].str.split(')').str[0]
+    digits = has_parens & part.str.fullmatch(r'\d+').fillna(False)
+    return pd.to_numeric(part.where(digits), errors='coerce').astype('Int64')
+
+RATING_DTYPES = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32, 'timestamp': np.int64}
+
+def rating_chunks(data_dir, chunk_rows, columns=tuple(RATING_DTYPES)):
+    """ratings.csv as dicts of compact NumPy columns, chunk_rows rows at a
+    time. Ratings are half stars, so float32 holds them exactly."""
+    reader = pd.read_csv(
+        os.path.join(data_dir, 'ratings.csv'),
+        usecols=list(columns),
+        dtype={name: RATING_DTYPES[name] for name in columns},
+        chunksize=chunk_rows
+    )
+    for chunk in reader:
+        yield {name: chunk[name].to_numpy() for name in columns}
+
+def scan_ratings(data_dir, chunk_rows):
+    """One pass over the id columns: (row count, whether rows are sorted by
+    user, ratings per movie id)."""
+    n_rows, is_sorted, last_uid = 0, True, None
+    movie_counts = pd.Series(dtype=np.int64)
+    for chunk in rating_chunks(data_dir, chunk_rows, columns=('userId', 'movieId')):
+        uids = chunk['userId']
+        if len(uids):
+            if (last_uid is not None and uids[0] < last_uid) or np.any(np.diff(uids) < 0):
+                is_sorted = False
+            last_uid = uids[-1]
+        movie_counts = movie_counts.add(pd.Series(chunk['movieId']).value_counts(), fill_value=0)
+        n_rows += len(uids)
+    return n_rows, is_sorted, movie_counts
+
+def read_ratings(data_dir, chunk_rows):
+    """Read the whole of ratings.csv into compact NumPy columns."""
+    columns = {name: [] for name in RATING_DTYPES}
+    for chunk in rating_chunks(data_dir, chunk_rows):
+        for name in columns:
+            columns[name].append(chunk[name])
+    return {name: np.concatenate(parts) if parts else np.empty(0) for name, parts in columns.items()}
+
+def user_blocks(data_dir, chunk_rows):
+    """Stream a ratings.csv sorted by user as blocks of complete users: the
+    last user of a chunk may continue in the next one, so its rows are
+    carried over."""
+    carry = None
+    for chunk in rating_chunks(data_dir, chunk_rows):
+        if carry is not None:
+            chunk = {name: np.concatenate((carry[name], values)) for name, values in chunk.items()}
+        if not len(chunk['userId']):
+            continue
+        cut = int(np.searchsorted(chunk['userId'], chunk['userId'][-1]))
+        carry = {name: values[cut:] for name, values in chunk.items()}
+        if cut:
+            yield {name: values[:cut] for name, values in chunk.items()}
+    if carry is not None and len(carry['userId']):
+        yield carry
+
+def load_movies(data_dir):
+    movies_df = pd.read_csv(os.path.join(data_dir, 'movies.csv'), dtype={'movieId': np.int32})
+    links_df = pd.read_csv(os.path.join(data_dir, 'links.csv'), dtype={'movieId': np.int32})
+    movies_df = pd.merge(movies_df, links_df, on='movieId', how='left')
+
+    movies = pd.DataFrame({
+        'id': movies_df['movieId'],
+        'title': movies_df['title'],
+        # Keep original string "Action|Comedy"
+        'genres': movies_df['genres'],
+        'tmdb_id': movies_df['tmdbId'].astype('Int64'),
+        'poster_url': pd.Series(None, index=movies_df.index, dtype=object),
+        'release_year': parse_years(movies_df['title']),
+        # Serialized JSON; actors are filled in by the TMDB enrichment
+        'actors': '[]'
+    })
+    return movies
+
+def user_rows(uids, ratings, starts, stops, default_hash):
+    """One users row per uid with liked_movies / watch_history as JSON text.
+    ratings are sorted by user; uid's ratings are [starts[i], stops[i])."""
+    movie_ids = ratings['movieId'].tolist()
+    values = ratings['rating'].astype(np.float64).tolist()
+    timestamps = ratings['timestamp'].tolist()
+    liked, history = [], []
+    for start, stop in zip(starts, stops):
+        liked.append('[' + ', '.join(str(movie_ids[j]) for j in range(start, stop) if values[j] >= 4.0) + ']')
+        history.append('[' + ', '.join(
+            f'{{"movie_id": {movie_ids[j]}, "rating": {values[j]!r}, "timestamp": {timestamps[j]}}}'
+            for j in range(start, stop)
+        ) + ']')
+    created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+    return pd.DataFrame({
+        'id': uids,
+        'username': [f"user{uid}" for uid in uids],
+        'email': [f"user{uid}@example.com" for uid in uids],
+        'password_hash': default_hash,
+        'liked_movies': liked,
+        'watch_history': history,
+        'created_at': created_at
+    })
+
+def insert_user_ratings(ratings, existing, default_hash, chunk_rows):
+    """Insert users (those not in `existing`) and then the ratings of a
+    block of ratings sorted by user. Returns the number of ratings."""
+    uids, starts = np.unique(ratings['userId'], return_index=True)
+    stops = np.append(starts[1:], len(ratings['userId']))
+    keep = np.array([int(uid) not in existing for uid in uids], dtype=bool)
+    uids, starts, stops = uids[keep], starts[keep], stops[keep]
+
+    # Users first: on Postgres ratings.user_id is a checked foreign key
+    for i in range(0, len(uids), USER_BATCH):
+        batch = slice(i, i + USER_BATCH)
+        lo, hi = int(starts[batch][0]), int(stops[batch][-1])
+        window = {name: values[lo:hi] for name, values in ratings.items()}
+        rows = user_rows(uids[batch].tolist(), window, starts[batch] - lo, stops[batch] - lo, default_hash)
+        insert_rows('users', list(rows.columns), rows)
+        db.session.commit()
+    existing.update(int(uid) for uid in uids)
+
+    columns = ['user_id', 'movie_id', 'rating', 'timestamp']
+    for start in range(0, len(ratings['userId']), chunk_rows):
+        stop = start + chunk_rows
+        frame = pd.DataFrame({
+            'user_id': ratings['userId'][start:stop],
+            'movie_id': ratings['movieId'][start:stop],
+            'rating': ratings['rating'][start:stop].astype(np.float64),
+            'timestamp': ratings['timestamp'][start:stop]
+        })
+        insert_rows(Rating.__tablename__, columns, frame)
+        db.session.commit()
+    return len(ratings['userId'])
+
+def load_data(data_dir=DATA_DIR, chunk_rows=CHUNK_ROWS):
     with app.app_context():
         # Create tables if they don't exist
         db.create_all()
@@ -45,140 +229,68 @@ def load_data():
              print("Data already exists. Skipping data loading.")
              return
 
-        print("Reading CSV files...")
-        movies_df = pd.read_csv('../data/ml-latest-small/movies.csv')
-        links_df = pd.read_csv('../data/ml-latest-small/links.csv')
-        ratings_df = pd.read_csv('../data/ml-latest-small/ratings.csv')
-
-        movies_df = pd.merge(movies_df, links_df, on='movieId', how='left')
-
-        print(f"Processing {len(movies_df)} movies...")
-        
-        popular_ids = ratings_df['movieId'].value_counts().head(100).index.tolist()
-        
-        movies_to_insert = []
-        
-        # We need to commit in batches or all at once? SQLAlchemy objects.
-        # Let's simple iterate and add.
-        
-        count = 0
-        for _, row in movies_df.iterrows():
-            movie_id = int(row['movieId'])
-            # Check if movie exists (redundant with top-level check but good for partials)
-            # Skipping individual check for speed since we checked empty table above.
-            
-            title = row['title']
-            genres = row['genres'] # Keep as string for now, or split? Model expects String
-            # Model definition: genres = db.Column(db.String(255))
-            # Just keep original string "Action|Comedy"
-            
-            tmdb_id = row['tmdbId']
-            
-            poster_url = None
-            release_year = None
-            actors = []
-            
-            # Simple heuristic for year
-            try:
-                if '(' in title and ')' in title:
-                   part = title.split('(')[-1].split(')')[0]
-                   if part.isdigit():
-                       release_year = int(part)
-            except:
-                pass
-
-            if movie_id in popular_ids and TMDB_API_KEY and not pd.isna(tmdb_id):
-                print(f"Fetching details for: {title}")
-                p_url, r_year, c_actors = fetch_tmdb_details(tmdb_id)
-                if p_url: poster_url = p_url
-                if r_year: release_year = r_year
-                if c_actors: actors = c_actors
-                time.sleep(0.1)
-
-            movie = Movie(
-                id=movie_id,
-                title=title,
-                genres=genres,
-                tmdb_id=int(tmdb_id) if not pd.isna(tmdb_id) else None,
-                poster_url=poster_url,
-                release_year=release_year,
-                actors=actors 
-            )
-            db.session.add(movie)
-            count += 1
-            if count % 1000 == 0:
-                print(f"Processed {count} movies...")
-        
-        db.session.commit()
-        print(f"Committed {count} movies.")
-
-        print("Processing Users...")
-        # Create users based on ratings
-        user_ids = ratings_df['userId'].unique()
-        
-        # Pre-hash password
-        default_pw = "password"
-        # bcrypt.hashpw returns bytes. store as string.
-        default_hash = bcrypt.hashpw(default_pw.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-
-        for uid in user_ids:
-            # Check if user exists
-            if User.query.get(int(uid)):
-                continue
-
-            # We can aggregate likes for each user
-            user_ratings = ratings_df[ratings_df['userId'] == uid]
-            liked = user_ratings[user_ratings['rating'] >= 4.0]['movieId'].tolist()
-            
-            # Watch history: list of {movie_id, rating, timestamp}
-            history = []
-            for _, r in user_ratings.iterrows():
-                history.append({
-                    "movie_id": int(r['movieId']),
-                    "rating": float(r['rating']),
-                    "timestamp": int(r['timestamp'])
-                })
-
-            user = User(
-                id=int(uid),
-                username=f"user{uid}",
-                email=f"user{uid}@example.com",
-                password_hash=default_hash,
-                liked_movies=liked,
-                watch_history=history
-            )
-            db.session.add(user)
-        
-        db.session.commit()
-        print("Users created.")
-        
-        print("Loading Ratings...")
-        # Since we stored history in User, do we need Rating table?
-        # Yes, for collaborative filtering or easier SQL queries.
-        # But for huge datasets it's slow. Small is fine.
-        
-        # Speed up: Bulk insert mappings
-        # ratings_df.to_sql? No, simple loop for now
-        
-        ratings_batch = []
-        for _, row in ratings_df.iterrows():
-            r = Rating(
-                user_id=int(row['userId']),
-                movie_id=int(row['movieId']),
-                rating=float(row['rating']),
-                timestamp=int(row['timestamp'])
-            )
-            ratings_batch.append(r)
-            if len(ratings_batch) > 5000:
-                db.session.bulk_save_objects(ratings_batch)
-                ratings_batch = []
-                db.session.commit()
-        
-        if ratings_batch:
-            db.session.bulk_save_objects(ratings_batch)
+        with stage("scan ratings.csv") as progress:
+            n_ratings, sorted_by_user, movie_counts = scan_ratings(data_dir, chunk_rows)
+            progress['rows'] = n_ratings
+
+        with stage("read movies.csv + links.csv") as progress:
+            movies = load_movies(data_dir)
+            progress['rows'] = len(movies)
+
+        with stage("insert movies") as progress:
+            insert_rows('movies', list(movies.columns), movies)
             db.session.commit()
-            
-        print("Ratings loaded.")
+            progress['rows'] = len(movies)
+
+        print("Indexing genres and actors...")
+        rebuild_movie_terms()
+
+        # TMDB details only for the most rated movies; update_posters.py
+        # backfills the rest
+        client = TMDBClient()
+        if client.api_key:
+            popular_ids = movie_counts.sort_values(ascending=False, kind='stable').head(TMDB_ENRICH_TOP).index
+            enrich_movies([int(mid) for mid in popular_ids], client=client)
+        else:
+            print("WARNING: TMDB_API_KEY not found in environment variables. Data loading may be incomplete.")
+
+        # Pre-hash password: bcrypt.hashpw returns bytes, store as string
+        default_hash = bcrypt.hashpw("password".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        existing = {uid for (uid,) in db.session.query(User.id)}
+        if sorted_by_user:
+            with stage("insert users + ratings (streamed)") as progress:
+                for block in user_blocks(data_dir, chunk_rows):
+                    progress['rows'] += insert_user_ratings(block, existing, default_hash, chunk_rows)
+        else:
+            print("ratings.csv is not sorted by user; reading it whole to group it")
+            with stage("read ratings.csv") as progress:
+                ratings = read_ratings(data_dir, chunk_rows)
+                progress['rows'] = len(ratings['userId'])
+
+            with stage("group ratings by user") as progress:
+                # Stable sort keeps each user's ratings in file order
+                order = np.argsort(ratings['userId'], kind='stable')
+                ratings = {name: values[order] for name, values in ratings.items()}
+                del order
+                progress['rows'] = len(ratings['userId'])
+
+            with stage("insert users + ratings") as progress:
+                progress['rows'] = insert_user_ratings(ratings, existing, default_hash, chunk_rows)
+
+        if is_postgres():
+            # Explicit ids do not advance the serial; keep signups from colliding
+            db.session.execute(text(
+                "SELECT setval(pg_get_serial_sequence('users', 'id'), COALESCE(MAX(id), 1)) FROM users"
+            ))
+            db.session.commit()
+
+        with stage("build movie_stats") as progress:
+            rebuild_movie_stats()
+            progress['rows'] = n_ratings
 
 if __name__ == "__main__":
-    load_data()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory with movies.csv, links.csv and ratings.csv')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='CSV rows read / inserted per chunk')
+    args = parser.parse_args()
+    load_data(data_dir=args.data_dir, chunk_rows=args.chunk_rows)
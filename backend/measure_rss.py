@@ -0,0 +1,143 @@
+"""Per-worker memory of the gunicorn deployment, with and without preload_app.
+
+Starts gunicorn with gunicorn.conf.py in each mode, sends the same mix of
+API requests so every worker has served traffic, then reads
+/proc/<pid>/smaps_rollup of the master and each worker (Linux only):
+- RSS: resident memory, pages shared with other processes counted in full
+- PSS: resident memory with shared pages split between the processes
+  sharing them; the sum over all processes is the real footprint
+- private dirty: pages only this process has written, i.e. roughly what
+  one more worker costs
+
+Uses DATABASE_URL and the model/ artifact of the working directory, like
+the app itself.
+
+Usage:
+    python measure_rss.py --workers 4 --requests 400
+    python measure_rss.py --modes preload
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def smaps_rollup(pid):
+    """Memory fields of /proc/<pid>/smaps_rollup, in MB."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+    return values
+
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def wait_until_up(base_url, master, n_workers, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if master.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {master.returncode}")
+        try:
+            if requests.get(f"{base_url}/api/health", timeout=2).ok and \
+                    len(worker_pids(master.pid)) >= n_workers:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('gunicorn did not come up in time')
+
+
+def send_traffic(base_url, n_requests, concurrency, seed=0):
+    """Mix of the read endpoints the frontend calls, spread over all workers."""
+    rng = random.Random(seed)
+    movie_ids = [m['movie_id'] for m in requests.get(f"{base_url}/api/popular", timeout=30).json()]
+    paths = []
+    for i in range(n_requests):
+        kind = i % 6
+        if kind == 0:
+            paths.append(f"/api/recommend/{rng.randint(1, 600)}")
+        elif kind == 1 and movie_ids:
+            paths.append(f"/api/similar/{rng.choice(movie_ids)}")
+        elif kind == 2:
+            paths.append(f"/api/search?q={rng.choice(['star', 'the', 'lov', 'dark kn', 'toy'])}")
+        elif kind == 3:
+            paths.append(f"/api/movies/genre/{rng.choice(['Drama', 'Comedy', 'Action', 'Horror'])}")
+        elif kind == 4:
+            paths.append('/api/movies/filter?genres=Drama&min_rating=3')
+        else:
+            paths.append(f"/api/popular?sort={rng.choice(['count', 'rating', 'trending'])}")
+
+    def get(path):
+        return requests.get(f"{base_url}{path}", timeout=60).status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        statuses = list(pool.map(get, paths))
+    return sum(1 for status in statuses if status != 200)
+
+
+def measure(mode, args):
+    env = dict(os.environ, PORT=str(args.port), WEB_CONCURRENCY=str(args.workers),
+               PRELOAD_APP='1' if mode == 'preload' else '0')
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(backend_dir, 'gunicorn.conf.py'),
+         '--pythonpath', backend_dir, 'app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if not args.verbose else None
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_up(base_url, master, args.workers)
+        failed = send_traffic(base_url, args.requests, concurrency=2 * args.workers)
+        time.sleep(1)
+        processes = [('master', master.pid)] + [(f"worker {i + 1}", pid)
+                                                 for i, pid in enumerate(worker_pids(master.pid))]
+        rows = [(name, smaps_rollup(pid)) for name, pid in processes]
+    finally:
+        master.terminate()
+        try:
+            master.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            master.kill()
+
+    print(f"\n{mode} ({args.workers} workers, {args.requests} requests, {failed} failed)")
+    print(f"{'process':<10} {'RSS MB':>8} {'PSS MB':>8} {'shared MB':>10} {'priv dirty MB':>14}")
+    for name, mem in rows:
+        shared = mem['Shared_Clean'] + mem['Shared_Dirty']
+        print(f"{name:<10} {mem['Rss']:>8.1f} {mem['Pss']:>8.1f} {shared:>10.1f} {mem['Private_Dirty']:>14.1f}")
+    workers = [mem for name, mem in rows if name != 'master']
+    total_pss = sum(mem['Pss'] for _, mem in rows)
+    per_worker_dirty = sum(mem['Private_Dirty'] for mem in workers) / max(len(workers), 1)
+    print(f"total PSS {total_pss:.1f} MB, mean private dirty per worker {per_worker_dirty:.1f} MB")
+    return total_pss, per_worker_dirty
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=400, help='requests sent before measuring')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--modes', nargs='+', default=['no-preload', 'preload'], choices=['no-preload', 'preload'])
+    parser.add_argument('--verbose', action='store_true', help="show gunicorn's log")
+    args = parser.parse_args()
+
+    results = {mode: measure(mode, args) for mode in args.modes}
+    if len(results) == 2:
+        (base_pss, base_dirty), (pre_pss, pre_dirty) = results['no-preload'], results['preload']
+        print(f"\npreload: total PSS {base_pss:.1f} -> {pre_pss:.1f} MB, "
+              f"private dirty per worker {base_dirty:.1f} -> {pre_dirty:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
 from datetime import datetime
 
 db = SQLAlchemy()
@@ -41,7 +42,73 @@ class Movie(db.Model):
 class Rating(db.Model):
     __tablename__ = 'ratings'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), nullable=False)
     rating = db.Column(db.Float, nullable=False)
-    timestamp = db.Column(db.Integer)
+    timestamp = db.Column(db.Integer, index=True)
+
+class CacheVersion(db.Model):
+    """Version counters bumped by writers so in-process caches know to refresh."""
+    __tablename__ = 'cache_versions'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class MovieStats(db.Model):
+    """Per-movie rating aggregates, updated in the same transaction as each
+    rating write (see movie_stats.py) so routes can filter and sort on them."""
+    __tablename__ = 'movie_stats'
+    movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), primary_key=True)
+    rating_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    rating_sum = db.Column(db.Float, nullable=False, default=0.0)
+    rating_mean = db.Column(db.Float, nullable=False, default=0.0, index=True)
+
+class MovieGenre(db.Model):
+    """One row per (movie, genre), derived from Movie.genres (see catalog_index.py)."""
+    __tablename__ = 'movie_genres'
+    movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), primary_key=True)
+    genre = db.Column(db.String(64), primary_key=True, index=True)
+
+class MovieActor(db.Model):
+    """One row per (movie, actor), derived from Movie.actors (see catalog_index.py)."""
+    __tablename__ = 'movie_actors'
+    movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), primary_key=True)
+    actor = db.Column(db.String(255), primary_key=True, index=True)
+
+class TmdbResponse(db.Model):
+    """Persistent tier of the TMDB response cache (see tmdb_cache.py).
+    payload is null for movies TMDB does not know."""
+    __tablename__ = 'tmdb_responses'
+    key = db.Column(db.String(128), primary_key=True)
+    payload = db.Column(db.JSON, nullable=True)
+    fetched_at = db.Column(db.Integer, nullable=False)
+
+class PosterJob(db.Model):
+    """Pending poster lookup for a movie, worked off by the background
+    poster queue (see poster_queue.py). Rows are deleted once done."""
+    __tablename__ = 'poster_jobs'
+    movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), primary_key=True)
+    tmdb_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.Integer, nullable=False, default=0, index=True)
+    claimed_by = db.Column(db.String(64), nullable=True)
+    enqueued_at = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.Integer, nullable=False)
+
+
+# Indexes added to existing tables after they were first created;
+# db.create_all() only creates indexes along with new tables
+LATE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_ratings_user_id ON ratings (user_id)',
+    'CREATE INDEX IF NOT EXISTS ix_ratings_timestamp ON ratings (timestamp)',
+]
+
+def ensure_indexes():
+    """Create LATE_INDEXES on databases created before they were declared."""
+    try:
+        for statement in LATE_INDEXES:
+            db.session.execute(text(statement))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Warning: could not create indexes: {e}")
@@ -0,0 +1,136 @@
+"""Read-through, size-bounded LRU cache of movie metadata keyed by movie id.
+
+Movie rows almost never change, so hot endpoints hydrate ids from here
+instead of issuing an IN query and building ORM objects per request.
+
+Invalidation: writers (the poster queue, update_posters.py, the details
+route) call bump_movies_version() in the same transaction as their
+update. Every process polls that version at most every
+MOVIE_CACHE_CHECK_SECONDS and drops its cache when it moves, which also
+covers writes made by other gunicorn workers or offline scripts.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from models import CacheVersion, Movie, db
+
+MOVIES_VERSION_KEY = 'movies'
+
+
+class MovieRecord:
+    __slots__ = ('id', 'title', 'genres', 'tmdb_id', 'poster_url', 'release_year', 'actors')
+
+    def __init__(self, movie):
+        self.id = movie.id
+        self.title = movie.title
+        self.genres = movie.genres
+        self.tmdb_id = movie.tmdb_id
+        self.poster_url = movie.poster_url
+        self.release_year = movie.release_year
+        self.actors = movie.actors
+
+    def to_dict(self):
+        """The movie dict shape used across the API responses."""
+        return {
+            'movie_id': self.id,
+            'title': self.title,
+            'genres': self.genres,
+            'poster_url': self.poster_url,
+            'release_year': self.release_year,
+            'actors': list(self.actors or []),
+            'tmdb_id': self.tmdb_id
+        }
+
+
+class MovieCache:
+    def __init__(self, max_size=None, check_interval=None):
+        self.max_size = max_size or int(os.environ.get('MOVIE_CACHE_SIZE', 50000))
+        self.check_interval = check_interval if check_interval is not None else \
+            float(os.environ.get('MOVIE_CACHE_CHECK_SECONDS', 5))
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, movie_id):
+        return self.get_many([movie_id]).get(movie_id)
+
+    def get_many(self, movie_ids):
+        """Return {movie_id: MovieRecord} for the ids that exist. Misses are
+        loaded with a single IN query and cached."""
+        self._check_version()
+        found = {}
+        missing = []
+        with self._lock:
+            for mid in movie_ids:
+                record = self._records.get(mid)
+                if record is None:
+                    missing.append(mid)
+                else:
+                    self._records.move_to_end(mid)
+                    found[mid] = record
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            loaded = [MovieRecord(m) for m in Movie.query.filter(Movie.id.in_(set(missing))).all()]
+            with self._lock:
+                for record in loaded:
+                    self._records[record.id] = record
+                    found[record.id] = record
+                while len(self._records) > self.max_size:
+                    self._records.popitem(last=False)
+        return found
+
+    def get_dicts(self, movie_ids):
+        """Movie dicts for movie_ids in the given order, skipping unknown ids."""
+        records = self.get_many(movie_ids)
+        return [records[mid].to_dict() for mid in movie_ids if mid in records]
+
+    def invalidate(self, movie_ids=None):
+        """Drop the given ids (or everything) from this process's cache."""
+        with self._lock:
+            if movie_ids is None:
+                self._records.clear()
+            else:
+                for mid in movie_ids:
+                    self._records.pop(mid, None)
+
+    def stats(self):
+        return {'size': len(self._records), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = read_cache_version(MOVIES_VERSION_KEY)
+        if self._version is not None and version != self._version:
+            self.invalidate()
+        self._version = version
+
+
+def bump_cache_version(name):
+    """Increment the named cache version. Call inside the writer's session
+    before it commits."""
+    updated = db.session.query(CacheVersion).filter_by(name=name).update(
+        {CacheVersion.version: CacheVersion.version + 1}
+    )
+    if not updated:
+        db.session.add(CacheVersion(name=name, version=1))
+
+
+def read_cache_version(name):
+    return db.session.query(CacheVersion.version).filter_by(name=name).scalar() or 0
+
+
+def bump_movies_version():
+    """Mark cached movie metadata stale in every process. Call inside the
+    writer's session before it commits."""
+    bump_cache_version(MOVIES_VERSION_KEY)
+
+
+movie_cache = MovieCache()
@@ -0,0 +1,82 @@
+"""Maintenance of the denormalized movie_stats table (count, sum, mean per movie)."""
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from models import MovieStats, Rating, db
+
+
+def rebuild_movie_stats():
+    """Recompute every movie's aggregates from the ratings table in one statement."""
+    db.session.execute(delete(MovieStats))
+    db.session.execute(insert(MovieStats).from_select(
+        ['movie_id', 'rating_count', 'rating_sum', 'rating_mean'],
+        select(
+            Rating.movie_id,
+            func.count(Rating.id),
+            func.sum(Rating.rating),
+            func.avg(Rating.rating)
+        ).group_by(Rating.movie_id)
+    ))
+    db.session.commit()
+
+
+def ensure_movie_stats():
+    """Backfill movie_stats for databases seeded before the table existed."""
+    if MovieStats.query.first() is None and Rating.query.first() is not None:
+        print("Building movie_stats from ratings...")
+        rebuild_movie_stats()
+
+
+def apply_rating(movie_id, rating, old_rating=None):
+    """Fold one rating write into movie_stats. Call before the rating's
+    commit so both land in the same transaction. old_rating is the value
+    being replaced, if the user had rated the movie before."""
+    count_delta = 0 if old_rating is not None else 1
+    sum_delta = rating - (old_rating or 0.0)
+    stats = MovieStats.__table__
+    changes = {
+        'rating_count': stats.c.rating_count + count_delta,
+        'rating_sum': stats.c.rating_sum + sum_delta,
+        'rating_mean': (stats.c.rating_sum + sum_delta) / (stats.c.rating_count + count_delta)
+    }
+    first = {'movie_id': movie_id, 'rating_count': 1, 'rating_sum': rating, 'rating_mean': rating}
+
+    # One upsert, so two first ratings of a movie at once cannot both insert
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        db.session.execute(dialect_insert(stats).values(**first).on_conflict_do_update(
+            index_elements=[stats.c.movie_id], set_=changes
+        ))
+        return
+
+    updated = db.session.execute(update(stats).where(stats.c.movie_id == movie_id).values(**changes)).rowcount
+    if not updated:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(stats).values(**first))
+        except IntegrityError:
+            # Another writer inserted it first
+            db.session.execute(update(stats).where(stats.c.movie_id == movie_id).values(**changes))
+
+
+def movies_with_min_rating(movie_ids, min_rating=None, limit=30, chunk_size=500):
+    """[(movie_id, rating_mean or None)] for the first `limit` of movie_ids
+    (in order) whose mean rating is at least min_rating. Unrated movies
+    count as 0. Candidates are checked chunk by chunk, so a selective
+    in-memory filter never turns into a large IN query."""
+    rows = []
+    for start in range(0, len(movie_ids), chunk_size):
+        chunk = [int(mid) for mid in movie_ids[start:start + chunk_size]]
+        means = dict(db.session.query(MovieStats.movie_id, MovieStats.rating_mean).filter(
+            MovieStats.movie_id.in_(chunk)
+        ).all())
+        for movie_id in chunk:
+            mean = means.get(movie_id)
+            if min_rating is None or (mean or 0.0) >= min_rating:
+                rows.append((movie_id, mean))
+                if len(rows) == limit:
+                    return rows
+    return rows
@@ -0,0 +1,191 @@
+"""In-memory popularity rankings for /api/popular and the recommender fallbacks.
+
+Per-movie aggregates are loaded from movie_stats at most every
+POPULARITY_REFRESH_SECONDS and updated incrementally by /api/rate in
+between, so serving a popular list never scans the ratings table. Once
+loaded, rankings are reloaded on a background thread while requests keep
+serving the current ones.
+
+Ranking kinds:
+- 'count':    number of ratings (the original /popular ordering)
+- 'rating':   Bayesian average, (C * global_mean + sum) / (C + count), so a
+              movie needs about C ratings before its own mean dominates
+- 'trending': exponentially time-decayed rating count with a half-life of
+              POPULARITY_HALF_LIFE_DAYS
+"""
+import os
+import time
+import threading
+import numpy as np
+from flask import current_app
+from sqlalchemy import func
+from models import MovieStats, Rating, db
+from ranking import top_k
+
+KINDS = ('count', 'rating', 'trending')
+# Ratings older than this many half-lives weigh < 0.4% and are not loaded
+TRENDING_WINDOW_HALF_LIVES = 8
+# Recent ratings are counted in SQL per movie and time bucket of this
+# fraction of a half-life; decaying by the bucket centre is within 0.6%
+TRENDING_BUCKETS_PER_HALF_LIFE = 64
+# Rankings are cached this deep; deeper requests are computed on the fly
+CACHED_DEPTH = 100
+
+
+class PopularityRanking:
+    def __init__(self, refresh_interval=None, half_life_days=None, prior_weight=None):
+        self.refresh_interval = refresh_interval or float(os.environ.get('POPULARITY_REFRESH_SECONDS', 600))
+        half_life_days = half_life_days or float(os.environ.get('POPULARITY_HALF_LIFE_DAYS', 30))
+        self.half_life = half_life_days * 86400
+        self.prior_weight = prior_weight or float(os.environ.get('POPULARITY_PRIOR_WEIGHT', 10))
+        self._lock = threading.Lock()
+        self._refreshed_at = None
+        self._refreshing = False
+        self._positions = {}
+        self.movie_ids = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.sums = np.empty(0, dtype=np.float64)
+        self.decayed = np.empty(0, dtype=np.float64)
+        self._epoch = 0
+        self._top = {}
+
+    def top(self, n=10, kind='count'):
+        """Movie ids of the n most popular movies by the given ranking kind."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown popularity kind '{kind}'. Use one of: {', '.join(KINDS)}")
+        self._maybe_refresh()
+        with self._lock:
+            if n > CACHED_DEPTH:
+                return self._rank(kind, n)
+            if kind not in self._top:
+                self._top[kind] = self._rank(kind, CACHED_DEPTH)
+            return self._top[kind][:n]
+
+    def top_among(self, movie_ids, n=10, kind='count'):
+        """The n most popular of the given movie ids; unrated movies rank last."""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        scores = self.scores_for(movie_ids, kind)
+        # Stable sort keeps ties in movie id order
+        order = np.argsort(-scores, kind='stable')[:n]
+        return [int(movie_ids[i]) for i in order]
+
+    def scores_for(self, movie_ids, kind='count'):
+        """Ranking scores of the given movie ids as a float array, -1 for unrated movies."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown popularity kind '{kind}'. Use one of: {', '.join(KINDS)}")
+        self._maybe_refresh()
+        with self._lock:
+            positions = np.array([self._positions.get(int(mid), -1) for mid in movie_ids], dtype=np.int64)
+            scores = np.full(len(positions), -1.0)
+            rated = positions >= 0
+            scores[rated] = self._scores(kind)[positions[rated]]
+        return scores
+
+    def record_rating(self, movie_id, rating, old_rating=None, timestamp=None):
+        """Apply one /api/rate write. old_rating is the value it replaced, if any."""
+        if self._refreshed_at is None:
+            return
+        timestamp = timestamp or time.time()
+        movie_id = int(movie_id)
+        with self._lock:
+            pos = self._positions.get(movie_id)
+            if pos is None:
+                pos = self._append(movie_id)
+            if old_rating is None:
+                self.counts[pos] += 1
+                self.sums[pos] += rating
+            else:
+                self.sums[pos] += rating - old_rating
+            # A re-rating counts as fresh activity for trending
+            self.decayed[pos] += self._weight(timestamp)
+            self._top.clear()
+
+    def refresh(self):
+        """Reload aggregates: counts and sums from movie_stats, plus the
+        recent ratings window for trending."""
+        now = time.time()
+        totals = db.session.query(
+            MovieStats.movie_id,
+            MovieStats.rating_count,
+            MovieStats.rating_sum
+        ).all()
+
+        # Decay is computed relative to the refresh time; scaling every score
+        # by the same factor later does not change the ranking
+        width = max(1, int(self.half_life / TRENDING_BUCKETS_PER_HALF_LIFE))
+        bucket = Rating.timestamp // width
+        recent = db.session.query(Rating.movie_id, bucket, func.count()).filter(
+            Rating.timestamp >= int(now - TRENDING_WINDOW_HALF_LIVES * self.half_life)
+        ).group_by(Rating.movie_id, bucket).all()
+
+        movie_ids = np.array([row[0] for row in totals], dtype=np.int64)
+        positions = {int(mid): i for i, mid in enumerate(movie_ids)}
+        decayed = np.zeros(len(movie_ids), dtype=np.float64)
+        if recent:
+            recent_ids = np.array([positions.get(mid, -1) for mid, _, _ in recent])
+            centres = (np.array([b for _, b, _ in recent], dtype=np.float64) + 0.5) * width
+            weights = np.array([count for _, _, count in recent]) * np.exp2((centres - now) / self.half_life)
+            decayed = np.bincount(recent_ids[recent_ids >= 0], weights=weights[recent_ids >= 0],
+                                  minlength=len(movie_ids))
+
+        with self._lock:
+            self._epoch = now
+            self._positions = positions
+            self.movie_ids = movie_ids
+            self.counts = np.array([row[1] for row in totals], dtype=np.int64)
+            self.sums = np.array([row[2] or 0 for row in totals], dtype=np.float64)
+            self.decayed = decayed
+            self._top.clear()
+            self._refreshed_at = time.monotonic()
+
+    def _maybe_refresh(self):
+        if self._refreshed_at is None:
+            self.refresh()
+        elif time.monotonic() - self._refreshed_at > self.refresh_interval:
+            self._refresh_async()
+
+    def _refresh_async(self):
+        # Requests keep serving the current rankings while a thread reloads them
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        app = current_app._get_current_object()
+
+        def refresh():
+            try:
+                with app.app_context():
+                    self.refresh()
+            except Exception as e:
+                print(f"Error refreshing popularity rankings: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, name='popularity-refresh', daemon=True).start()
+
+    def _weight(self, timestamp):
+        return 2.0 ** ((timestamp - self._epoch) / self.half_life)
+
+    def _scores(self, kind):
+        if kind == 'count':
+            return self.counts.astype(np.float64)
+        if kind == 'rating':
+            total = self.counts.sum()
+            global_mean = self.sums.sum() / total if total else 0.0
+            return (self.prior_weight * global_mean + self.sums) / (self.prior_weight + self.counts)
+        return self.decayed
+
+    def _rank(self, kind, n):
+        return [int(self.movie_ids[i]) for i in top_k(self._scores(kind), n)]
+
+    def _append(self, movie_id):
+        pos = len(self.movie_ids)
+        self._positions[movie_id] = pos
+        self.movie_ids = np.append(self.movie_ids, movie_id)
+        self.counts = np.append(self.counts, 0)
+        self.sums = np.append(self.sums, 0.0)
+        self.decayed = np.append(self.decayed, 0.0)
+        return pos
+
+
+popularity = PopularityRanking()
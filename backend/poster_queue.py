@@ -0,0 +1,285 @@
+"""Background backfill of missing movie posters.
+
+Routes that return movies call enqueue_missing() with the movie dicts they
+are about to send; movies without a poster_url get a row in poster_jobs and
+the response goes out straight away with whatever poster data exists. A
+worker thread per process claims due jobs in batches, looks them up on
+TMDB (concurrently, under the shared rate limit), stores the poster and
+deletes the job.
+
+Jobs live in the database, so they survive restarts and several gunicorn
+workers can drain the same queue: a batch is claimed by flipping its rows
+to 'running' under this worker's id, and a claim older than LEASE_SECONDS
+(worker died mid-batch) is picked up again. Failed lookups are retried
+with exponential backoff up to MAX_ATTEMPTS, then left as 'failed'.
+Movies TMDB has no poster for are kept as 'not_found' so they are not
+enqueued again on every request. Both are retried when the movie is
+enqueued again RETRY_SECONDS after the job ended (TMDB may have added the
+poster, or the outage is over).
+
+info() reports queue depth by status, the age of the oldest pending job
+and recent throughput; it is served at /api/metrics/poster-queue.
+"""
+import os
+import time
+import socket
+import threading
+from collections import deque
+from flask import current_app
+from sqlalchemy import and_, func, insert, or_, update
+from sqlalchemy.orm import Session
+from models import Movie, PosterJob, db
+from movie_cache import bump_movies_version, movie_cache
+from tmdb_cache import DETAILS_APPEND, tmdb_cache
+from tmdb_client import POSTER_BASE_URL, TMDBClient
+
+MAX_ATTEMPTS = 5
+LEASE_SECONDS = 300
+RETRY_BASE_SECONDS = 60
+# Window for the throughput figure in info()
+THROUGHPUT_WINDOW = 60
+TERMINAL = ('failed', 'not_found')
+
+
+def _insert_or_revive(session, rows, revive_before):
+    """INSERT poster_jobs rows. Movies that already have a job keep it,
+    unless it ended (failed / not_found) before revive_before: then it is
+    reset to a fresh pending job."""
+    jobs = PosterJob.__table__
+    # No IN (...): expanding parameters don't work with executemany
+    stale = and_(or_(*(jobs.c.status == status for status in TERMINAL)), jobs.c.updated_at <= revive_before)
+    dialect = session.bind.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        ids = [row['movie_id'] for row in rows]
+        existing = {mid for (mid,) in session.query(PosterJob.movie_id).filter(PosterJob.movie_id.in_(ids))}
+        new = [row for row in rows if row['movie_id'] not in existing]
+        if new:
+            session.execute(insert(jobs), new)
+        for row in rows:
+            if row['movie_id'] in existing:
+                session.execute(update(jobs).where(jobs.c.movie_id == row['movie_id'], stale).values(
+                    row, claimed_by=None))
+        return
+    statement = dialect_insert(jobs)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=[jobs.c.movie_id],
+        set_={name: statement.excluded[name] for name in
+              ('tmdb_id', 'status', 'attempts', 'run_after', 'enqueued_at', 'updated_at')} | {'claimed_by': None},
+        where=stale
+    ), rows)
+
+
+class PosterQueue:
+    def __init__(self, batch_size=None, poll_seconds=None, concurrency=None, client=None):
+        self.batch_size = batch_size or int(os.environ.get('POSTER_QUEUE_BATCH', 20))
+        self.poll_seconds = poll_seconds or float(os.environ.get('POSTER_QUEUE_POLL_SECONDS', 5))
+        self.concurrency = concurrency or int(os.environ.get('POSTER_QUEUE_CONCURRENCY', 4))
+        self.retry_seconds = float(os.environ.get('POSTER_QUEUE_RETRY_SECONDS', 86400))
+        self._client = client
+        # Movie id -> when this process last enqueued it (or saw its job
+        # end), so hot pages don't write to poster_jobs on every request.
+        # Entries expire after retry_seconds so ended jobs can be retried.
+        self._known = {}
+        self._pruned_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.worker_id = None
+        self._completed = deque()
+        self.stats = {'enqueued': 0, 'processed': 0, 'updated': 0, 'not_found': 0,
+                      'retried': 0, 'failed': 0, 'batches': 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = TMDBClient(concurrency=self.concurrency)
+        return self._client
+
+    def enqueue_missing(self, movies_data):
+        """Queue poster lookups for movie dicts with a tmdb_id but no poster_url."""
+        items = [(m.get('movie_id') or m.get('id'), m['tmdb_id'])
+                 for m in movies_data or [] if not m.get('poster_url') and m.get('tmdb_id')]
+        return self.enqueue(items)
+
+    def enqueue(self, items):
+        """Queue (movie_id, tmdb_id) pairs; returns how many were new to this process."""
+        clock = time.monotonic()
+        with self._lock:
+            if clock - self._pruned_at > 60:
+                self._known = {mid: at for mid, at in self._known.items() if clock - at < self.retry_seconds}
+                self._pruned_at = clock
+            new = {}
+            for movie_id, tmdb_id in items:
+                movie_id = int(movie_id)
+                known_at = self._known.get(movie_id)
+                if known_at is None or clock - known_at >= self.retry_seconds:
+                    new[movie_id] = int(tmdb_id)
+                    self._known[movie_id] = clock
+        if not new:
+            return 0
+
+        now = int(time.time())
+        rows = [{'movie_id': movie_id, 'tmdb_id': tmdb_id, 'status': 'pending', 'attempts': 0,
+                 'run_after': now, 'enqueued_at': now, 'updated_at': now}
+                for movie_id, tmdb_id in new.items()]
+        # Own session, so the request's transaction is untouched
+        try:
+            with Session(db.engine) as session:
+                _insert_or_revive(session, rows, revive_before=now - self.retry_seconds)
+                session.commit()
+        except Exception as e:
+            print(f"Failed to enqueue poster jobs: {e}")
+            with self._lock:
+                for movie_id in new:
+                    self._known.pop(movie_id, None)
+            return 0
+
+        with self._lock:
+            self.stats['enqueued'] += len(new)
+        self.start()
+        self._wakeup.set()
+        return len(new)
+
+    def start(self, app=None):
+        """Start this process's worker thread if it is not running (e.g. after a fork)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if not self.client.api_key:
+                # Jobs stay queued until a worker with a key picks them up
+                if self._pid != os.getpid():
+                    print("WARNING: TMDB_API_KEY not set, poster queue worker not started.")
+                    self._pid = os.getpid()
+                return
+            app = app or current_app._get_current_object()
+            self._pid = os.getpid()
+            self.worker_id = f"{socket.gethostname()}:{self._pid}"
+            self._thread = threading.Thread(target=self._run, args=(app,), name='poster-queue', daemon=True)
+            self._thread.start()
+
+    def info(self):
+        now = int(time.time())
+        counts = dict(db.session.query(PosterJob.status, func.count()).group_by(PosterJob.status).all())
+        oldest = db.session.query(func.min(PosterJob.enqueued_at)).filter(PosterJob.status == 'pending').scalar()
+        with self._lock:
+            while self._completed and self._completed[0][0] < time.time() - THROUGHPUT_WINDOW:
+                self._completed.popleft()
+            recent = sum(n for _, n in self._completed)
+            stats = dict(self.stats)
+        return dict(
+            stats,
+            depth=counts.get('pending', 0),
+            running=counts.get('running', 0),
+            failed_jobs=counts.get('failed', 0),
+            not_found_jobs=counts.get('not_found', 0),
+            oldest_pending_seconds=now - oldest if oldest else 0,
+            throughput_per_min=round(recent * 60 / THROUGHPUT_WINDOW, 1),
+            worker_alive=bool(self._thread and self._thread.is_alive() and self._pid == os.getpid()),
+            worker_id=self.worker_id,
+        )
+
+    def _run(self, app):
+        with app.app_context():
+            while True:
+                self._wakeup.clear()
+                try:
+                    processed = self._work_batch()
+                except Exception as e:
+                    print(f"Poster queue batch failed: {e}")
+                    db.session.rollback()
+                    processed = 0
+                finally:
+                    db.session.remove()
+                if not processed:
+                    self._wakeup.wait(self.poll_seconds)
+
+    def _claim(self):
+        now = int(time.time())
+        due = or_(
+            and_(PosterJob.status == 'pending', PosterJob.run_after <= now),
+            and_(PosterJob.status == 'running', PosterJob.updated_at < now - LEASE_SECONDS),
+        )
+        ids = [mid for (mid,) in db.session.query(PosterJob.movie_id).filter(due)
+               .order_by(PosterJob.enqueued_at).limit(self.batch_size)]
+        if not ids:
+            return []
+        # Only rows still due flip to ours, so two workers never share a job
+        db.session.query(PosterJob).filter(PosterJob.movie_id.in_(ids), due).update(
+            {'status': 'running', 'claimed_by': self.worker_id, 'updated_at': now},
+            synchronize_session=False)
+        db.session.commit()
+        return db.session.query(PosterJob.movie_id, PosterJob.tmdb_id).filter(
+            PosterJob.movie_id.in_(ids), PosterJob.status == 'running',
+            PosterJob.claimed_by == self.worker_id, PosterJob.updated_at == now
+        ).all()
+
+    def _work_batch(self):
+        jobs = self._claim()
+        if not jobs:
+            return 0
+        tmdb_ids = dict(jobs)
+        posters, missing, errors = {}, [], []
+        for movie_id, data, error in self.client.fetch_many(jobs, append_to_response=DETAILS_APPEND):
+            if error:
+                errors.append(movie_id)
+                print(f"Poster lookup failed for movie {movie_id}: {error}")
+                continue
+            # Same response the details page needs, so warm its cache too
+            tmdb_cache.put(tmdb_ids[movie_id], data)
+            if data and data.get('poster_path'):
+                posters[movie_id] = f"{POSTER_BASE_URL}{data['poster_path']}"
+            else:
+                missing.append(movie_id)
+
+        now = int(time.time())
+        if posters:
+            for movie in Movie.query.filter(Movie.id.in_(list(posters))):
+                if not movie.poster_url:
+                    movie.poster_url = posters[movie.id]
+            bump_movies_version()
+            PosterJob.query.filter(PosterJob.movie_id.in_(list(posters))).delete(synchronize_session=False)
+        if missing:
+            PosterJob.query.filter(PosterJob.movie_id.in_(missing)).update(
+                {'status': 'not_found', 'claimed_by': None, 'updated_at': now}, synchronize_session=False)
+        gave_up = []
+        for job in PosterJob.query.filter(PosterJob.movie_id.in_(errors)) if errors else []:
+            job.attempts += 1
+            job.claimed_by = None
+            job.updated_at = now
+            if job.attempts >= MAX_ATTEMPTS:
+                job.status = 'failed'
+                gave_up.append(job.movie_id)
+            else:
+                job.status = 'pending'
+                job.run_after = now + RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+        db.session.commit()
+        if posters:
+            movie_cache.invalidate(list(posters))
+            print(f"Poster queue: stored {len(posters)} posters")
+
+        done = len(posters) + len(missing)
+        clock = time.monotonic()
+        with self._lock:
+            for movie_id in posters:
+                self._known.pop(movie_id, None)
+            # Ended jobs can be revived retry_seconds from now; expire the
+            # entry then, so the next request after that re-enqueues it
+            for movie_id in missing + gave_up:
+                if movie_id in self._known:
+                    self._known[movie_id] = clock
+            self._completed.append((time.time(), done))
+            self.stats['batches'] += 1
+            self.stats['processed'] += done
+            self.stats['updated'] += len(posters)
+            self.stats['not_found'] += len(missing)
+            self.stats['retried'] += len(errors) - len(gave_up)
+            self.stats['failed'] += len(gave_up)
+        return len(jobs)
+
+
+poster_queue = PosterQueue()
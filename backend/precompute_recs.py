@@ -0,0 +1,150 @@
+"""Precompute the top-N personalized list of every user in the model.
+
+Runs after train_model.py. Scores users in chunks (one matrix-matrix
+product per chunk) across a process pool and writes a compact store
+(RECS_PATH, same artifact format as the model) that /api/recommend serves
+from. Users who rated anything after the model was trained (or after the
+precompute started) are scored live instead.
+
+Chunks are sized from the catalog so each worker's score block stays
+under CHUNK_BYTES, and the pool defaults to the CPUs this process may run
+on (not the host's), at most MAX_WORKERS.
+
+Usage: python precompute_recs.py [--n 50] [--chunk USERS] [--workers N]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from app import create_app
+from models import Rating, db
+from artifact import load_artifact, resolve_artifact, save_artifact
+from idmap import IdIndex
+from ranking import top_k_rows
+from train_model import MODEL_PATH, stage
+
+sys.path.append(os.getcwd())
+
+RECS_PATH = 'recs'
+N_RECS = 50
+# Scratch memory per worker for one chunk of scores, and default pool cap
+CHUNK_BYTES = 64 * 1024 * 1024
+MAX_WORKERS = 4
+# float32 scores + argpartition's float32 copy and int64 result, per cell
+BYTES_PER_SCORE = 16
+
+# Per-worker state, set up once by _init_worker
+_model = None
+_seen = None
+
+
+def _init_worker(model_path, seen_dir):
+    # Both the model and the seen matrix are memory-mapped, so workers share
+    # their pages instead of receiving a pickled copy each
+    global _model, _seen
+    _, _model = load_artifact(model_path)
+    _seen = {name: np.load(os.path.join(seen_dir, f"{name}.npy"), mmap_mode='r')
+             for name in ('indptr', 'indices')}
+
+
+def _score_chunk(task):
+    start, stop, n = task
+    user_factors = _model['user_factors'][start:stop]
+    pred_ratings = user_factors @ _model['item_factors'].T + _model['user_means'][start:stop, None]
+
+    # Mask already-rated movies: CSR row r holds the seen movie positions of user start + r
+    indptr = _seen['indptr'][start:stop + 1]
+    cols = _seen['indices'][indptr[0]:indptr[-1]]
+    rows = np.repeat(np.arange(stop - start), np.diff(indptr))
+    pred_ratings[rows, cols] = -np.inf
+
+    top = top_k_rows(pred_ratings, n)
+    scores = np.take_along_axis(pred_ratings, top, axis=1).astype(np.float32)
+    movie_idx = top.astype(np.int32)
+    movie_idx[~np.isfinite(scores)] = -1
+    return start, movie_idx, scores
+
+
+def default_workers():
+    """CPUs this process may run on (not the host's core count), capped."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, MAX_WORKERS))
+
+
+def precompute(n=N_RECS, chunk_size=None, workers=None):
+    tracemalloc.start()
+    # Pin the current model version, so a model published mid-run does not
+    # reach some pool workers and not others
+    model_path = resolve_artifact(MODEL_PATH)
+    manifest, model = load_artifact(model_path)
+    user_index = IdIndex(model['user_ids'])
+    movie_index = IdIndex(model['movie_ids'])
+    n_users, n_movies = len(user_index), len(movie_index)
+    n = min(n, n_movies)
+
+    # Ratings written from here on are newer than the store
+    computed_at = int(time.time())
+
+    app = create_app()
+    with stage("load ratings"), app.app_context():
+        query = db.session.query(Rating.user_id, Rating.movie_id).statement
+        df = pd.read_sql(query, db.engine)
+
+    with stage("build seen matrix"):
+        rows = user_index.lookup(df['user_id'].to_numpy())
+        cols = movie_index.lookup(df['movie_id'].to_numpy())
+        known = (rows >= 0) & (cols >= 0)
+        seen = sparse.csr_matrix(
+            (np.ones(int(known.sum()), dtype=np.int8), (rows[known], cols[known])),
+            shape=(n_users, n_movies)
+        )
+        del df, rows, cols, known
+
+    movie_idx = np.empty((n_users, n), dtype=np.int32)
+    scores = np.empty((n_users, n), dtype=np.float32)
+    chunk_size = chunk_size or max(1, CHUNK_BYTES // (BYTES_PER_SCORE * n_movies))
+    tasks = [(start, min(start + chunk_size, n_users), n) for start in range(0, n_users, chunk_size)]
+    workers = workers or default_workers()
+
+    seen_dir = tempfile.mkdtemp(prefix='seen-')
+    try:
+        np.save(os.path.join(seen_dir, 'indptr.npy'), seen.indptr)
+        np.save(os.path.join(seen_dir, 'indices.npy'), seen.indices)
+        print(f"Scoring {n_users} users x {n_movies} movies in {len(tasks)} chunks on {workers} workers...")
+        with stage("score users"), Pool(workers, initializer=_init_worker, initargs=(model_path, seen_dir)) as pool:
+            for start, chunk_idx, chunk_scores in pool.imap_unordered(_score_chunk, tasks):
+                movie_idx[start:start + len(chunk_idx)] = chunk_idx
+                scores[start:start + len(chunk_idx)] = chunk_scores
+    finally:
+        shutil.rmtree(seen_dir, ignore_errors=True)
+
+    with stage("save store"):
+        save_artifact(
+            RECS_PATH,
+            {'movie_idx': movie_idx, 'scores': scores},
+            computed_at=computed_at,
+            model_created_at=manifest['created_at'],
+            n_recs=n
+        )
+    print(f"Top-{n} recommendations for {n_users} users saved to {RECS_PATH}/")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, default=N_RECS, help='recommendations stored per user')
+    parser.add_argument('--chunk', type=int, default=None,
+                        help='users scored per task (default: sized to CHUNK_BYTES)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f'pool size (default: usable CPUs, at most {MAX_WORKERS})')
+    args = parser.parse_args()
+    precompute(n=args.n, chunk_size=args.chunk, workers=args.workers)
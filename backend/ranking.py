@@ -0,0 +1,82 @@
+import numpy as np
+
+
+def top_k(scores, k, exclude=None):
+    """Return indices of the k highest scores, best first.
+
+    Uses argpartition so only the k survivors get sorted. `exclude` is an
+    optional boolean mask (same length as scores) of positions to skip,
+    e.g. movies the user has already rated.
+    """
+    if exclude is not None:
+        scores = np.where(exclude, -np.inf, scores)
+        k = min(k, len(scores) - int(np.count_nonzero(exclude)))
+    else:
+        k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def top_k_rows(scores, k):
+    """Row-wise top_k for a 2-D score matrix.
+
+    Returns an (n_rows, k) array of column indices, best first per row.
+    Excluded entries should be set to -inf beforehand; if a row has fewer
+    than k finite scores, its trailing indices point at -inf entries.
+    """
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.intp)
+
+    if k < n_cols:
+        candidates = np.argpartition(scores, -k, axis=1)[:, -k:]
+    else:
+        candidates = np.tile(np.arange(n_cols), (n_rows, 1))
+    order = np.argsort(np.take_along_axis(scores, candidates, axis=1), axis=1)[:, ::-1]
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def normalize_rows(matrix, dtype=np.float32):
+    """Return a C-contiguous copy of matrix with every row scaled to unit L2 norm.
+
+    All-zero rows are left as zeros so they score 0 against everything.
+    """
+    matrix = np.array(matrix, dtype=dtype, order='C', copy=True)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    matrix /= norms
+    return matrix
+
+
+def neighbor_table(item_vectors, n_neighbors, chunk_size=1024):
+    """Top-n cosine neighbors for every row of a unit-normalized item matrix.
+
+    Returns (indices, scores): int32 and float32 arrays of shape
+    (n_items, n_neighbors), best first, never including the item itself.
+    Rows are scored in chunks so the similarity block stays bounded.
+    """
+    n_items = len(item_vectors)
+    n_neighbors = min(n_neighbors, n_items - 1)
+    indices = np.empty((n_items, n_neighbors), dtype=np.int32)
+    scores = np.empty((n_items, n_neighbors), dtype=np.float32)
+    if n_neighbors <= 0:
+        return indices, scores
+
+    for start in range(0, n_items, chunk_size):
+        stop = min(start + chunk_size, n_items)
+        block = item_vectors[start:stop] @ item_vectors.T
+        rows = np.arange(stop - start)
+        block[rows, rows + start] = -np.inf
+
+        top = top_k_rows(block, n_neighbors)
+        indices[start:stop] = top
+        scores[start:stop] = np.take_along_axis(block, top, axis=1)
+
+    return indices, scores
@@ -1,218 +1,626 @@
-import pickle
+import os
+import time
+import threading
 import numpy as np
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from models import Movie, Rating, db
+from ann import DEFAULT_N_PROBE, ExactIndex, IVFIndex
+from artifact import MANIFEST, artifact_lock, current_version, load_artifact, resolve_artifact, save_artifact
+from idmap import IdIndex
+from models import Rating, db
+from movie_cache import movie_cache
+from popularity import popularity
+from ranking import top_k, top_k_rows
+
+# Users scored per matrix-matrix product in get_recommendations_batch;
+# bounds the score block to BATCH_CHUNK_USERS x n_movies floats
+BATCH_CHUNK_USERS = 256
+# Users need this many ratings before they are folded into the model; with
+# fewer, the centered rating vector says next to nothing (one rating centers
+# to zero) and cold-start similarity is the better guess
+FOLD_IN_MIN_RATINGS = int(os.environ.get('FOLD_IN_MIN_RATINGS', 3))
+
+
+class ModelState:
+    """One loaded model version: the memory-mapped arrays, id and ANN
+    indexes, the precomputed recs built from it and its fold-in overlay.
+
+    Recommender serves from a single ModelState reference and swaps it for
+    a freshly loaded one on reload. Request code reads recommender.model
+    once and uses that object throughout, so a request never mixes two
+    versions. Apart from the overlay nothing here changes after load.
+    """
+
+    def __init__(self, manifest, arrays, ann_n_probe=DEFAULT_N_PROBE):
+        self.manifest = manifest
+        self.created_at = manifest['created_at']
+        self.version = manifest.get('version') or \
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(self.created_at))
+        meta = manifest['meta']
+        self.global_mean = meta.get('global_mean', 3.5)
+        # Ratings written after this are not in the factors and get folded in
+        self.ratings_as_of = meta.get('ratings_as_of', self.created_at)
+
+        self.user_ids = arrays['user_ids']
+        self.movie_ids = arrays['movie_ids']
+        self.user_means = arrays['user_means']
+        self.user_factors = arrays['user_factors']
+        self.item_factors = arrays['item_factors']
+        self.item_vectors = arrays['item_vectors']
+        self.user_index = IdIndex(self.user_ids)
+        self.movie_index = IdIndex(self.movie_ids)
+
+        # Precomputed item-item neighbors; without them get_similar_movies
+        # scores against the whole catalog
+        self.neighbor_idx = arrays.get('neighbor_idx')
+        self.neighbor_scores = arrays.get('neighbor_scores')
+
+        # IVF index for similarity retrieval, exact brute-force search otherwise
+        self.item_index = ExactIndex(self.item_vectors)
+        if 'ivf_centroids' in arrays:
+            self.item_index = IVFIndex.from_arrays(arrays, self.item_vectors, n_probe=ann_n_probe)
+
+        # Per-user top-N store from precompute_recs.py (see Recommender._load_recs)
+        self.rec_movie_idx = None
+        self.rec_scores = None
+        self.recs_computed_at = None
+
+        # Fold-in overlay: user_id -> (factor row, mean, latest rating
+        # timestamp, rating count) for users who rated after training
+        self.overlay = {}
+        self.overlay_lock = threading.Lock()
+        self.overlay_dirty = False
+        self.overlay_saved_at = time.monotonic()
+
+        # What the files looked like when this was loaded (Recommender.reload)
+        self.source = None
+        self.loaded_at = None
+        self.load_seconds = None
+
+    def seen_mask(self, movie_ids):
+        """Boolean mask over model movie positions, True for the given movie ids."""
+        seen = np.zeros(len(self.movie_ids), dtype=bool)
+        idx = self.movie_index.lookup(movie_ids)
+        seen[idx[idx >= 0]] = True
+        return seen
+
+    def fold_in(self, ratings):
+        """Factor row and mean for a user from (movie_id, rating) pairs, or
+        None with fewer than FOLD_IN_MIN_RATINGS ratings on model movies or
+        when they all have the same value (centered to zero, no preference).
+
+        Least-squares projection of the user's centered rating row onto the
+        item factors. The factors are the orthonormal right singular vectors
+        and unrated movies count as zero, as in training, so the solution
+        is r @ V over the rated movies: exactly what TruncatedSVD.transform
+        gives a training row, without refitting anything.
+        """
+        if not ratings:
+            return None
+        values = np.array([rating for _, rating in ratings], dtype=np.float32)
+        mean = float(values.mean())
+        idx = self.movie_index.lookup([mid for mid, _ in ratings])
+        known = idx >= 0
+        if known.sum() < FOLD_IN_MIN_RATINGS or np.all(values[known] == values[known][0]):
+            return None
+        user_vec = (values[known] - mean) @ self.item_factors[idx[known]]
+        return user_vec.astype(np.float32), mean
+
+    def info(self):
+        return {
+            'version': self.version,
+            'created_at': self.created_at,
+            'loaded_at': self.loaded_at,
+            'load_seconds': self.load_seconds,
+            'ratings_as_of': self.ratings_as_of,
+            'n_users': len(self.user_ids),
+            'n_movies': len(self.movie_ids),
+            'n_components': int(self.item_factors.shape[1]),
+            'index': type(self.item_index).__name__,
+            'neighbors': self.neighbor_idx is not None,
+            'recs_computed_at': self.recs_computed_at,
+            'overlay_users': len(self.overlay)
+        }
+
 
 class Recommender:
-    def __init__(self, model_path='model.pkl'):
+    def __init__(self, model_path='model', recs_path='recs', overlay_path='model_overlay'):
         self.model_path = model_path
-        self.loaded = False
-        self.svd = None
-        self.user_ids = []
-        self.movie_ids = []
-        self.user_map = {}
-        self.movie_map = {}
-        self.user_means = {}
-        self.matrix_reduced = None
-        self.components = None
-        self.global_mean = 3.5
-        
+        self.recs_path = recs_path
+        self.overlay_path = overlay_path
+        # Lists probed per IVF query: higher means better recall, slower queries
+        self.ann_n_probe = int(os.environ.get('ANN_NPROBE', DEFAULT_N_PROBE))
+        self.overlay_save_interval = float(os.environ.get('FOLD_IN_SAVE_SECONDS', 60))
+        # How often the watcher looks for a new model version (0 = never)
+        self.watch_interval = float(os.environ.get('MODEL_WATCH_SECONDS', 10))
+        # The active ModelState; replaced wholesale, never modified in place
+        self.model = None
+        self.previous_version = None
+        self._reload_lock = threading.Lock()
+        self._overlay_saving = False
+        self._watcher = None
+        self._watcher_pid = None
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
     def load_model(self):
+        """Open the current model artifact written by train_model.py and make
+        it the active model. Returns True if a model was loaded.
+
+        All arrays are memory-mapped read-only: user/item factors as
+        float32 rows, item_vectors pre-normalized for cosine similarity,
+        plus the optional neighbor table and IVF index.
+        """
+        with self._reload_lock:
+            model = self._load_state()
+            if model is None:
+                return False
+            self._activate(model)
+            return True
+
+    def reload(self, force=False):
+        """Load and switch to the current model version if the files changed
+        since the active one was loaded (a new model version or a new recs
+        store). Requests keep using the old model until the swap, which is
+        a single reference assignment. Returns True if the model changed."""
+        with self._reload_lock:
+            active = self.model
+            if not force and active is not None and active.source == self._source():
+                return False
+            model = self._load_state()
+            if model is None:
+                return False
+            self._activate(model)
+            return True
+
+    def start_watcher(self):
+        """Start the background thread that calls reload() every
+        watch_interval seconds. Safe to call again after a fork."""
+        if self.watch_interval <= 0:
+            return
+        if self._watcher is not None and self._watcher.is_alive() and self._watcher_pid == os.getpid():
+            return
+        self._watcher_pid = os.getpid()
+        self._watcher = threading.Thread(target=self._watch, name='model-watcher', daemon=True)
+        self._watcher.start()
+
+    def info(self):
+        """Active model version and load time, for the admin endpoint."""
+        model = self.model
+        info = model.info() if model is not None else {'version': None}
+        info.update(
+            loaded=model is not None,
+            previous_version=self.previous_version,
+            watching=bool(self._watcher and self._watcher.is_alive() and self._watcher_pid == os.getpid()),
+            watch_seconds=self.watch_interval,
+            pid=os.getpid()
+        )
+        return info
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"Model reload failed: {e}")
+
+    def _source(self):
+        """(model version, manifest mtimes) identifying the files on disk."""
+        def mtime(path):
+            try:
+                return os.stat(os.path.join(path, MANIFEST)).st_mtime_ns
+            except FileNotFoundError:
+                return None
+        return (current_version(self.model_path), mtime(resolve_artifact(self.model_path)), mtime(self.recs_path))
+
+    def _load_state(self):
+        start = time.perf_counter()
+        source = self._source()
         try:
-            with open(self.model_path, 'rb') as f:
-                data = pickle.load(f)
-                self.svd = data['svd']
-                self.user_ids = data['user_ids']
-                self.movie_ids = data['movie_ids']
-                self.user_means = data['user_means']
-                self.matrix_reduced = data['matrix_reduced']
-                self.components = data['components']
-                self.global_mean = data.get('global_mean', 3.5)
-                
-                self.user_map = {uid: i for i, uid in enumerate(self.user_ids)}
-                self.movie_map = {mid: i for i, mid in enumerate(self.movie_ids)}
-                self.loaded = True
-                print("Model loaded successfully.")
+            manifest, arrays = load_artifact(self.model_path)
         except FileNotFoundError:
-            print(f"Model file {self.model_path} not found. Recommendations will be fallback only.")
+            print(f"Model {self.model_path} not found. Recommendations will be fallback only.")
+            return None
         except Exception as e:
             print(f"Error loading model: {e}")
+            return None
+
+        model = ModelState(manifest, arrays, ann_n_probe=self.ann_n_probe)
+        model.source = source
+        print(f"Model {model.version} loaded ({len(model.user_ids)} users, {len(model.movie_ids)} movies, "
+              f"neighbors: {'yes' if model.neighbor_idx is not None else 'no'}, "
+              f"index: {type(model.item_index).__name__}).")
+        self._load_recs(model)
+        self._load_overlay(model)
+        # Fault in the arrays every request reads before taking traffic
+        float(model.item_factors.sum())
+        float(model.item_vectors.sum())
+        model.loaded_at = time.time()
+        model.load_seconds = round(time.perf_counter() - start, 3)
+        return model
+
+    def _activate(self, model):
+        active = self.model
+        if active is not None and active.created_at == model.created_at:
+            # Same model, new recs store: keep the users folded in so far
+            with active.overlay_lock:
+                for uid, entry in active.overlay.items():
+                    model.overlay.setdefault(uid, entry)
+        self.model = model
+        if active is not None:
+            self.previous_version = active.version
+            print(f"Switched model {active.version} -> {model.version} (loaded in {model.load_seconds}s).")
+
+    def _load_recs(self, model):
+        """Open the per-user top-N store written by precompute_recs.py, if it
+        was built from this model."""
+        try:
+            manifest, arrays = load_artifact(self.recs_path)
+        except FileNotFoundError:
+            print(f"Precomputed recommendations {self.recs_path} not found. Scoring live.")
+            return
+        except Exception as e:
+            print(f"Error loading precomputed recommendations: {e}")
+            return
+
+        meta = manifest['meta']
+        if meta.get('model_created_at') != model.created_at or len(arrays['movie_idx']) != len(model.user_ids):
+            print(f"Precomputed recommendations {self.recs_path} belong to another model. Scoring live.")
+            return
+        model.rec_movie_idx = arrays['movie_idx']
+        model.rec_scores = arrays['scores']
+        model.recs_computed_at = meta['computed_at']
+        print(f"Precomputed recommendations loaded (top {meta['n_recs']} per user).")
 
     def get_recommendations(self, user_id, n=5):
-        if not self.loaded:
+        model = self.model
+        if model is None:
             return {'type': 'popular', 'movies': self.get_popular_movies(n)}
-        
-        # Cold start for new user
-        if user_id not in self.user_map:
+
+        # Returning users are served from the precomputed store
+        user_idx = model.user_index.get(user_id)
+        if user_idx is not None:
+            precomputed = self._precomputed_recommendations(model, user_id, user_idx, n)
+            if precomputed is not None:
+                return {'type': 'personalized', 'movies': self._resolve_movie_details(precomputed)}
+
+        # Users who rated since training are scored with their folded-in row
+        ratings = db.session.query(Rating.movie_id, Rating.rating, Rating.timestamp).filter_by(user_id=user_id).all()
+        folded = self._folded_user(model, user_id, ratings)
+        if folded is not None:
+            user_vec, user_mean = folded
+        elif user_idx is not None:
+            user_vec = model.user_factors[user_idx]
+            user_mean = model.user_means[user_idx]
+        else:
+            # Cold start for new user
             print(f"User {user_id} not in model. Trying cold-start recommendations.")
-            cold_start = self.get_cold_start_recommendations(user_id, n)
+            try:
+                cold_start = self._resolve_movie_details(
+                    self._cold_start_items(model, [(mid, rating) for mid, rating, _ in ratings], n))
+            except Exception as e:
+                print(f"Cold-start recommendation error: {e}")
+                cold_start = []
             if cold_start:
                 return {'type': 'similar', 'movies': cold_start}
             return {'type': 'popular', 'movies': self.get_popular_movies(n)}
-        
-        user_idx = self.user_map[user_id]
-        user_vec = self.matrix_reduced[user_idx]
-        user_mean = self.user_means.get(user_id, self.global_mean)
-        
-        # Predict all: dot(user_vec, item_vecs) + mean
-        # item_vecs are in self.components (shape: n_components x n_movies)
-        pred_ratings = np.dot(user_vec, self.components) + user_mean
-        
-        # We need to filter out movies user has already seen.
-        # Ideally we should have a quick lookup set.
-        # Since we don't have the matrix loaded as sparse/dataframe here (to save memory/time?)
-        # Actually pickle had user_item_matrix dataframe, but `train_model` put it in `data`.
-        # Wait, I didn't save `user_item_matrix` in final pickle in `train_model.py`'s last edit?
-        # Let me check `train_model.py`. 
-        # `full_matrix = df.pivot_table...`
-        # `model_data = { ... 'user_ids': list(full_matrix.index), ... }`
-        # I did not save `full_matrix` itself to save space?
-        # No, I didn't. So I can't check what user has seen from the model file efficiently strictly speaking,
-        # unless I query DB or use cached list.
-        # But querying DB for a single user is fast.
-        
-        rated_movies = pd.read_sql(Rating.query.filter_by(user_id=user_id).statement, db.engine)
-        rated_movie_ids = set(rated_movies['movie_id'].tolist())
-        
-        recommendations = []
-        
-        # pred_ratings is an array of size n_movies, corresponding to self.movie_ids
-        # We want indices that sort this array descending
-        
-        # Get top indices (more than n, to filter rated)
-        # Using argpartition is faster than full sort
-        # But simple argsort is fine for 10k items
-        sorted_indices = np.argsort(pred_ratings)[::-1]
-        
-        count = 0
-        for idx in sorted_indices:
-            movie_id = self.movie_ids[idx]
-            if movie_id not in rated_movie_ids:
-                recommendations.append({
-                    'movie_id': int(movie_id),
-                    'predicted_rating': float(pred_ratings[idx])
-                })
-                count += 1
-                if count >= n:
-                    break
-        
+
+        # Predict all: dot(item_vecs, user_vec) + mean
+        # item_vecs are the rows of model.item_factors (shape: n_movies x n_components)
+        pred_ratings = model.item_factors @ user_vec + user_mean
+
+        # Mask out movies the user has already rated, then take the top n
+        # with a partial sort instead of ordering the whole catalog.
+        seen = model.seen_mask([mid for mid, _, _ in ratings])
+
+        recommendations = [{
+            'movie_id': int(model.movie_ids[idx]),
+            'predicted_rating': float(pred_ratings[idx])
+        } for idx in top_k(pred_ratings, n, exclude=seen)]
+
         # Resolve Movie Titles
         return {'type': 'personalized', 'movies': self._resolve_movie_details(recommendations)}
 
+    def _precomputed_recommendations(self, model, user_id, user_idx, n):
+        """Top-n from the precomputed store, or None if there is no usable
+        entry (no store, n deeper than it, or the user rated since the model
+        was trained or the store was built)."""
+        if model.rec_movie_idx is None or n > model.rec_movie_idx.shape[1]:
+            return None
+        # The store scores training rows, so ratings newer than the model
+        # are not in it even when precompute_recs.py ran after them
+        rated_since = db.session.query(Rating.id).filter(
+            Rating.user_id == user_id,
+            Rating.timestamp >= min(model.ratings_as_of, model.recs_computed_at)
+        ).first()
+        if rated_since:
+            return None
+
+        return [{
+            'movie_id': int(model.movie_ids[idx]),
+            'predicted_rating': float(score)
+        } for idx, score in zip(model.rec_movie_idx[user_idx, :n], model.rec_scores[user_idx, :n]) if idx >= 0]
+
+    def get_recommendations_batch(self, user_ids, n=5):
+        """Recommendations for many users in one pass.
+
+        Scores all known users with one matrix-matrix product per chunk,
+        reads every user's ratings with a single query and hydrates all
+        movie details with a single IN query. Returns
+        {user_id: {'type': ..., 'movies': [...]}} in the same shapes as
+        get_recommendations.
+        """
+        user_ids = list(dict.fromkeys(int(uid) for uid in user_ids))
+        if not user_ids:
+            return {}
+        model = self.model
+        if model is None:
+            popular = self.get_popular_movies(n)
+            return {uid: {'type': 'popular', 'movies': [dict(m) for m in popular]} for uid in user_ids}
+
+        ratings_by_user = {}
+        rows = db.session.query(Rating.user_id, Rating.movie_id, Rating.rating, Rating.timestamp).filter(
+            Rating.user_id.in_(user_ids)
+        ).all()
+        for uid, mid, rating, timestamp in rows:
+            ratings_by_user.setdefault(uid, []).append((mid, rating, timestamp))
+
+        # Factor row and mean per user: folded in if they rated since
+        # training, else the model's own row
+        results = {}
+        scored = []
+        positions = model.user_index.lookup(user_ids)
+        for uid, pos in zip(user_ids, positions):
+            folded = self._folded_user(model, uid, ratings_by_user.get(uid, []))
+            if folded is not None:
+                scored.append((uid, *folded))
+            elif pos >= 0:
+                scored.append((uid, model.user_factors[pos], model.user_means[pos]))
+        for start in range(0, len(scored), BATCH_CHUNK_USERS):
+            chunk = scored[start:start + BATCH_CHUNK_USERS]
+            user_vecs = np.stack([vec for _, vec, _ in chunk])
+            user_means = np.array([mean for _, _, mean in chunk], dtype=np.float32)
+            pred_ratings = user_vecs @ model.item_factors.T + user_means[:, None]
+
+            # Mask every user's rated movies, then take the top n per row
+            for row, (uid, _, _) in enumerate(chunk):
+                seen = model.movie_index.lookup([mid for mid, _, _ in ratings_by_user.get(uid, [])])
+                pred_ratings[row, seen[seen >= 0]] = -np.inf
+            top = top_k_rows(pred_ratings, n)
+
+            for row, (uid, _, _) in enumerate(chunk):
+                results[uid] = {'type': 'personalized', 'movies': [{
+                    'movie_id': int(model.movie_ids[idx]),
+                    'predicted_rating': float(pred_ratings[row, idx])
+                } for idx in top[row] if np.isfinite(pred_ratings[row, idx])]}
+
+        # Users outside the model: cold-start from their ratings, else popular
+        popular = None
+        for uid in user_ids:
+            if uid in results:
+                continue
+            try:
+                cold_start = self._cold_start_items(
+                    model, [(mid, rating) for mid, rating, _ in ratings_by_user.get(uid, [])], n)
+            except Exception as e:
+                print(f"Cold-start recommendation error for user {uid}: {e}")
+                cold_start = []
+            if cold_start:
+                results[uid] = {'type': 'similar', 'movies': cold_start}
+                continue
+            if popular is None:
+                popular = self.get_popular_movies(n)
+            results[uid] = {'type': 'popular', 'movies': [dict(m) for m in popular]}
+
+        # Resolve Movie Titles for every personalized and cold-start list at once
+        to_resolve = [r for r in results.values() if r['type'] != 'popular']
+        movies = movie_cache.get_many({item['movie_id'] for r in to_resolve for item in r['movies']})
+        for r in to_resolve:
+            r['movies'] = self._resolve_movie_details(r['movies'], movies=movies)
+
+        return {uid: results[uid] for uid in user_ids}
+
     def get_cold_start_recommendations(self, user_id, n=10):
         """Content-based recommendations for users not in the SVD model.
         Uses the user's own ratings to find similar movies via item embeddings."""
+        model = self.model
+        if model is None:
+            return []
         try:
-            ratings = Rating.query.filter_by(user_id=user_id).all()
-            if not ratings:
-                return []
-
-            # Get highly-rated movies (>= 3.5 stars)
-            liked_movie_ids = [r.movie_id for r in ratings if r.rating >= 3.5]
-            if not liked_movie_ids:
-                # If all ratings are low, use all rated movies
-                liked_movie_ids = [r.movie_id for r in ratings]
-
-            rated_movie_ids = set(r.movie_id for r in ratings)
-
-            # Build a pseudo-user vector by averaging item embeddings of liked movies
-            item_vecs = []
-            for mid in liked_movie_ids:
-                if mid in self.movie_map:
-                    idx = self.movie_map[mid]
-                    item_vecs.append(self.components[:, idx])
-
-            if not item_vecs:
-                return []
-
-            # Average the item vectors to create a user profile
-            user_profile = np.mean(item_vecs, axis=0).reshape(1, -1)
-
-            # Find most similar movies using cosine similarity
-            item_matrix = self.components.T  # (n_movies, n_components)
-            sim_scores = cosine_similarity(user_profile, item_matrix).flatten()
-
-            sorted_indices = np.argsort(sim_scores)[::-1]
-
-            recommendations = []
-            for idx in sorted_indices:
-                movie_id = self.movie_ids[idx]
-                if movie_id not in rated_movie_ids:
-                    recommendations.append({
-                        'movie_id': int(movie_id),
-                        'predicted_rating': float(sim_scores[idx] * 5)  # Scale to 0-5
-                    })
-                    if len(recommendations) >= n:
-                        break
-
-            return self._resolve_movie_details(recommendations)
+            ratings = db.session.query(Rating.movie_id, Rating.rating).filter_by(user_id=user_id).all()
+            return self._resolve_movie_details(self._cold_start_items(model, ratings, n))
         except Exception as e:
             print(f"Cold-start recommendation error: {e}")
             return []
 
+    def _cold_start_items(self, model, ratings, n):
+        """Cold-start candidates from a user's (movie_id, rating) pairs, not yet resolved."""
+        if not ratings:
+            return []
+
+        # Get highly-rated movies (>= 3.5 stars)
+        liked_movie_ids = [mid for mid, rating in ratings if rating >= 3.5]
+        if not liked_movie_ids:
+            # If all ratings are low, use all rated movies
+            liked_movie_ids = [mid for mid, _ in ratings]
+
+        # Build a pseudo-user vector by averaging item embeddings of liked movies
+        liked_idx = model.movie_index.lookup(liked_movie_ids)
+        liked_idx = liked_idx[liked_idx >= 0]
+        if not len(liked_idx):
+            return []
+
+        # Average the item vectors to create a user profile, then retrieve
+        # its nearest neighbors among the normalized item vectors (cosine)
+        user_profile = model.item_factors[liked_idx].mean(axis=0)
+        norm = np.linalg.norm(user_profile)
+        if norm == 0:
+            return []
+        seen = model.seen_mask([mid for mid, _ in ratings])
+        indices, sim_scores = model.item_index.search(user_profile / norm, n, exclude=seen)
+
+        return [{
+            'movie_id': int(model.movie_ids[idx]),
+            'predicted_rating': float(score * 5)  # Scale to 0-5
+        } for idx, score in zip(indices, sim_scores)]
+
+    def fold_in_user(self, user_id):
+        """Refold a user after a rating write, so the next request is
+        personalized with it. Returns True if the overlay has a row for them."""
+        model = self.model
+        if model is None:
+            return False
+        ratings = db.session.query(Rating.movie_id, Rating.rating, Rating.timestamp).filter_by(user_id=user_id).all()
+        with model.overlay_lock:
+            model.overlay.pop(user_id, None)
+        return self._folded_user(model, user_id, ratings) is not None
+
+    def _folded_user(self, model, user_id, ratings):
+        """(factor row, mean) from the overlay for a user with ratings newer
+        than the model, folding them in first if the overlay entry is missing
+        or out of date. None when the model already covers their ratings
+        (or they have too few to fold in)."""
+        latest = max((timestamp or 0 for _, _, timestamp in ratings), default=0)
+        if latest < model.ratings_as_of:
+            return None
+        entry = model.overlay.get(user_id)
+        if entry is not None and entry[2] == latest and entry[3] == len(ratings):
+            return entry[0], entry[1]
+
+        folded = model.fold_in([(mid, rating) for mid, rating, _ in ratings])
+        if folded is None:
+            return None
+        with model.overlay_lock:
+            model.overlay[user_id] = (folded[0], folded[1], latest, len(ratings))
+            model.overlay_dirty = True
+        self._maybe_save_overlay(model)
+        return folded
+
+    def _load_overlay(self, model):
+        """Read the fold-in overlay saved for this model."""
+        entries = self._read_overlay(model)
+        if not entries:
+            return
+        with model.overlay_lock:
+            model.overlay.update(entries)
+        print(f"Fold-in overlay loaded ({len(entries)} users).")
+
+    def save_overlay(self, model=None):
+        """Persist the overlay next to the model, merged with what other
+        workers saved (the newer entry per user wins)."""
+        model = model or self.model
+        if model is None:
+            return
+        with model.overlay_lock:
+            model.overlay_dirty = False
+            model.overlay_saved_at = time.monotonic()
+        # Held across read, merge and write so no worker's entries are lost
+        with artifact_lock(self.overlay_path):
+            saved = self._read_overlay(model) or {}
+            with model.overlay_lock:
+                for uid, entry in saved.items():
+                    current = model.overlay.get(uid)
+                    if current is None or current[2] < entry[2]:
+                        model.overlay[uid] = entry
+                entries = dict(model.overlay)
+            if not entries:
+                return
+
+            uids = sorted(entries)
+            save_artifact(
+                self.overlay_path,
+                {
+                    'user_ids': np.array(uids, dtype=np.int64),
+                    'user_factors': np.stack([entries[uid][0] for uid in uids]).astype(np.float32),
+                    'user_means': np.array([entries[uid][1] for uid in uids], dtype=np.float32),
+                    'as_of': np.array([entries[uid][2] for uid in uids], dtype=np.int64),
+                    'n_ratings': np.array([entries[uid][3] for uid in uids], dtype=np.int64)
+                },
+                lock=False,
+                model_created_at=model.created_at,
+                saved_at=time.time()
+            )
+
+    def _read_overlay(self, model):
+        """Saved overlay entries for this model, or None."""
+        try:
+            manifest, arrays = load_artifact(self.overlay_path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error loading fold-in overlay: {e}")
+            return None
+        if manifest['meta'].get('model_created_at') != model.created_at:
+            return None
+        return {
+            int(uid): (np.array(vec), float(mean), int(as_of), int(count))
+            for uid, vec, mean, as_of, count in zip(
+                arrays['user_ids'], arrays['user_factors'], arrays['user_means'],
+                arrays['as_of'], arrays['n_ratings'])
+        }
+
+    def _maybe_save_overlay(self, model):
+        # At most every overlay_save_interval seconds, off the request thread
+        with model.overlay_lock:
+            if not model.overlay_dirty or self._overlay_saving or \
+                    time.monotonic() - model.overlay_saved_at < self.overlay_save_interval:
+                return
+            self._overlay_saving = True
+
+        def save():
+            try:
+                self.save_overlay(model)
+            except Exception as e:
+                print(f"Error saving fold-in overlay: {e}")
+            finally:
+                self._overlay_saving = False
+
+        threading.Thread(target=save, name='overlay-save', daemon=True).start()
+
     def get_similar_movies(self, movie_id, n=5):
-        if not self.loaded or movie_id not in self.movie_map:
+        model = self.model
+        movie_idx = model.movie_index.get(movie_id) if model is not None else None
+        if movie_idx is None:
             return []
-            
-        movie_idx = self.movie_map[movie_id]
-        # Item embedding: column of components matrix?
-        # svd.components_ shape is (n_components, n_features/movies)
-        # So item vec is column movie_idx
-        item_vec = self.components[:, movie_idx].reshape(1, -1) # Shape (1, n_components)
-        
-        # Similarity with all items (columns of components)
-        # components is (n_components, n_movies). transposing to (n_movies, n_components)
-        item_matrix = self.components.T
-        
-        # Compute cosine similarity
-        sim_scores = cosine_similarity(item_vec, item_matrix).flatten()
-        
-        # Sort
-        sorted_indices = np.argsort(sim_scores)[::-1]
-        
-        similar_movies = []
-        # Skip the first one (itself)
-        for idx in sorted_indices[1:n+1]:
-             similar_movies.append({
-                 'movie_id': int(self.movie_ids[idx]),
-                 'score': float(sim_scores[idx])
-             })
-             
+
+        # Served straight from the precomputed table when it is deep enough
+        if model.neighbor_idx is not None and n <= model.neighbor_idx.shape[1]:
+            similar_movies = [{
+                'movie_id': int(model.movie_ids[idx]),
+                'score': float(score)
+            } for idx, score in zip(model.neighbor_idx[movie_idx, :n], model.neighbor_scores[movie_idx, :n])]
+            return self._resolve_movie_details(similar_movies)
+
+        # Rows of item_vectors are unit length, so the dot product is the
+        # cosine similarity. Take one extra to skip the movie itself.
+        indices, sim_scores = model.item_index.search(model.item_vectors[movie_idx], n + 1)
+        similar_movies = [{
+            'movie_id': int(model.movie_ids[idx]),
+            'score': float(score)
+        } for idx, score in zip(indices, sim_scores) if idx != movie_idx][:n]
+
         return self._resolve_movie_details(similar_movies)
 
-    def get_popular_movies(self, n=5):
-        # Query: Top n most rated movies
-        query = db.session.query(
-            Movie, 
-            db.func.count(Rating.id).label('count')
-        ).join(Rating).group_by(Movie.id).order_by(db.desc('count')).limit(n)
-        
-        results = query.all()
-        # Row is (Movie, count)
-        return [{
-            'movie_id': m[0].id, 
-            'title': m[0].title, 
-            'genres': m[0].genres, 
-            'tmdb_id': m[0].tmdb_id,
-            'poster_url': m[0].poster_url,
-            'release_year': m[0].release_year,
-            'actors': m[0].actors
-        } for m in results]
-
-    def _resolve_movie_details(self, items):
+    def get_popular_movies(self, n=5, kind='count'):
+        # Top n from the in-memory popularity ranking ('count', 'rating' or
+        # 'trending'), details come from the movie cache
+        return movie_cache.get_dicts(popularity.top(n, kind))
+
+    def _resolve_movie_details(self, items, movies=None):
+        """Attach movie details to items. `movies` (id -> MovieRecord) can be
+        passed in when the caller already fetched them for several lists."""
         if not items:
             return []
-        
-        ids = [item['movie_id'] for item in items]
-        movies = Movie.query.filter(Movie.id.in_(ids)).all()
-        movie_map = {m.id: m for m in movies}
-        
+
+        if movies is None:
+            movies = movie_cache.get_many([item['movie_id'] for item in items])
+
         resolved = []
         for item in items:
             mid = item['movie_id']
-            if mid in movie_map:
-                m = movie_map[mid]
+            if mid in movies:
+                m = movies[mid]
                 item['title'] = m.title
                 item['genres'] = m.genres
                 item['tmdb_id'] = m.tmdb_id
@@ -1,7 +1,16 @@
 from flask import Blueprint, jsonify, request
 from models import db, User, Movie, Rating
 from recommender import recommender
+from movie_cache import bump_movies_version, movie_cache
+from popularity import KINDS as POPULARITY_KINDS, popularity
+from movie_stats import apply_rating, movies_with_min_rating
+from catalog_index import catalog_index
+from search_index import search_index
+from tmdb_cache import tmdb_cache
+from poster_queue import poster_queue
 import time
+import hmac
+from functools import wraps
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 import bcrypt
 import os
@@ -18,86 +27,65 @@ if not os.environ.get('TMDB_API_KEY'):
     except:
         pass
 
-import requests
 import os
 
-# Helper to fetch full details from TMDB
+# Helper to fetch full details from TMDB, through the response cache
+# (in-process LRU + tmdb_responses table, see tmdb_cache.py)
 def fetch_tmdb_movie_details(tmdb_id):
-    api_key = os.environ.get('TMDB_API_KEY')
-    if not api_key:
-        # Fallback to hardcoded or shared env if not in os.environ
-        # For now, let's assume it's loaded or use the one from config
-        # In a real app config is better.
-        pass
-    
     if not tmdb_id:
         return None
-
-    try:
-        url = f"https://api.themoviedb.org/3/movie/{tmdb_id}?api_key={api_key}&append_to_response=videos,release_dates"
-        res = requests.get(url, timeout=5)
-        if res.status_code == 200:
-            return res.json()
-    except Exception as e:
-        print(f"Error fetching TMDB details: {e}")
-    return None
+    return tmdb_cache.get_movie(tmdb_id)
 
 def ensure_posters(movies_data):
     """
-    Checks a list of movie dictionaries for missing poster_urls.
-    If missing, fetches from TMDB, updates the DB, and updates the dictionary in-place.
+    Queues a background poster lookup for movies in the list that have no
+    poster_url (see poster_queue.py). Returns immediately; the posters show
+    up in later responses once the worker has stored them.
     """
-    if not movies_data:
-        return
-
-    # Identify movies needing updates
-    missing_indices = []
-    missing_ids = []
-    
-    for i, m in enumerate(movies_data):
-        if not m.get('poster_url') and m.get('tmdb_id'):
-            missing_indices.append(i)
-            missing_ids.append(m.get('movie_id') or m.get('id')) 
-
-    if not missing_ids:
-        return
-
-    # Query DB objects to update
-    movies_to_update = Movie.query.filter(Movie.id.in_(missing_ids)).all()
-    
-    updated_count = 0
-    for mov in movies_to_update:
-        print(f"Fetching missing poster for: {mov.title}")
-        tmdb_info = fetch_tmdb_movie_details(mov.tmdb_id)
-        
-        if tmdb_info:
-            poster_path = tmdb_info.get('poster_path')
-            if poster_path:
-                full_poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}"
-                mov.poster_url = full_poster_url
-                
-                # Update the dictionaries in our list
-                for idx in missing_indices:
-                    item = movies_data[idx]
-                    item_id = item.get('movie_id') or item.get('id')
-                    if item_id == mov.id:
-                        item['poster_url'] = full_poster_url
-                
-                updated_count += 1
-                
-    if updated_count > 0:
-        try:
-            db.session.commit()
-            print(f"Updated posters for {updated_count} movies.")
-        except Exception as e:
-            print(f"Failed to commit poster updates: {e}")
-            db.session.rollback()
+    poster_queue.enqueue_missing(movies_data)
 
 api = Blueprint('api', __name__)
 
 @api.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy'}), 200
+    model = recommender.model
+    return jsonify({'status': 'healthy', 'model_version': model.version if model else None}), 200
+
+def admin_required(view):
+    # Admin endpoints need the X-Admin-Token header to match ADMIN_TOKEN;
+    # with ADMIN_TOKEN unset they are disabled
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = os.environ.get('ADMIN_TOKEN')
+        if not expected:
+            return jsonify({'error': 'Admin endpoints are disabled (ADMIN_TOKEN not set)'}), 403
+        token = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token.encode(), expected.encode()):
+            return jsonify({'error': 'Invalid or missing admin token'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@api.route('/admin/model', methods=['GET'])
+@admin_required
+def model_info():
+    return jsonify(recommender.info())
+
+@api.route('/admin/model/reload', methods=['POST'])
+@admin_required
+def reload_model():
+    # Normally the watcher does this within MODEL_WATCH_SECONDS
+    try:
+        changed = recommender.reload(force=request.args.get('force') == '1')
+        return jsonify(dict(recommender.info(), changed=changed))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/metrics/poster-queue', methods=['GET'])
+def poster_queue_metrics():
+    try:
+        return jsonify(poster_queue.info())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @api.route('/movies/details/<int:movie_id>', methods=['GET'])
 def get_movie_details(movie_id):
@@ -134,9 +122,11 @@ def get_movie_details(movie_id):
                     data['certification'] = cert
         
             # Save details to DB for future speedup
-            if tmdb_data.get('poster_path') and not movie.poster_url:
+            if tmdb_data and tmdb_data.get('poster_path') and not movie.poster_url:
                  movie.poster_url = f"https://image.tmdb.org/t/p/w500{tmdb_data.get('poster_path')}"
+                 bump_movies_version()
                  db.session.commit()
+                 movie_cache.invalidate([movie.id])
 
         return jsonify(data)
     except Exception as e:
@@ -191,41 +181,20 @@ def login():
 
 @api.route('/movies/actors', methods=['GET'])
 def get_top_actors():
-    # Return a curated list of top actors (fetched from loaded movies)
-    # Since we store actors as JSON list in Movie, we need to aggregate.
-    # Postgres specific: SELECT unnest(actors) as actor, count(*) ...
-    # Or just fetch all movies and aggregate in python (easier for small dataset).
+    # Most frequent actors across the catalog, from the in-memory actor index
     try:
-        movies = Movie.query.all()
-        actor_counts = {}
-        for m in movies:
-            if m.actors:
-                for actor in m.actors:
-                    actor_counts[actor] = actor_counts.get(actor, 0) + 1
-        
-        # Sort by count
-        sorted_actors = sorted(actor_counts.items(), key=lambda x: x[1], reverse=True)[:20]
-        return jsonify([{'name': name, 'count': count} for name, count in sorted_actors])
+        index = catalog_index.get()
+        return jsonify([{'name': name, 'count': len(movies)} for name, movies in index.top_actors[:20]])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @api.route('/movies/actor/<string:actor_name>', methods=['GET'])
 def get_movies_by_actor(actor_name):
-    # Filter movies where actor in actors list
+    # Posting list lookup for the actor (exact name)
     try:
-        movies = Movie.query.all()
-        matching = [m for m in movies if m.actors and actor_name in m.actors]
-        
-        matching_dicts = [{
-            'movie_id': m.id, 
-            'title': m.title, 
-            'genres': m.genres, 
-            'poster_url': m.poster_url,
-            'release_year': m.release_year,
-            'actors': m.actors,
-            'tmdb_id': m.tmdb_id
-        } for m in matching[:10]]
-        
+        movie_ids = catalog_index.get().movies_by_actor(actor_name)[:10]
+        matching_dicts = movie_cache.get_dicts([int(mid) for mid in movie_ids])
+
         ensure_posters(matching_dicts)
         return jsonify(matching_dicts)
     except Exception as e:
@@ -235,27 +204,12 @@ def get_movies_by_actor(actor_name):
 @api.route('/movies/genre/<string:genre_name>', methods=['GET'])
 def get_movies_by_genre(genre_name):
     try:
-        # Use LIKE query on genres field (pipe-separated)
-        movies = Movie.query.filter(Movie.genres.ilike(f'%{genre_name}%')).all()
-        # Sort by rating count (proxy for popularity)
-        movies_with_ratings = []
-        for m in movies:
-            count = Rating.query.filter_by(movie_id=m.id).count()
-            movies_with_ratings.append((m, count))
-        movies_with_ratings.sort(key=lambda x: x[1], reverse=True)
-        top = movies_with_ratings[:15]
-
-        result = [{
-            'movie_id': m.id,
-            'title': m.title,
-            'genres': m.genres,
-            'poster_url': m.poster_url,
-            'release_year': m.release_year,
-            'actors': m.actors,
-            'tmdb_id': m.tmdb_id
-        } for m, _ in top]
-
+        # Genre bitmap from the catalog index (exact genre, case-insensitive),
+        # sorted by rating count (proxy for popularity)
+        movie_ids = catalog_index.get().filter(genres=[genre_name])
+        top_ids = popularity.top_among(movie_ids, n=15, kind='count')
 
+        result = movie_cache.get_dicts(top_ids)
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -267,7 +221,7 @@ def filter_movies():
     Filter movies by genre(s), release year range, minimum avg rating, and actor.
     All provided filters are applied as AND conditions.
     Query params:
-      genres     - comma-separated genre names (movie must contain ALL)
+      genres     - comma-separated genre names (movie must have ALL, exact match)
       year_min   - minimum release year (inclusive)
       year_max   - maximum release year (inclusive)
       min_rating - minimum average user rating (0-5)
@@ -280,54 +234,25 @@ def filter_movies():
         min_rating = request.args.get('min_rating', type=float)
         actor_param = request.args.get('actor', '').strip()
 
-        query = Movie.query
-
-        # Year range filter
-        if year_min is not None:
-            query = query.filter(Movie.release_year >= year_min)
-        if year_max is not None:
-            query = query.filter(Movie.release_year <= year_max)
-
-        # Genre filter (movie genres field is pipe-separated e.g. "Action|Drama")
-        if genres_param:
-            selected_genres = [g.strip() for g in genres_param.split(',') if g.strip()]
-            for genre in selected_genres:
-                query = query.filter(Movie.genres.ilike(f'%{genre}%'))
+        selected_genres = [g.strip() for g in genres_param.split(',') if g.strip()]
 
-        # Actor filter
-        if actor_param:
-            # actors is stored as JSON list; use ilike on the JSON string representation
-            query = query.filter(Movie.actors.cast(db.String).ilike(f'%{actor_param}%'))
-
-        movies = query.limit(100).all()
+        # Genre, year and actor conditions are combined on the in-memory
+        # catalog index; only the rating condition needs the database
+        candidates = catalog_index.get().filter(
+            genres=selected_genres,
+            year_min=year_min,
+            year_max=year_max,
+            actor=actor_param or None
+        )
+        rows = movies_with_min_rating(candidates, min_rating, limit=30)
 
-        # Build result dicts
+        records = movie_cache.get_many([movie_id for movie_id, _ in rows])
         results = []
-        for m in movies:
-            avg_rating = None
-            if min_rating is not None:
-                # Compute average rating from ratings table
-                ratings_list = [r.rating for r in m.ratings]
-                if ratings_list:
-                    avg_rating = sum(ratings_list) / len(ratings_list)
-                else:
-                    avg_rating = 0.0
-                if avg_rating < min_rating:
-                    continue  # Skip movies below min rating
-
-            results.append({
-                'movie_id': m.id,
-                'title': m.title,
-                'genres': m.genres,
-                'poster_url': m.poster_url,
-                'release_year': m.release_year,
-                'actors': m.actors,
-                'tmdb_id': m.tmdb_id,
-                'avg_rating': avg_rating
-            })
-
-        # Limit to 30 results
-        results = results[:30]
+        for movie_id, avg_rating in rows:
+            if movie_id in records:
+                item = records[movie_id].to_dict()
+                item['avg_rating'] = avg_rating if avg_rating is not None else 0.0
+                results.append(item)
 
         return jsonify(results)
 
@@ -358,11 +283,52 @@ def recommend(user_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+MAX_BATCH_USERS = 1000
+
+@api.route('/recommend/batch', methods=['POST'])
+def recommend_batch():
+    """
+    Recommendations for many users in one call (for precompute jobs).
+    Body: {"user_ids": [1, 2, ...], "n": 10}
+    """
+    start = time.time()
+    data = request.json or {}
+    user_ids = data.get('user_ids')
+    n = data.get('n', 10)
+
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({'error': 'user_ids must be a non-empty list'}), 400
+    if len(user_ids) > MAX_BATCH_USERS:
+        return jsonify({'error': f'At most {MAX_BATCH_USERS} user_ids per request'}), 400
+
+    if isinstance(n, bool) or not isinstance(n, int):
+        return jsonify({'error': 'n must be an integer'}), 400
+    if n < 1:
+        return jsonify({'error': 'n must be at least 1'}), 400
+
+    try:
+        user_ids = [int(uid) for uid in user_ids]
+        n = min(n, 100)
+        results = recommender.get_recommendations_batch(user_ids, n=n)
+
+        return jsonify({
+            'results': [{
+                'user_id': uid,
+                'recommendations': result['movies'],
+                'type': result['type']
+            } for uid, result in results.items()],
+            'latency_ms': int((time.time() - start) * 1000)
+        })
+    except (TypeError, ValueError):
+        return jsonify({'error': 'user_ids must be integers'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @api.route('/similar/<int:movie_id>', methods=['GET'])
 def similar(movie_id):
     start = time.time()
     try:
-        movie = Movie.query.get(movie_id)
+        movie = movie_cache.get(movie_id)
         if not movie:
             return jsonify({'error': 'Movie not found'}), 404
             
@@ -378,12 +344,14 @@ def similar(movie_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-from sqlalchemy import or_
-
 @api.route('/popular', methods=['GET'])
 def popular():
+    # sort: count (most rated, default), rating (Bayesian average) or trending
+    kind = request.args.get('sort', 'count')
+    if kind not in POPULARITY_KINDS:
+        return jsonify({'error': f"sort must be one of: {', '.join(POPULARITY_KINDS)}"}), 400
     try:
-        movies = recommender.get_popular_movies(n=10)
+        movies = recommender.get_popular_movies(n=10, kind=kind)
         return jsonify(movies)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -396,25 +364,13 @@ def search_movies():
 
     limit = min(int(request.args.get('limit', 20)), 50)
 
-    # Fast DB-only search — no TMDB calls
-    results = Movie.query.filter(
-        or_(
-            Movie.title.ilike(f'%{query}%'),
-            Movie.genres.ilike(f'%{query}%')
-        )
-    ).limit(limit).all()
-
-    results_dicts = [{
-        'movie_id': m.id,
-        'title': m.title,
-        'genres': m.genres,
-        'poster_url': m.poster_url,   # use whatever is already in DB
-        'release_year': m.release_year,
-        'actors': m.actors,
-        'tmdb_id': m.tmdb_id
-    } for m in results]
-
-    return jsonify(results_dicts)
+    # Trigram / prefix index over titles (pg_trgm on Postgres), ranked by
+    # match quality and popularity — no TMDB calls
+    try:
+        movie_ids = search_index.search(query, limit=limit)
+        return jsonify(movie_cache.get_dicts(movie_ids))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @api.route('/rate', methods=['POST'])
 def rate_movie():
@@ -425,6 +381,11 @@ def rate_movie():
     
     if not all([user_id, movie_id, rating_val]):
         return jsonify({'error': 'Missing data'}), 400
+    # Clients may send ids as strings; everything below keys on ints
+    try:
+        user_id, movie_id, rating_val = int(user_id), int(movie_id), float(rating_val)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'user_id and movie_id must be integers, rating a number'}), 400
         
     try:
         # Check if user exists, create if not
@@ -441,19 +402,27 @@ def rate_movie():
             
         # Update or Create Rating
         existing = Rating.query.filter_by(user_id=user_id, movie_id=movie_id).first()
+        old_rating = existing.rating if existing else None
         if existing:
-            existing.rating = float(rating_val)
+            existing.rating = rating_val
             existing.timestamp = int(time.time())
         else:
             new_rating = Rating(
                 user_id=user_id, 
                 movie_id=movie_id, 
-                rating=float(rating_val),
+                rating=rating_val,
                 timestamp=int(time.time())
             )
             db.session.add(new_rating)
-            
+
+        apply_rating(movie_id, rating_val, old_rating=old_rating)
         db.session.commit()
+        popularity.record_rating(movie_id, rating_val, old_rating=old_rating)
+        # Fold the new rating into the user's factors right away
+        try:
+            recommender.fold_in_user(user_id)
+        except Exception as e:
+            print(f"Fold-in failed for user {user_id}: {e}")
         
         return jsonify({'message': 'Rating saved'})
     except Exception as e:
@@ -467,9 +436,10 @@ def get_user_ratings(user_id):
         if not ratings:
             return jsonify([])
 
+        movies = movie_cache.get_many([r.movie_id for r in ratings])
         result = []
         for r in ratings:
-            movie = Movie.query.get(r.movie_id)
+            movie = movies.get(r.movie_id)
             if movie:
                 result.append({
                     'movie_id': movie.id,
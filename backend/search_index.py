@@ -0,0 +1,305 @@
+"""Title search for /api/search (search-as-you-type).
+
+In memory (default on SQLite), TitleIndex keeps per-trigram posting lists
+over normalized titles plus a sorted word vocabulary:
+- queries of 3+ characters intersect the posting lists of their trigrams
+  and verify the substring, so matching costs the shortest posting list
+  rather than a table scan
+- shorter queries, and each word of multi-word queries ("st da" ->
+  "Star Dark"), match word prefixes by bisecting the vocabulary
+- when fewer than `limit` titles contain the query, titles sharing at
+  least FUZZY_MIN_SIMILARITY of its trigrams are added, which tolerates
+  typos ("matirx" -> "Matrix")
+Results are ranked by match quality (title prefix > word prefix >
+substring / genre name > fuzzy), then by rating count.
+
+The index is rebuilt whenever the catalog index is (same 'catalog'
+version). On Postgres the query runs in SQL instead, backed by a pg_trgm
+GIN index on lower(title); SEARCH_BACKEND=memory|postgres overrides the
+choice.
+"""
+import os
+import re
+import time
+import bisect
+import threading
+import unicodedata
+import numpy as np
+from sqlalchemy import case, func, or_, select, text
+from models import Movie, MovieGenre, MovieStats, db
+from catalog_index import catalog_index
+from popularity import popularity
+
+FUZZY_MIN_SIMILARITY = 0.4
+# Queries shorter than this are not typo-corrected; they match too much
+FUZZY_MIN_LENGTH = 4
+# Genre names match queries from this length on ("dra" -> Drama)
+GENRE_MIN_LENGTH = 3
+# Popularity scores are re-read at most this often
+POPULARITY_CHECK_SECONDS = 60
+
+TIER_TITLE_PREFIX = 3
+TIER_WORD_PREFIX = 2
+TIER_SUBSTRING = 1
+TIER_FUZZY = 0
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text_):
+    """Lowercase, strip accents and collapse punctuation to single spaces."""
+    text_ = unicodedata.normalize('NFKD', text_ or '').encode('ascii', 'ignore').decode('ascii')
+    return _NON_WORD.sub(' ', text_.lower()).strip()
+
+
+def trigrams(text_):
+    return {text_[i:i + 3] for i in range(len(text_) - 2)}
+
+
+class TitleIndex:
+    """Trigram and word-prefix index over a fixed list of titles."""
+
+    def __init__(self, movie_ids, titles):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.titles = [normalize(t) for t in titles]
+        # Leading spaces give word-start trigrams ("  s", " st"), so prefix
+        # queries and typos in the first letters still share trigrams
+        self.padded = ['  ' + t + ' ' for t in self.titles]
+
+        # Trigram posting lists, grouped with one argsort into offsets/items
+        self.trigram_ids = {}
+        tri_col, pos_col = [], []
+        for pos, title in enumerate(self.padded):
+            for tri in trigrams(title):
+                tri_col.append(self.trigram_ids.setdefault(tri, len(self.trigram_ids)))
+                pos_col.append(pos)
+        tri_col = np.array(tri_col, dtype=np.int32)
+        order = np.argsort(tri_col, kind='stable')
+        self.trigram_items = np.array(pos_col, dtype=np.int32)[order]
+        self.trigram_offsets = np.zeros(len(self.trigram_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tri_col, minlength=len(self.trigram_ids)), out=self.trigram_offsets[1:])
+
+        # Word vocabulary for short prefix queries
+        words = {}
+        for pos, title in enumerate(self.titles):
+            for word in set(title.split()):
+                words.setdefault(word, []).append(pos)
+        self.vocabulary = sorted(words)
+        self.word_postings = [np.array(words[w], dtype=np.int32) for w in self.vocabulary]
+        self.title_order = np.array(sorted(range(len(self.titles)), key=self.titles.__getitem__), dtype=np.int32)
+        self.sorted_titles = [self.titles[i] for i in self.title_order]
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def _posting(self, tri):
+        tri_id = self.trigram_ids.get(tri)
+        if tri_id is None:
+            return np.empty(0, dtype=np.int32)
+        return self.trigram_items[self.trigram_offsets[tri_id]:self.trigram_offsets[tri_id + 1]]
+
+    def _prefix_positions(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        stop = bisect.bisect_left(self.vocabulary, prefix + '\x7f')
+        if start == stop:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(self.word_postings[start:stop]))
+
+    def _substring_matches(self, query):
+        """(positions, tiers) of titles containing query."""
+        postings = sorted((self._posting(tri) for tri in trigrams(query)), key=len)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        # Verify and grade in one pass
+        word_query = ' ' + query
+        positions, tiers = [], []
+        for pos in candidates:
+            title = self.titles[pos]
+            at = title.find(query)
+            if at < 0:
+                continue
+            positions.append(pos)
+            if at == 0:
+                tiers.append(TIER_TITLE_PREFIX)
+            elif title[at - 1] == ' ' or word_query in title:
+                tiers.append(TIER_WORD_PREFIX)
+            else:
+                tiers.append(TIER_SUBSTRING)
+        return np.array(positions, dtype=np.int32), np.array(tiers, dtype=np.int8)
+
+    def _prefix_matches(self, query):
+        """(positions, tiers) of titles with a word starting with each query word."""
+        words = query.split()
+        positions = self._prefix_positions(words[0])
+        for word in words[1:]:
+            positions = np.intersect1d(positions, self._prefix_positions(word), assume_unique=True)
+        tiers = np.full(len(positions), TIER_WORD_PREFIX, dtype=np.int8)
+        # Titles starting with the query form one contiguous run in sorted order
+        start = bisect.bisect_left(self.sorted_titles, query)
+        stop = bisect.bisect_left(self.sorted_titles, query + '\x7f')
+        if start < stop:
+            tiers[np.isin(positions, self.title_order[start:stop])] = TIER_TITLE_PREFIX
+        return positions, tiers
+
+    def _fuzzy_positions(self, query):
+        query_trigrams = trigrams('  ' + query)
+        hits = [self._posting(tri) for tri in query_trigrams]
+        hits = [h for h in hits if len(h)]
+        if not hits:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.titles))
+        similarity = shared / len(query_trigrams)
+        positions = np.flatnonzero(similarity >= FUZZY_MIN_SIMILARITY).astype(np.int32)
+        return positions, similarity[positions]
+
+    def search(self, query, limit=20, popularity_scores=None, extra_positions=None):
+        """Movie ids of the best `limit` matches for query.
+
+        popularity_scores is aligned with movie_ids and breaks ties within
+        a match tier; extra_positions (e.g. movies of a matching genre)
+        join the substring tier."""
+        query = normalize(query)
+        if not query:
+            return []
+        if len(query) < 3:
+            positions, tiers = self._prefix_matches(query)
+        else:
+            positions, tiers = self._substring_matches(query)
+            if ' ' in query:
+                # "st da" -> "Star Dark": every word as a word prefix
+                extra, extra_tiers = self._prefix_matches(query)
+                new = ~np.isin(extra, positions)
+                positions = np.concatenate([positions, extra[new]])
+                tiers = np.concatenate([tiers, extra_tiers[new]])
+        similarity = np.ones(len(positions))
+
+        if extra_positions is not None and len(extra_positions):
+            extra = np.setdiff1d(extra_positions, positions, assume_unique=True).astype(np.int32)
+            positions = np.concatenate([positions, extra])
+            tiers = np.concatenate([tiers, np.full(len(extra), TIER_SUBSTRING, dtype=np.int8)])
+            similarity = np.concatenate([similarity, np.ones(len(extra))])
+
+        if len(positions) < limit and len(query) >= FUZZY_MIN_LENGTH:
+            fuzzy, fuzzy_similarity = self._fuzzy_positions(query)
+            new = ~np.isin(fuzzy, positions)
+            positions = np.concatenate([positions, fuzzy[new]])
+            tiers = np.concatenate([tiers, np.full(int(new.sum()), TIER_FUZZY, dtype=np.int8)])
+            similarity = np.concatenate([similarity, fuzzy_similarity[new]])
+
+        if not len(positions):
+            return []
+        pop = popularity_scores[positions] if popularity_scores is not None else np.zeros(len(positions))
+        # lexsort: last key is primary; positions last-resort keeps id order
+        order = np.lexsort((positions, -pop, -similarity, -tiers))[:limit]
+        return [int(self.movie_ids[positions[i]]) for i in order]
+
+
+class SearchIndex:
+    def __init__(self, backend=None):
+        self.backend = backend or os.environ.get('SEARCH_BACKEND')
+        self._index = None
+        self._terms = None
+        self._popularity = None
+        self._popularity_at = 0.0
+        self._lock = threading.Lock()
+
+    def search(self, query, limit=20):
+        if self._use_postgres():
+            return search_postgres(query, limit)
+        index, terms = self.get()
+        return index.search(
+            query,
+            limit=limit,
+            popularity_scores=self._popularity_scores(index),
+            extra_positions=self._genre_positions(terms, query)
+        )
+
+    def get(self):
+        """(TitleIndex, TermIndex) pair, rebuilt when the catalog index was."""
+        terms = catalog_index.get()
+        if terms is not self._terms:
+            with self._lock:
+                if terms is not self._terms:
+                    self._index = self._build(terms)
+                    self._terms = terms
+                    self._popularity = None
+        return self._index, self._terms
+
+    def _use_postgres(self):
+        if self.backend is None:
+            self.backend = 'postgres' if db.engine.dialect.name == 'postgresql' else 'memory'
+        return self.backend == 'postgres'
+
+    def _build(self, terms):
+        start = time.time()
+        titles = dict(db.session.query(Movie.id, Movie.title).all())
+        index = TitleIndex(terms.movie_ids, [titles.get(int(mid), '') for mid in terms.movie_ids])
+        print(f"Search index built: {len(index)} titles, {len(index.trigram_ids)} trigrams, "
+              f"{len(index.vocabulary)} words in {time.time() - start:.2f}s")
+        return index
+
+    def _popularity_scores(self, index):
+        now = time.monotonic()
+        if self._popularity is None or now - self._popularity_at > POPULARITY_CHECK_SECONDS:
+            self._popularity = popularity.scores_for(index.movie_ids, kind='count')
+            self._popularity_at = now
+        return self._popularity
+
+    def _genre_positions(self, terms, query):
+        query = query.strip().lower()
+        if len(query) < GENRE_MIN_LENGTH:
+            return None
+        bitmaps = [bitmap for genre, bitmap in terms.genres.items() if genre.startswith(query)]
+        if not bitmaps:
+            return None
+        return np.flatnonzero(np.logical_or.reduce(bitmaps)).astype(np.int32)
+
+
+def ensure_search_indexes():
+    """Create the pg_trgm extension and title trigram index on Postgres."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    try:
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        db.session.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_movies_title_trgm ON movies USING gin (lower(title) gin_trgm_ops)'
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Warning: could not create pg_trgm search index, using in-memory search: {e}")
+        search_index.backend = 'memory'
+
+
+def search_postgres(query, limit=20):
+    """The same ranking as TitleIndex.search, in SQL. LIKE and the pg_trgm
+    similarity operator (%) on lower(title) both use the GIN trigram index."""
+    query = query.strip().lower()
+    if not query:
+        return []
+    title = func.lower(Movie.title)
+    pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    genre_match = Movie.id.in_(
+        select(MovieGenre.movie_id).where(func.lower(MovieGenre.genre).like(f'{pattern}%'))
+    ) if len(query) >= GENRE_MIN_LENGTH else False
+    tier = case(
+        (title.like(f'{pattern}%'), TIER_TITLE_PREFIX),
+        (title.like(f'% {pattern}%'), TIER_WORD_PREFIX),
+        (or_(title.like(f'%{pattern}%'), genre_match), TIER_SUBSTRING),
+        else_=TIER_FUZZY
+    )
+    rows = db.session.query(Movie.id).outerjoin(
+        MovieStats, MovieStats.movie_id == Movie.id
+    ).filter(or_(title.like(f'%{pattern}%'), title.op('%')(query), genre_match)).order_by(
+        tier.desc(),
+        func.similarity(title, query).desc(),
+        func.coalesce(MovieStats.rating_count, 0).desc(),
+        Movie.id
+    ).limit(limit).all()
+    return [movie_id for (movie_id,) in rows]
+
+
+search_index = SearchIndex()
@@ -0,0 +1,190 @@
+"""TTL cache of TMDB movie detail responses for the request path.
+
+Two tiers: an in-process LRU (TMDB_CACHE_SIZE entries) in front of the
+tmdb_responses table, which survives restarts and is shared by every
+gunicorn worker. A response is
+- fresh for TMDB_CACHE_TTL seconds: served from cache
+- stale for TMDB_CACHE_STALE_SECONDS after that: served from cache while
+  a background thread refetches it (stale-while-revalidate)
+- expired beyond that: fetched synchronously, falling back to the expired
+  copy if TMDB fails
+"Not found" answers are cached too, for TMDB_CACHE_NEGATIVE_TTL seconds.
+
+Concurrent misses for the same movie are coalesced: one thread fetches,
+the others wait for its result instead of issuing their own request.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy.orm import Session
+from models import TmdbResponse, db
+from tmdb_client import TMDBClient
+
+DETAILS_APPEND = ('videos', 'release_dates')
+
+
+class _Entry:
+    __slots__ = ('data', 'fetched_at')
+
+    def __init__(self, data, fetched_at):
+        self.data = data
+        self.fetched_at = fetched_at
+
+
+class TMDBCache:
+    def __init__(self, max_size=None, ttl=None, stale_ttl=None, negative_ttl=None, client=None):
+        self.max_size = max_size or int(os.environ.get('TMDB_CACHE_SIZE', 5000))
+        self.ttl = ttl or float(os.environ.get('TMDB_CACHE_TTL', 86400))
+        self.stale_ttl = stale_ttl if stale_ttl is not None else \
+            float(os.environ.get('TMDB_CACHE_STALE_SECONDS', 7 * 86400))
+        self.negative_ttl = negative_ttl or float(os.environ.get('TMDB_CACHE_NEGATIVE_TTL', 3600))
+        self._client = client
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'stale_hits': 0, 'db_hits': 0, 'misses': 0,
+                      'coalesced': 0, 'fetches': 0, 'errors': 0}
+
+    @property
+    def client(self):
+        # Created on first use so the API key loaded by routes.py is picked up;
+        # no retries on the request path, a stale copy is better than waiting
+        if self._client is None:
+            self._client = TMDBClient(max_retries=0)
+        return self._client
+
+    def get_movie(self, tmdb_id, append_to_response=DETAILS_APPEND):
+        """Movie details JSON (or None if TMDB has no such movie)."""
+        key = f"movie/{int(tmdb_id)}?{','.join(append_to_response)}"
+        entry = self._memory_get(key)
+        if entry is None:
+            entry = self._db_get(key)
+
+        if entry is not None:
+            if self._is_fresh(entry):
+                self._count('hits')
+                return entry.data
+            if self._is_fresh(entry, grace=self.stale_ttl):
+                self._count('stale_hits')
+                self._refresh_async(key, tmdb_id, append_to_response)
+                return entry.data
+
+        self._count('misses')
+        fresh = self._fetch_coalesced(key, tmdb_id, append_to_response)
+        if fresh is not None:
+            return fresh.data
+        # TMDB failed: an expired copy beats nothing
+        return entry.data if entry is not None else None
+
+    def put(self, tmdb_id, data, append_to_response=DETAILS_APPEND):
+        """Store a response fetched elsewhere (e.g. by the poster queue)."""
+        key = f"movie/{int(tmdb_id)}?{','.join(append_to_response)}"
+        entry = _Entry(data, time.time())
+        self._memory_put(key, entry)
+        self._db_put(key, entry)
+
+    def invalidate(self, tmdb_id=None):
+        """Drop this process's in-memory copies (all, or one movie's)."""
+        with self._lock:
+            if tmdb_id is None:
+                self._entries.clear()
+            else:
+                prefix = f"movie/{int(tmdb_id)}?"
+                for key in [k for k in self._entries if k.startswith(prefix)]:
+                    del self._entries[key]
+
+    def info(self):
+        return dict(self.stats, size=len(self._entries), max_size=self.max_size)
+
+    def _is_fresh(self, entry, grace=0.0):
+        ttl = self.ttl if entry.data is not None else self.negative_ttl
+        return time.time() - entry.fetched_at < ttl + grace
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _memory_put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _db_get(self, key):
+        try:
+            with Session(db.engine) as session:
+                row = session.get(TmdbResponse, key)
+                if row is None:
+                    return None
+                entry = _Entry(row.payload, row.fetched_at)
+        except Exception as e:
+            print(f"TMDB cache read failed: {e}")
+            return None
+        self._count('db_hits')
+        self._memory_put(key, entry)
+        return entry
+
+    def _db_put(self, key, entry):
+        # Own short-lived session, so the caller's transaction is untouched
+        try:
+            with Session(db.engine) as session:
+                session.merge(TmdbResponse(key=key, payload=entry.data, fetched_at=int(entry.fetched_at)))
+                session.commit()
+        except Exception as e:
+            print(f"TMDB cache write failed: {e}")
+
+    def _fetch_coalesced(self, key, tmdb_id, append_to_response):
+        """Fetch once per key at a time; returns the new entry, or None on failure."""
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            event.wait(self.client.timeout + 1)
+            entry = self._memory_get(key)
+            return entry if entry is not None and self._is_fresh(entry) else None
+
+        try:
+            self._count('fetches')
+            data = self.client.get_movie(tmdb_id, append_to_response)
+            entry = _Entry(data, time.time())
+            self._memory_put(key, entry)
+            self._db_put(key, entry)
+            return entry
+        except Exception as e:
+            self._count('errors')
+            print(f"Error fetching TMDB details: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _refresh_async(self, key, tmdb_id, append_to_response):
+        with self._lock:
+            if key in self._inflight:
+                return
+        app = current_app._get_current_object()
+
+        def refresh():
+            with app.app_context():
+                self._fetch_coalesced(key, tmdb_id, append_to_response)
+
+        threading.Thread(target=refresh, name=f"tmdb-refresh-{tmdb_id}", daemon=True).start()
+
+
+tmdb_cache = TMDBCache()
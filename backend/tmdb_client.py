@@ -0,0 +1,191 @@
+"""Shared TMDB API client for the enrichment scripts (load_data.py,
+update_posters.py).
+
+- one pooled requests.Session, so connections are reused
+- a token bucket shared by all threads keeps the request rate under
+  TMDB_RATE_LIMIT per second; a 429 pauses the bucket for Retry-After
+- fetch_many() runs lookups on a bounded thread pool, so enrichment runs
+  at the rate limit rather than one round-trip at a time
+
+TMDB_BASE_URL points the client elsewhere, e.g. at tmdb_stub.py for
+local runs.
+"""
+import os
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+
+TMDB_BASE_URL = os.environ.get('TMDB_BASE_URL', 'https://api.themoviedb.org/3')
+POSTER_BASE_URL = 'https://image.tmdb.org/t/p/w500'
+RATE_LIMIT = float(os.environ.get('TMDB_RATE_LIMIT', 40))
+CONCURRENCY = int(os.environ.get('TMDB_CONCURRENCY', 8))
+MAX_RETRIES = 3
+
+
+class TMDBError(Exception):
+    """A lookup failed after retries (as opposed to TMDB not knowing the movie)."""
+
+
+def tmdb_api_key():
+    """TMDB_API_KEY, falling back to VITE_TMDB_API_KEY in ../frontend/.env."""
+    api_key = os.environ.get('TMDB_API_KEY')
+    if not api_key:
+        try:
+            with open('../frontend/.env', 'r') as f:
+                for line in f:
+                    if 'VITE_TMDB_API_KEY' in line:
+                        api_key = line.split('=')[1].strip()
+                        break
+        except OSError:
+            pass
+    return api_key
+
+
+def parse_details(data):
+    """(poster_url, release_year, top-5 actors) from a movie details
+    response fetched with append_to_response=credits."""
+    poster = data.get('poster_path')
+    poster_url = f"{POSTER_BASE_URL}{poster}" if poster else None
+    release_date = data.get('release_date') or ''
+    year = int(release_date[:4]) if release_date[:4].isdigit() else None
+    actors = [actor['name'] for actor in data.get('credits', {}).get('cast', [])[:5]]
+    return poster_url, year, actors
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to
+    `capacity`. The default capacity of 1 spaces requests evenly, which
+    keeps a fixed-window limit on the server side from ever seeing a burst."""
+
+    def __init__(self, rate, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Hold every caller for `seconds` (after a 429) and drop saved-up burst."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._updated = self._paused_until
+
+
+def _retry_after(response, default=1.0):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class TMDBClient:
+    def __init__(self, api_key=None, base_url=None, rate_limit=None, concurrency=None,
+                 max_retries=MAX_RETRIES, timeout=5):
+        self.api_key = api_key or tmdb_api_key()
+        self.base_url = (base_url or TMDB_BASE_URL).rstrip('/')
+        self.concurrency = concurrency or CONCURRENCY
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_limit or RATE_LIMIT)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get_movie(self, tmdb_id, append_to_response=('credits',)):
+        """Movie details JSON, or None if TMDB has no such movie. Raises
+        TMDBError once retries for 429s, 5xx and network errors run out."""
+        params = {'api_key': self.api_key}
+        if append_to_response:
+            params['append_to_response'] = ','.join(append_to_response)
+        url = f"{self.base_url}/movie/{int(tmdb_id)}"
+
+        for attempt in range(self.max_retries + 1):
+            backoff = min(2 ** attempt, 30)
+            self.bucket.acquire()
+            self._count('requests')
+            try:
+                res = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                self._count('errors')
+                last_error = str(e)
+                time.sleep(backoff)
+                continue
+            if res.status_code == 200:
+                return res.json()
+            if res.status_code == 404:
+                return None
+            last_error = f"HTTP {res.status_code}"
+            if res.status_code == 429:
+                self._count('throttled')
+                self.bucket.pause(_retry_after(res, default=backoff))
+            elif res.status_code >= 500:
+                self._count('errors')
+                time.sleep(backoff)
+            else:
+                break
+        raise TMDBError(f"TMDB movie {tmdb_id}: {last_error}")
+
+    def fetch_many(self, items, append_to_response=('credits',)):
+        """Fetch details for (key, tmdb_id) pairs on a bounded thread pool.
+
+        Yields (key, data, error) as lookups finish, in completion order:
+        data is the response JSON or None, error a message when the lookup
+        failed. At most 2 x concurrency lookups are queued at a time, so
+        items can be a lazy iterator over a large catalog."""
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pending = {}
+
+            def submit_next():
+                for key, tmdb_id in items:
+                    pending[pool.submit(self.get_movie, tmdb_id, append_to_response)] = key
+                    return True
+                return False
+
+            while len(pending) < 2 * self.concurrency and submit_next():
+                pass
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    try:
+                        data, error = future.result(), None
+                    except Exception as e:
+                        data, error = None, str(e)
+                    yield key, data, error
+                    submit_next()
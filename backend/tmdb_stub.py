@@ -0,0 +1,122 @@
+"""Local stand-in for the TMDB API, for exercising the enrichment pipeline
+without network access or an API key.
+
+Serves GET /3/movie/<tmdb_id> with deterministic fake details (poster,
+release date, credits, videos, release_dates). It can add latency, return
+404 for a share of ids, and enforce a rate limit with 429 + Retry-After
+the way TMDB does.
+
+Usage:
+    python tmdb_stub.py --port 8765 --latency-ms 150 --rate-limit 40
+    TMDB_BASE_URL=http://127.0.0.1:8765/3 TMDB_API_KEY=stub python update_posters.py
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOVIE_PATH = re.compile(r'^/3/movie/(\d+)(?:\?.*)?$')
+
+
+def fake_movie(tmdb_id):
+    year = 1950 + tmdb_id % 70
+    return {
+        'id': tmdb_id,
+        'title': f"Stub Movie {tmdb_id}",
+        'overview': f"Overview of stub movie {tmdb_id}.",
+        'tagline': 'A stub tagline.',
+        'runtime': 80 + tmdb_id % 60,
+        'poster_path': f"/stub{tmdb_id}.jpg",
+        'backdrop_path': f"/stub{tmdb_id}_backdrop.jpg",
+        'release_date': f"{year}-01-01",
+        'credits': {'cast': [{'name': f"Actor {(tmdb_id * 7 + i) % 500}"} for i in range(8)]},
+        'videos': {'results': [{'type': 'Trailer', 'site': 'YouTube', 'key': f"stub{tmdb_id}"}]},
+        'release_dates': {'results': [{'iso_3166_1': 'US', 'release_dates': [{'certification': 'PG-13'}]}]}
+    }
+
+
+class StubState:
+    def __init__(self, latency, rate_limit, missing_every):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.missing_every = missing_every
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.served = 0
+        self.throttled = 0
+
+    def allow(self):
+        """Fixed one-second window limiter; returns seconds to wait, or 0."""
+        if not self.rate_limit:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start, self.window_count = now, 0
+            if self.window_count >= self.rate_limit:
+                self.throttled += 1
+                return max(1, int(self.window_start + 1 - now + 0.999))
+            self.window_count += 1
+            return 0
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            match = MOVIE_PATH.match(self.path)
+            if not match:
+                return self._send(404, {'status_message': 'Not found'})
+            retry_after = state.allow()
+            if retry_after:
+                return self._send(429, {'status_message': 'Rate limited'}, {'Retry-After': str(retry_after)})
+            time.sleep(state.latency)
+            tmdb_id = int(match.group(1))
+            if state.missing_every and tmdb_id % state.missing_every == 0:
+                return self._send(404, {'status_message': 'The resource you requested could not be found.'})
+            with state.lock:
+                state.served += 1
+            self._send(200, fake_movie(tmdb_id))
+
+        def _send(self, status, body, headers=None):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=150, help='simulated upstream latency')
+    parser.add_argument('--rate-limit', type=int, default=40, help='requests per second before 429 (0 = off)')
+    parser.add_argument('--missing-every', type=int, default=0, help='404 for tmdb ids divisible by N')
+    args = parser.parse_args()
+
+    state = StubState(args.latency_ms / 1000, args.rate_limit, args.missing_every)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(state))
+    print(f"TMDB stub on http://127.0.0.1:{args.port}/3 (latency {args.latency_ms:g} ms, "
+          f"rate limit {args.rate_limit or 'off'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served {state.served} movies, throttled {state.throttled} requests")
+
+
+if __name__ == "__main__":
+    main()
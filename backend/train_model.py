@@ -1,24 +1,79 @@
 import os
 import sys
-import pickle
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from sklearn.decomposition import TruncatedSVD
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 from sklearn.model_selection import train_test_split
 from app import create_app
 from models import Rating, Movie, db
+from ann import IVFIndex
+from artifact import publish_artifact
+from ranking import neighbor_table, normalize_rows
 
 sys.path.append(os.getcwd())
 
-MODEL_PATH = 'model.pkl'
+MODEL_PATH = 'model'
+N_NEIGHBORS = 50
+ANN_MIN_ITEMS = int(os.environ.get('ANN_MIN_ITEMS', 20000))
+# SVD rank; tune_model.py reports accuracy against serving cost per rank
+N_COMPONENTS = int(os.environ.get('N_COMPONENTS', 20))
+
+@contextmanager
+def stage(name):
+    """Report wall time and peak traced allocations of a training stage."""
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    # ru_maxrss is KiB on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"[stage] {name}: {elapsed:.2f}s, peak traced {peak / 2**20:.1f} MB, max RSS {max_rss:.0f} MB")
+
+def build_matrix(df, values):
+    """Build a users x movies CSR matrix straight from integer-coded ids.
+
+    Returns (matrix, user_ids, movie_ids) where user_ids/movie_ids are the
+    sorted ids behind each row/column. Only observed ratings are stored;
+    everything else is an implicit zero, as with pivot_table(...).fillna(0).
+    """
+    user_codes, user_ids = pd.factorize(df['user_id'], sort=True)
+    movie_codes, movie_ids = pd.factorize(df['movie_id'], sort=True)
+    matrix = sparse.csr_matrix(
+        (df[values].to_numpy(dtype=np.float64), (user_codes, movie_codes)),
+        shape=(len(user_ids), len(movie_ids))
+    )
+    return matrix, user_ids, movie_ids
+
+def predict_pairs(user_factors, item_factors, u_idx, m_idx, chunk_size=100_000):
+    """Centered predictions for (user, movie) position pairs.
+
+    Row-wise dot product of the gathered user and item factors, done in
+    chunks so memory stays bounded by chunk_size x n_components.
+    """
+    preds = np.empty(len(u_idx), dtype=np.float64)
+    for start in range(0, len(u_idx), chunk_size):
+        stop = start + chunk_size
+        preds[start:stop] = np.einsum(
+            'ij,ij->i', user_factors[u_idx[start:stop]], item_factors[m_idx[start:stop]]
+        )
+    return preds
 
 def train_and_evaluate():
+    tracemalloc.start()
     app = create_app()
-    with app.app_context():
-        # Load ratings from DB
+    # Ratings written after this point are folded in at serving time
+    ratings_as_of = int(time.time())
+    with stage("load ratings"), app.app_context():
+        # Load ratings from DB (only the columns training needs)
         print("Loading ratings from database...")
-        query = Rating.query.statement
+        query = db.session.query(Rating.user_id, Rating.movie_id, Rating.rating).statement
         df = pd.read_sql(query, db.engine)
     
     print(f"Loaded {len(df)} ratings.")
@@ -46,63 +101,41 @@ def train_and_evaluate():
     
     # Subtract mean
     train_df = train_df.copy()
-    train_df['rating_centered'] = train_df.apply(
-        lambda row: row['rating'] - user_means.get(row['user_id'], global_mean), axis=1
-    )
+    train_df['rating_centered'] = train_df['rating'] - train_df.groupby('user_id')['rating'].transform('mean')
     
     # Create Matrix
-    train_matrix = train_df.pivot_table(index='user_id', columns='movie_id', values='rating_centered').fillna(0)
+    with stage("build train matrix"):
+        train_matrix, user_ids, movie_ids = build_matrix(train_df, 'rating_centered')
+    print(f"Train matrix: {train_matrix.shape[0]} users x {train_matrix.shape[1]} movies, {train_matrix.nnz} ratings")
     
     # SVD
-    n_components = 20
+    n_components = N_COMPONENTS
     print(f"Training TruncatedSVD with n_components={n_components}...")
-    svd = TruncatedSVD(n_components=n_components, random_state=42)
-    matrix_reduced = svd.fit_transform(train_matrix) # U * Sigma
-    
-    # Reconstruct: U * Sigma * Vt
-    # Predicted_Centered = U * S * Vt
-    matrix_reconstructed = np.dot(matrix_reduced, svd.components_)
-    
-    # Map back to Dataframe structure
-    # We need to map indices back to IDs
-    user_ids = train_matrix.index
-    movie_ids = train_matrix.columns
-    
-    user_map = {uid: i for i, uid in enumerate(user_ids)}
-    movie_map = {mid: i for i, mid in enumerate(movie_ids)}
-    
-    y_pred_svd = []
-    y_true_svd = []
-    
-    hits = 0
-    misses = 0
-    
-    for _, row in test_df.iterrows():
-        uid = row['user_id']
-        mid = row['movie_id']
-        
-        if uid in user_map and mid in movie_map:
-            u_idx = user_map[uid]
-            m_idx = movie_map[mid]
-            
-            # Predict centered rating
-            pred_centered = matrix_reconstructed[u_idx, m_idx]
-            
-            # Add mean back
-            user_mean = user_means.get(uid, global_mean)
-            pred_rating = pred_centered + user_mean
-            
-            # Clip to range
-            pred_rating = max(0.5, min(5.0, pred_rating))
-            
-            y_pred_svd.append(pred_rating)
-            y_true_svd.append(row['rating'])
-            hits += 1
-        else:
-            misses += 1
-    
+    with stage("fit train SVD"):
+        svd = TruncatedSVD(n_components=n_components, random_state=42)
+        matrix_reduced = svd.fit_transform(train_matrix) # U * Sigma
+    
+    with stage('evaluate'):
+        # Map test ids to matrix positions (-1 when unseen in training)
+        u_idx = user_ids.get_indexer(test_df['user_id'])
+        m_idx = movie_ids.get_indexer(test_df['movie_id'])
+        known = (u_idx >= 0) & (m_idx >= 0)
+        u_idx, m_idx = u_idx[known], m_idx[known]
+
+        # Predicted_Centered = (U * S)[u] . Vt[:, m], scored only for the test
+        # pairs instead of reconstructing the full users x movies matrix.
+        # Add the user mean back and clip to the rating range.
+        item_factors = np.ascontiguousarray(svd.components_.T)
+        train_user_means = user_means.reindex(user_ids).to_numpy()
+        pred_centered = predict_pairs(matrix_reduced, item_factors, u_idx, m_idx)
+        y_pred_svd = np.clip(pred_centered + train_user_means[u_idx], 0.5, 5.0)
+        y_true_svd = test_df['rating'].to_numpy()[known]
+
+        hits = int(known.sum())
+        misses = len(known) - hits
+
     print(f"\nSVD Evaluation on {hits} overlapping ratings (skipped {misses})...")
-    if y_true_svd:
+    if hits:
         mae_svd = mean_absolute_error(y_true_svd, y_pred_svd)
         rmse_svd = np.sqrt(mean_squared_error(y_true_svd, y_pred_svd))
         print(f"SVD MAE: {mae_svd:.4f}")
@@ -113,27 +146,52 @@ def train_and_evaluate():
     print("\nTraining final model on full dataset...")
     # Calculate means on full data
     full_user_means = df.groupby('user_id')['rating'].mean()
-    df['rating_centered'] = df.apply(lambda row: row['rating'] - full_user_means[row['user_id']], axis=1)
-    
-    full_matrix = df.pivot_table(index='user_id', columns='movie_id', values='rating_centered').fillna(0)
-    
-    svd_final = TruncatedSVD(n_components=n_components, random_state=42)
-    matrix_final = svd_final.fit_transform(full_matrix)
-    
-    model_data = {
-        'svd': svd_final,
-        'user_ids': list(full_matrix.index),
-        'movie_ids': list(full_matrix.columns),
-        'user_means': full_user_means.to_dict(),
-        'matrix_reduced': matrix_final,
-        'components': svd_final.components_,
-        'global_mean': global_mean
+    df['rating_centered'] = df['rating'] - df.groupby('user_id')['rating'].transform('mean')
+    
+    with stage("build full matrix"):
+        full_matrix, full_user_ids, full_movie_ids = build_matrix(df, 'rating_centered')
+    
+    with stage("fit final SVD"):
+        svd_final = TruncatedSVD(n_components=n_components, random_state=42)
+        matrix_final = svd_final.fit_transform(full_matrix)
+    
+    # Serving arrays: float32 factor rows, ids and means aligned with them
+    user_factors = matrix_final.astype(np.float32)
+    item_factors = np.ascontiguousarray(svd_final.components_.T, dtype=np.float32)
+    item_vectors = normalize_rows(item_factors)
+    arrays = {
+        'user_ids': np.asarray(full_user_ids, dtype=np.int64),
+        'movie_ids': np.asarray(full_movie_ids, dtype=np.int64),
+        'user_means': full_user_means.reindex(full_user_ids).to_numpy(dtype=np.float32),
+        'user_factors': user_factors,
+        'item_factors': item_factors,
+        'item_vectors': item_vectors
     }
-    
-    with open(MODEL_PATH, 'wb') as f:
-        pickle.dump(model_data, f)
-        
-    print(f"Final Model saved to {MODEL_PATH}")
+
+    # Precompute the item-item neighbor table served by /api/similar
+    print(f"\nComputing top-{N_NEIGHBORS} neighbors for {len(full_movie_ids)} movies...")
+    with stage("neighbor table"):
+        arrays['neighbor_idx'], arrays['neighbor_scores'] = neighbor_table(item_vectors, N_NEIGHBORS)
+
+    # Coarse-quantized (IVF) index for cold-start and deep similarity queries.
+    # Below ANN_MIN_ITEMS exact search is as fast, so no index is written.
+    if len(item_vectors) >= ANN_MIN_ITEMS:
+        print("\nBuilding IVF index...")
+        with stage("IVF index"):
+            ann_index = IVFIndex.build(item_vectors)
+        arrays.update(ann_index.to_arrays())
+        print(f"IVF index with {ann_index.n_lists} lists")
+
+    with stage("save model"):
+        version = publish_artifact(
+            MODEL_PATH,
+            arrays,
+            global_mean=float(global_mean),
+            n_components=n_components,
+            n_ratings=len(df),
+            ratings_as_of=ratings_as_of
+        )
+    print(f"Final Model saved to {MODEL_PATH}/{version}/ (now current)")
 
 if __name__ == "__main__":
     train_and_evaluate()
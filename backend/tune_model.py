@@ -0,0 +1,276 @@
+"""Hyperparameter sweep for the SVD model with k-fold evaluation.
+
+Crosses n_components, centering strategy and bias shrinkage over k folds of
+the ratings, one (fold, config) fit per task on a process pool, and writes
+the accuracy next to the serving cost of each config:
+- rmse / mae: held-out error, mean and std over the folds
+- fit_seconds: TruncatedSVD fit time on one fold
+- score_ms_per_user: scoring one user against the whole catalog plus the
+  top-N selection, as /api/recommend does live
+- factor_mb: float32 user_factors + item_factors + item_vectors
+
+Centering strategies (the baseline the SVD models the residual of):
+- none: global mean
+- user: global mean + user bias (what train_model.py and serving use)
+- item: global mean + item bias
+- user_item: global mean + item bias + user bias of what is left
+Shrinkage damps each bias towards zero by that many pseudo-ratings, so
+users and movies with few ratings get a baseline near the global mean;
+0 with user centering is the plain user mean. Centering none has no biases,
+so it runs once, with shrinkage 0. n_components 0 scores the baseline alone.
+
+The ratings matrix is written once as memory-mapped .npy arrays (CSR plus
+a fold label per rating) that the workers open, so no worker receives a
+pickled copy of the data.
+
+Usage:
+    python tune_model.py --folds 5 --ranks 10 20 40 80 --out tune_report
+    python tune_model.py --centering user --shrinkage 0 5 10 25 --workers 4
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+from threadpoolctl import threadpool_limits
+from app import create_app
+from models import Rating, db
+from ranking import top_k_rows
+from train_model import predict_pairs, stage
+
+sys.path.append(os.getcwd())
+
+CENTERINGS = ('none', 'user', 'item', 'user_item')
+SCORE_USERS = 256
+SCORE_TOP_N = 50
+
+# Per-worker state, set up once by _init_worker
+_data = None
+_shape = None
+
+
+def _init_worker(data_dir, shape):
+    # One BLAS thread per process: the pool already uses every core, and
+    # timings are not skewed by workers competing for threads
+    global _data, _shape
+    threadpool_limits(1)
+    _shape = shape
+    _data = {name: np.load(os.path.join(data_dir, f"{name}.npy"), mmap_mode='r')
+             for name in ('indptr', 'indices', 'data', 'fold')}
+
+
+def _biases(codes, residual, size, shrinkage):
+    """Per-code mean residual, damped by shrinkage pseudo-ratings of 0."""
+    sums = np.bincount(codes, weights=residual, minlength=size)
+    counts = np.bincount(codes, minlength=size)
+    return np.divide(sums, counts + shrinkage, out=np.zeros(size), where=counts + shrinkage > 0)
+
+
+def _baseline(rows, cols, values, shape, centering, shrinkage):
+    """Global mean, user and item biases fitted on the training ratings."""
+    global_mean = values.mean()
+    user_bias = np.zeros(shape[0])
+    item_bias = np.zeros(shape[1])
+    residual = values - global_mean
+    if centering in ('item', 'user_item'):
+        item_bias = _biases(cols, residual, shape[1], shrinkage)
+        residual = residual - item_bias[cols]
+    if centering in ('user', 'user_item'):
+        user_bias = _biases(rows, residual, shape[0], shrinkage)
+    return global_mean, user_bias, item_bias
+
+
+def _score_cost(user_factors, item_factors, rng):
+    """Milliseconds to score a user against every movie and pick the top-N."""
+    if user_factors.shape[1] == 0:
+        return 0.0
+    users = rng.choice(len(user_factors), size=min(SCORE_USERS, len(user_factors)), replace=False)
+    n = min(SCORE_TOP_N, len(item_factors))
+    start = time.perf_counter()
+    for u in users:
+        top_k_rows((user_factors[u] @ item_factors.T)[None, :], n)
+    return (time.perf_counter() - start) * 1000 / len(users)
+
+
+def _evaluate(task):
+    fold, n_components, centering, shrinkage, seed = task
+    indptr, indices, values = _data['indptr'], _data['indices'], _data['data']
+    shape = _shape
+    rows = np.repeat(np.arange(shape[0], dtype=np.int32), np.diff(indptr))
+    test = np.asarray(_data['fold']) == fold
+    train = ~test
+
+    train_rows, train_cols = rows[train], np.asarray(indices[train])
+    train_values = np.asarray(values[train], dtype=np.float64)
+    global_mean, user_bias, item_bias = _baseline(
+        train_rows, train_cols, train_values, shape, centering, shrinkage
+    )
+
+    # Like train_model.py, only users and movies seen in training are scored
+    seen_users = np.bincount(train_rows, minlength=shape[0]) > 0
+    seen_movies = np.bincount(train_cols, minlength=shape[1]) > 0
+    test_rows, test_cols = rows[test], np.asarray(indices[test])
+    known = seen_users[test_rows] & seen_movies[test_cols]
+    u_idx, m_idx = test_rows[known], test_cols[known]
+    y_true = np.asarray(values[test], dtype=np.float64)[known]
+    preds = global_mean + user_bias[u_idx] + item_bias[m_idx]
+
+    fit_seconds = 0.0
+    user_factors = np.zeros((shape[0], 0), dtype=np.float32)
+    item_factors = np.zeros((shape[1], 0), dtype=np.float32)
+    if n_components:
+        residual = train_values - global_mean - user_bias[train_rows] - item_bias[train_cols]
+        matrix = sparse.csr_matrix((residual, (train_rows, train_cols)), shape=shape)
+        start = time.perf_counter()
+        svd = TruncatedSVD(n_components=n_components, random_state=42)
+        reduced = svd.fit_transform(matrix)
+        fit_seconds = time.perf_counter() - start
+        user_factors = reduced.astype(np.float32)
+        item_factors = np.ascontiguousarray(svd.components_.T, dtype=np.float32)
+        preds = preds + predict_pairs(reduced, svd.components_.T, u_idx, m_idx)
+
+    errors = np.clip(preds, 0.5, 5.0) - y_true
+    # user_factors + item_factors + item_vectors, as train_model.py saves them
+    factor_mb = (shape[0] + 2 * shape[1]) * n_components * 4 / 2**20
+    return {
+        'fold': fold,
+        'n_components': n_components,
+        'centering': centering,
+        'shrinkage': shrinkage,
+        'rmse': float(np.sqrt(np.mean(errors ** 2))) if len(errors) else None,
+        'mae': float(np.mean(np.abs(errors))) if len(errors) else None,
+        'n_test': int(known.sum()),
+        'n_skipped': int(len(known) - known.sum()),
+        'fit_seconds': fit_seconds,
+        'score_ms_per_user': _score_cost(user_factors, item_factors, np.random.default_rng(seed + fold)),
+        'factor_mb': factor_mb,
+    }
+
+
+def _summarize(fold_results):
+    """Mean/std over the folds of one config."""
+    first = fold_results[0]
+    summary = {key: first[key] for key in ('n_components', 'centering', 'shrinkage', 'factor_mb')}
+    for key in ('rmse', 'mae', 'fit_seconds', 'score_ms_per_user'):
+        values = np.array([r[key] for r in fold_results if r[key] is not None], dtype=np.float64)
+        summary[f"{key}_mean"] = float(values.mean()) if len(values) else None
+        summary[f"{key}_std"] = float(values.std()) if len(values) else None
+    summary['n_test'] = sum(r['n_test'] for r in fold_results)
+    summary['n_skipped'] = sum(r['n_skipped'] for r in fold_results)
+    summary['folds'] = sorted(fold_results, key=lambda r: r['fold'])
+    return summary
+
+
+CSV_FIELDS = [
+    'n_components', 'centering', 'shrinkage', 'rmse_mean', 'rmse_std', 'mae_mean', 'mae_std',
+    'fit_seconds_mean', 'score_ms_per_user_mean', 'factor_mb', 'n_test', 'n_skipped'
+]
+
+
+def write_report(out, report):
+    with open(f"{out}.json", 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(f"{out}.csv", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(report['results'])
+
+
+def tune(ranks, centerings, shrinkages, folds=5, workers=None, seed=42, out='tune_report'):
+    tracemalloc.start()
+    app = create_app()
+    with stage("load ratings"), app.app_context():
+        query = db.session.query(Rating.user_id, Rating.movie_id, Rating.rating).statement
+        df = pd.read_sql(query, db.engine)
+    print(f"Loaded {len(df)} ratings.")
+
+    with stage("build matrix"):
+        # CSR arrays of the ratings, with each rating's fold in the same order
+        user_codes, user_ids = pd.factorize(df['user_id'], sort=True)
+        movie_codes, movie_ids = pd.factorize(df['movie_id'], sort=True)
+        order = np.lexsort((movie_codes, user_codes))
+        shape = (len(user_ids), len(movie_ids))
+        arrays = {
+            'indptr': np.concatenate(([0], np.cumsum(np.bincount(user_codes, minlength=shape[0])))),
+            'indices': movie_codes[order].astype(np.int32),
+            'data': df['rating'].to_numpy(dtype=np.float32)[order],
+            'fold': np.random.default_rng(seed).integers(folds, size=len(df)).astype(np.int8)[order],
+        }
+        n_ratings = len(df)
+        del df, user_codes, movie_codes, order
+
+    # TruncatedSVD needs fewer components than the smaller matrix side
+    too_large = sorted(rank for rank in set(ranks) if rank >= min(shape))
+    if too_large:
+        print(f"Skipping n_components {too_large}: the matrix is only {shape[0]} x {shape[1]}")
+    # Centering none has no biases to shrink, so it runs once (shrinkage 0)
+    tasks = [(f, rank, centering, shrinkage, seed)
+             for rank in sorted(set(ranks) - set(too_large), reverse=True)
+             for centering in dict.fromkeys(centerings)
+             for shrinkage in ([0] if centering == 'none' else sorted(set(shrinkages)))
+             for f in range(folds)]
+    workers = workers or os.cpu_count()
+
+    data_dir = tempfile.mkdtemp(prefix='tune-')
+    results = {}
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(data_dir, f"{name}.npy"), array)
+        del arrays
+        print(f"Evaluating {len(tasks) // folds} configs x {folds} folds on {workers} workers...")
+        with stage("evaluate"), Pool(workers, initializer=_init_worker, initargs=(data_dir, shape)) as pool:
+            for done, result in enumerate(pool.imap_unordered(_evaluate, tasks), 1):
+                key = (result['n_components'], result['centering'], result['shrinkage'])
+                results.setdefault(key, []).append(result)
+                if done % max(len(tasks) // 10, 1) == 0:
+                    print(f"  {done}/{len(tasks)} fits done")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    summaries = sorted((_summarize(r) for r in results.values()),
+                       key=lambda s: (s['rmse_mean'] is None, s['rmse_mean']))
+    report = {
+        'created_at': int(time.time()),
+        'n_ratings': n_ratings,
+        'n_users': len(user_ids),
+        'n_movies': len(movie_ids),
+        'folds': folds,
+        'seed': seed,
+        'workers': workers,
+        'best': {key: summaries[0][key] for key in ('n_components', 'centering', 'shrinkage')} if summaries else None,
+        'results': summaries,
+    }
+    write_report(out, report)
+
+    print(f"\n{'rank':>5} {'centering':<10} {'shrink':>6} {'RMSE':>14} {'MAE':>7} "
+          f"{'fit s':>7} {'score ms':>9} {'factors MB':>11}")
+    for s in summaries:
+        rmse = f"{s['rmse_mean']:.4f}±{s['rmse_std']:.4f}" if s['rmse_mean'] is not None else '-'
+        mae = f"{s['mae_mean']:.4f}" if s['mae_mean'] is not None else '-'
+        print(f"{s['n_components']:>5} {s['centering']:<10} {s['shrinkage']:>6g} {rmse:>14} {mae:>7} "
+              f"{s['fit_seconds_mean']:>7.2f} {s['score_ms_per_user_mean']:>9.3f} {s['factor_mb']:>11.1f}")
+    print(f"\nReport written to {out}.json and {out}.csv")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ranks', type=int, nargs='+', default=[0, 10, 20, 40, 80], help='n_components values')
+    parser.add_argument('--centering', nargs='+', default=['user', 'user_item'], choices=CENTERINGS)
+    parser.add_argument('--shrinkage', type=float, nargs='+', default=[0, 10], help='bias shrinkage values')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None, help='pool size (default: CPU count)')
+    parser.add_argument('--seed', type=int, default=42, help='fold assignment seed')
+    parser.add_argument('--out', default='tune_report', help='report path without extension')
+    args = parser.parse_args()
+    tune(args.ranks, args.centering, args.shrinkage, folds=args.folds, workers=args.workers,
+         seed=args.seed, out=args.out)
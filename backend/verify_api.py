@@ -52,5 +52,22 @@ def test_endpoints():
     except Exception as e:
         print(f"Error: {e}")
 
+    # 4. Rating with a string movie_id (as some clients send it) must not
+    # corrupt the in-memory popularity ranking
+    try:
+        print("\nPOST /rate with movie_id as a string")
+        r = requests.post(f"{BASE_URL}/rate", json={'user_id': 1, 'movie_id': "1", 'rating': 4.5})
+        if r.status_code == 200:
+            popular = requests.get(f"{BASE_URL}/popular?sort=trending").json()
+            ids = [m['movie_id'] for m in popular]
+            if all(isinstance(mid, int) for mid in ids) and len(ids) == len(set(ids)):
+                print("Success!")
+            else:
+                print(f"Failed: popularity ranking corrupted: {ids}")
+        else:
+            print(f"Failed: {r.status_code} - {r.text}")
+    except Exception as e:
+        print(f"Error: {e}")
+
 if __name__ == "__main__":
     test_endpoints()
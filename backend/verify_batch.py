@@ -0,0 +1,58 @@
+"""Check that one user whose cold-start lookup fails does not fail the
+whole POST /api/recommend/batch: that user gets popular movies instead.
+
+Runs against DATABASE_URL and the model/ in the current directory, and
+rates one movie each for two new users.
+
+Usage: python verify_batch.py
+"""
+from app import app
+from recommender import recommender
+
+
+def test_batch_cold_start_error():
+    client = app.test_client()
+    model = recommender.model
+    if model is None:
+        print("Failed: no model loaded (run train_model.py first)")
+        return False
+
+    # Two new users with a single rating each take the cold-start path
+    trained_user = int(model.user_ids[0])
+    good_user, bad_user = int(model.user_ids[-1]) + 1000, int(model.user_ids[-1]) + 1001
+    bad_movie = int(model.movie_ids[1])
+    for user_id, movie_id in ((good_user, int(model.movie_ids[0])), (bad_user, bad_movie)):
+        r = client.post('/api/rate', json={'user_id': user_id, 'movie_id': movie_id, 'rating': 5})
+        if r.status_code != 200:
+            print(f"Failed: POST /rate {r.status_code} - {r.text}")
+            return False
+
+    # Make the cold-start lookup blow up for bad_user's ratings only
+    cold_start_items = recommender._cold_start_items
+
+    def failing_cold_start_items(model, ratings, n):
+        if any(mid == bad_movie for mid, _ in ratings):
+            raise ValueError("simulated cold-start failure")
+        return cold_start_items(model, ratings, n)
+
+    recommender._cold_start_items = failing_cold_start_items
+    try:
+        r = client.post('/api/recommend/batch', json={'user_ids': [trained_user, good_user, bad_user], 'n': 5})
+    finally:
+        del recommender._cold_start_items
+
+    if r.status_code != 200:
+        print(f"Failed: {r.status_code} - {r.text}")
+        return False
+    types = {result['user_id']: result['type'] for result in r.get_json()['results']}
+    expected = {trained_user: 'personalized', good_user: 'similar', bad_user: 'popular'}
+    if types == expected:
+        print("Success!")
+        return True
+    print(f"Failed: got types {types}, expected {expected}")
+    return False
+
+
+if __name__ == "__main__":
+    print("\nPOST /recommend/batch with a failing cold-start user")
+    test_batch_cold_start_error()